@@ -0,0 +1,88 @@
+"""
+Inuit Chatbot - Funnel Admin
+Built with Python & Streamlit
+
+Run:
+streamlit run admin.py
+
+Live reach and conversion numbers for every step of the journey, across
+all sessions of every server process. The pages count funnel events as
+they happen and merge them into .cache/funnel.db every few seconds; this
+page only reads those totals.
+"""
+
+import time
+
+import streamlit as st
+from pathlib import Path
+
+from inuit.flow import load_flow
+from inuit.funnel import choice_table, funnel_table, load_totals
+
+# Page configuration
+st.set_page_config(
+    page_title="Inuit Funnel",
+    page_icon="📈",
+    layout="wide"
+)
+
+FLOW_PATH = Path(__file__).parent / 'flows' / 'inuit.json'
+FUNNEL_DB = Path(__file__).parent / '.cache' / 'funnel.db'
+
+@st.cache_resource
+def get_flow():
+    """Compiled conversation flow shared by every session"""
+    return load_flow(FLOW_PATH)
+
+FLOW = get_flow()
+
+# Header
+st.title("📈 Conversation Funnel")
+col_caption, col_refresh = st.columns([5, 1])
+with col_refresh:
+    st.button("🔄 Refresh", use_container_width=True)
+with col_caption:
+    st.caption(f"Totals across every server process, merged every few seconds · read at {time.strftime('%H:%M:%S')}")
+
+totals = load_totals(FUNNEL_DB)
+if not totals:
+    st.info("No conversations have been counted yet.", icon="💡")
+    st.stop()
+
+rows = funnel_table(FLOW, totals)
+started, completed = rows[0]['reached'], rows[-1]['reached']
+
+# Headline numbers
+col1, col2, col3 = st.columns(3)
+col1.metric("Conversations", f"{started:,}")
+col2.metric(f"Reached {FLOW.journey[-1]}", f"{completed:,}")
+col3.metric("Completion rate", f"{completed / started:.1%}" if started else "–")
+
+# Reach and conversion by step
+st.markdown("### 📊 Reach by Step")
+st.dataframe(
+    rows,
+    hide_index=True,
+    use_container_width=True,
+    column_config={
+        'step': "Step",
+        'reached': st.column_config.NumberColumn("Conversations", help="Conversations that reached the step"),
+        'entries': st.column_config.NumberColumn("Entries", help="Times the step was shown, repeats included"),
+        'step_conversion': st.column_config.ProgressColumn(
+            "From previous step", min_value=0, max_value=1, format="%.2f"),
+        'overall_conversion': st.column_config.ProgressColumn(
+            "From start", min_value=0, max_value=1, format="%.2f"),
+        'fallbacks': st.column_config.NumberColumn("Fallbacks", help="Typed messages that matched no option"),
+    },
+)
+
+# What shoppers chose
+st.markdown("### 📝 Choices")
+recorded = [step_id for step_id in FLOW.journey if FLOW.steps[step_id].get('records')]
+for column, step_id in zip(st.columns(len(recorded)), recorded):
+    with column:
+        st.markdown(f"**{FLOW.steps[step_id]['records'].replace('_', ' ').title()}**")
+        st.dataframe(choice_table(totals, step_id), hide_index=True, use_container_width=True)
+
+other = st.selectbox("Choices on another step", [step_id for step_id in FLOW.steps if step_id not in recorded])
+st.dataframe(choice_table(totals, other), hide_index=True, use_container_width=True)
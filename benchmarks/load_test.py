@@ -0,0 +1,273 @@
+"""
+Concurrent-session load test for intuitbot.py and chatbot.py
+
+Drives simulated shoppers through the journey with streamlit.testing's
+AppTest and records, for every rerun, the wall time, how many script runs
+the click caused and how many bytes of ForwardMsgs the app sent. Latency
+is reported per step (the step the rerun landed on) as p50/p95/p99.
+
+AppTest swaps a process-wide mock runtime in for each run, so runs within
+one process cannot overlap. Concurrency therefore comes from two places:
+each worker process interleaves its sessions click by click, sharing the
+app's cached resources the way sessions of one server process do, and
+several worker processes compete for the CPU at once.
+
+    python benchmarks/load_test.py --app intuitbot.py --sessions 40 --workers 4
+    python benchmarks/load_test.py --app chatbot.py --baseline benchmarks/results/old.json
+
+Results are written as JSON (default: benchmarks/results/<app>-<time>.json).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# Buttons that move a shopper along the journey, by the step on screen
+ADVANCE_KEYS = {
+    'welcome': r'quick_1',
+    'intro': r'btn_\d+',
+    'occasion': r'btn_\d+',
+    'size': r'quick_\d+',
+    'recommendations': r'prod_(view_|cart_)?\d+',
+    'videos': r'done_videos|skip_videos|vid_\d+',
+    'order': r'btn_0',
+}
+MAX_CLICKS = 30
+PERCENTILES = (50, 95, 99)
+
+_RUNS = []
+_MANAGERS = []
+_GOAL = None
+
+
+def _record_runs():
+    """Make every AppTest run report its script runs and bytes sent"""
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    run = LocalScriptRunner.run
+
+    def counted_run(self, *args, **kwargs):
+        tree = run(self, *args, **kwargs)
+        reruns = sum(1 for event in self.events if event == ScriptRunnerEvent.SCRIPT_STARTED)
+        sent = sum(
+            data['forward_msg'].ByteSize()
+            for event, data in zip(self.events, self.event_data)
+            if event == ScriptRunnerEvent.ENQUEUE_FORWARD_MSG
+        )
+        _RUNS.append((reruns, sent))
+        return tree
+
+    LocalScriptRunner.run = counted_run
+
+
+def _track_sessions():
+    """Keep hold of the apps' session managers so conversations can be inspected"""
+    from inuit.sessions import SessionManager
+
+    init = SessionManager.__init__
+
+    def tracked_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        _MANAGERS.append(self)
+
+    SessionManager.__init__ = tracked_init
+
+
+class Session:
+    """One simulated shopper driving its own AppTest"""
+
+    def __init__(self, app, rng, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(str(ROOT / app), default_timeout=timeout)
+        self.rng = rng
+        self.loaded = False
+        self.clicks = 0
+        self.done = False
+
+    def step(self):
+        session_id = self.at.session_state.session_id
+        for manager in _MANAGERS:
+            conversation = manager.get(session_id)
+            if conversation is not None:
+                return conversation['current_step']
+        raise RuntimeError(f"no conversation for session {session_id}")
+
+    def advance(self, samples):
+        """Make the next move (the first load, then one click) and time it"""
+        if not self.loaded:
+            action = self.at.run
+            self.loaded = True
+        else:
+            on_screen = self.step()
+            pattern = re.compile(ADVANCE_KEYS.get(on_screen, r'$^'))
+            keys = [button.key for button in self.at.button if button.key and pattern.fullmatch(button.key)]
+            if not keys or self.clicks >= MAX_CLICKS:
+                raise RuntimeError(f"session stuck at step {on_screen!r} after {self.clicks} clicks")
+            action = self.at.button(key=self.rng.choice(keys)).click().run
+            self.clicks += 1
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+        reruns, sent = _RUNS.pop()
+        step = self.step()
+        samples.append((step, elapsed, reruns, sent, self.clicks > 0))
+        self.done = step == _GOAL
+
+
+def _init_worker():
+    global _GOAL
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+    _record_runs()
+    _track_sessions()
+    from inuit.flow import load_flow
+    _GOAL = load_flow(ROOT / 'flows' / 'inuit.json').journey[-1]
+
+
+def _run_worker(app, sessions, warmup, seed, timeout):
+    """Interleave sessions click by click; returns their samples"""
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        session = Session(app, rng, timeout)
+        while not session.done:
+            session.advance([])
+    samples = []
+    active = [Session(app, rng, timeout) for _ in range(sessions)]
+    while active:
+        for session in active:
+            session.advance(samples)
+        active = [session for session in active if not session.done]
+    return samples
+
+
+def percentiles(values, scale=1):
+    """p50/p95/p99 and mean of values, multiplied by scale"""
+    values = np.asarray(values, dtype=np.float64) * scale
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+    summary['mean'] = round(float(values.mean()), 3)
+    return summary
+
+
+def summarize(samples):
+    """Per-step and overall statistics from (step, seconds, reruns, bytes, is_click) samples"""
+    by_step = {}
+    for step, elapsed, _, sent, _ in samples:
+        entry = by_step.setdefault(step, ([], []))
+        entry[0].append(elapsed)
+        entry[1].append(sent)
+    clicks = [sample for sample in samples if sample[4]]
+    return {
+        'steps': {
+            step: {'reruns': len(times), 'latency_ms': percentiles(times, 1000), 'bytes': percentiles(sent)}
+            for step, (times, sent) in by_step.items()
+        },
+        'latency_ms': percentiles([sample[1] for sample in samples], 1000),
+        'bytes_per_rerun': percentiles([sample[3] / sample[2] for sample in samples]),
+        'reruns_per_click': percentiles([sample[2] for sample in clicks]) if clicks else None,
+        'clicks': len(clicks),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_test(app, sessions, workers, warmup=1, seed=0, timeout=30):
+    """Run the load test and return the report dict"""
+    import streamlit
+
+    shares = [sessions // workers + (i < sessions % workers) for i in range(workers)]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [
+            pool.submit(_run_worker, app, share, warmup, seed + i, timeout)
+            for i, share in enumerate(shares) if share
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - started
+    return {
+        'app': app,
+        'sessions': sessions,
+        'workers': workers,
+        'seed': seed,
+        'revision': _git_revision(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'streamlit': streamlit.__version__,
+        'delay_mode': os.environ.get('INUIT_DELAY_MODE', 'client'),
+        'seconds': round(elapsed, 3),
+        **summarize(samples),
+    }
+
+
+def compare(report, baseline):
+    """Lines describing how report's latency and bytes moved against baseline"""
+    lines = []
+    for step, stats in report['steps'].items():
+        old = baseline.get('steps', {}).get(step)
+        if not old:
+            continue
+        for metric in ('latency_ms', 'bytes'):
+            before, after = old[metric]['p95'], stats[metric]['p95']
+            change = (after - before) / before * 100 if before else 0.0
+            lines.append(f"{step:16} {metric:10} p95 {before:>10} -> {after:>10} ({change:+.1f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test built on AppTest")
+    parser.add_argument('--app', default='intuitbot.py', choices=('intuitbot.py', 'chatbot.py'))
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--warmup', type=int, default=1, help="untimed sessions per worker before measuring")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help="where to write the JSON report")
+    parser.add_argument('--baseline', help="earlier JSON report to compare p95s against")
+    args = parser.parse_args(argv)
+
+    report = load_test(args.app, args.sessions, args.workers, args.warmup, args.seed, args.timeout)
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{Path(args.app).stem}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    print(f"{report['app']}: {report['sessions']} sessions, {report['clicks']} clicks in {report['seconds']}s")
+    print(f"{'step':16} {'reruns':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bytes p50':>10}")
+    for step, stats in report['steps'].items():
+        latency = stats['latency_ms']
+        print(f"{step:16} {stats['reruns']:>6} {latency['p50']:>8} {latency['p95']:>8} "
+              f"{latency['p99']:>8} {stats['bytes']['p50']:>10}")
+    print(f"reruns per click: {report['reruns_per_click']}")
+    print(f"bytes per rerun:  {report['bytes_per_rerun']}")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        print('\n'.join(compare(report, baseline)))
+    print(f"report written to {output}")
+
+
+if __name__ == '__main__':
+    main()
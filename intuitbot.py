@@ -18,8 +18,18 @@ Features:
 """
 
 import streamlit as st
-from datetime import datetime
-import time
+
+from inuit import metrics
+from inuit.app import (
+    HANDOFF_POLL_SECONDS, display_message, get_broker, get_content, get_engine, get_flow, get_fulfilment,
+    get_thumbnails, init_session, job_status, leave_handoff, load_conversation, receive_handoff,
+    reset_conversation, save_conversation, send_text, show_theme, start_services, step_videos,
+)
+from inuit.delay import hold_until, thinking_delay
+from inuit.fragments import PageFragments
+from inuit.handoff import WAITING
+from inuit.messages import BOT, USER
+from inuit.rendering import MessageRenderer
 
 # ========== PAGE CONFIGURATION ==========
 st.set_page_config(
@@ -30,314 +40,61 @@ st.set_page_config(
 )
 
 # ========== CUSTOM STYLING ==========
-st.markdown("""
-<style>
-    /* Main background */
-    .main {
-        background: linear-gradient(135deg, #1e293b 0%, #334155 50%, #1e293b 100%);
-    }
-    
-    /* Hide Streamlit branding */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    
-    /* Button styling */
-    .stButton>button {
-        width: 100%;
-        background: linear-gradient(90deg, #d97706 0%, #b45309 100%);
-        color: white;
-        border: none;
-        padding: 14px 20px;
-        border-radius: 10px;
-        font-weight: 600;
-        font-size: 15px;
-        transition: all 0.3s;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-    }
-    .stButton>button:hover {
-        background: linear-gradient(90deg, #b45309 0%, #92400e 100%);
-        transform: translateY(-2px);
-        box-shadow: 0 6px 12px rgba(0,0,0,0.2);
-    }
-    
-    /* Chat messages */
-    .chat-message {
-        padding: 1.2rem;
-        border-radius: 15px;
-        margin-bottom: 1rem;
-        display: flex;
-        gap: 1rem;
-        animation: slideIn 0.3s ease-out;
-    }
-    @keyframes slideIn {
-        from {opacity: 0; transform: translateY(10px);}
-        to {opacity: 1; transform: translateY(0);}
-    }
-    .bot-message {
-        background-color: white;
-        border: 2px solid #e2e8f0;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.05);
-    }
-    .user-message {
-        background: linear-gradient(90deg, #d97706 0%, #b45309 100%);
-        color: white;
-        flex-direction: row-reverse;
-        box-shadow: 0 2px 8px rgba(217,119,6,0.3);
-    }
-    
-    /* Avatar styling */
-    .avatar {
-        width: 45px;
-        height: 45px;
-        border-radius: 50%;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-size: 22px;
-        flex-shrink: 0;
-        box-shadow: 0 2px 6px rgba(0,0,0,0.1);
-    }
-    .bot-avatar {
-        background: linear-gradient(135deg, #fef3c7 0%, #fde68a 100%);
-    }
-    .user-avatar {
-        background: linear-gradient(135deg, #334155 0%, #1e293b 100%);
-    }
-    
-    /* Product cards */
-    .product-card {
-        background: linear-gradient(135deg, #ffffff 0%, #f8fafc 100%);
-        padding: 1.2rem;
-        border-radius: 12px;
-        border: 2px solid #e2e8f0;
-        margin: 10px 0;
-        transition: all 0.3s;
-    }
-    .product-card:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 8px 16px rgba(0,0,0,0.1);
-        border-color: #d97706;
-    }
-    
-    /* Progress steps */
-    .progress-step {
-        padding: 14px;
-        border-radius: 10px;
-        margin-bottom: 10px;
-        transition: all 0.3s;
-        cursor: pointer;
-    }
-    .progress-step:hover {
-        transform: translateX(5px);
-    }
-    
-    /* Input styling */
-    .stTextInput>div>div>input {
-        border-radius: 10px;
-        border: 2px solid #cbd5e1;
-        padding: 12px;
-        font-size: 15px;
-    }
-    .stTextInput>div>div>input:focus {
-        border-color: #d97706;
-        box-shadow: 0 0 0 3px rgba(217,119,6,0.1);
-    }
-    
-    /* Typing indicator */
-    .typing-indicator {
-        display: flex;
-        gap: 6px;
-        padding: 10px;
-    }
-    .typing-dot {
-        width: 10px;
-        height: 10px;
-        background-color: #94a3b8;
-        border-radius: 50%;
-        animation: bounce 1.4s infinite ease-in-out;
-    }
-    .typing-dot:nth-child(1) {animation-delay: -0.32s;}
-    .typing-dot:nth-child(2) {animation-delay: -0.16s;}
-    @keyframes bounce {
-        0%, 80%, 100% {transform: scale(0);}
-        40% {transform: scale(1);}
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# ========== SESSION STATE INITIALIZATION ==========
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'current_step' not in st.session_state:
-    st.session_state.current_step = 0
-if 'user_choices' not in st.session_state:
-    st.session_state.user_choices = {
-        'shoe_type': '',
-        'occasion': '',
-        'size': ''
-    }
-if 'initialized' not in st.session_state:
-    st.session_state.initialized = False
-if 'show_typing' not in st.session_state:
-    st.session_state.show_typing = False
-if 'playing_video' not in st.session_state:
-    st.session_state.playing_video = None
+# Compiled once per process from themes/intuitbot.css
+show_theme('intuitbot')
 
 # ========== CONVERSATION FLOW ==========
-STEPS = [
-    {
-        'id': 'welcome',
-        'message': "Welcome to Inuit! 👋\n\nWe craft luxury footwear that blends timeless elegance with uncompromising comfort. From handcrafted leather boots to sophisticated sneakers, each pair tells a story of Italian craftsmanship.",
-        'type': 'quick_replies',
-        'options': ['✨ Tell me more', '👞 Show me shoes']
-    },
-    {
-        'id': 'intro',
-        'message': "Perfect! Let's find your ideal pair. What type of shoe are you looking for today?",
-        'type': 'buttons',
-        'options': [
-            ('👞 Formal Shoes', 'formal'),
-            ('👟 Sneakers', 'sneakers'),
-            ('🥾 Boots', 'boots'),
-            ('👡 Loafers', 'loafers')
-        ]
-    },
-    {
-        'id': 'occasion',
-        'message': "Excellent choice! What occasion are you shopping for?",
-        'type': 'buttons',
-        'options': [
-            ('💼 Work/Business', 'work'),
-            ('🎉 Special Events', 'events'),
-            ('🚶 Everyday Wear', 'casual'),
-            ('🎁 Gift', 'gift')
-        ]
-    },
-    {
-        'id': 'size',
-        'message': "Great! What's your shoe size? (US sizing)",
-        'type': 'quick_replies',
-        'options': ['7-8', '9-10', '11-12', "❓ I'm not sure"]
-    },
-    {
-        'id': 'recommendations',
-        'message': "✨ Based on your preferences, here are our top recommendations:",
-        'type': 'carousel',
-        'products': [
-            {
-                'name': 'Milano Executive',
-                'price': '$450',
-                'emoji': '👞',
-                'desc': 'Italian leather, hand-stitched perfection',
-                'features': '• Full-grain leather\n• Goodyear welt\n• Italian craftsmanship'
-            },
-            {
-                'name': 'Urban Elite',
-                'price': '$380',
-                'emoji': '👟',
-                'desc': 'Premium comfort meets modern design',
-                'features': '• Memory foam insole\n• Breathable mesh\n• Lightweight construction'
-            },
-            {
-                'name': 'Heritage Classic',
-                'price': '$520',
-                'emoji': '🥾',
-                'desc': 'Timeless craftsmanship for generations',
-                'features': '• Hand-waxed leather\n• Storm welt\n• Lifetime warranty'
-            }
-        ]
-    },
-    {
-        'id': 'videos',
-        'message': "🎥 Want to see how we craft perfection?\n\nHere's a behind-the-scenes look at our workshop:",
-        'type': 'videos',
-        'videos': [
-            {
-                'title': '🔪 Leather Selection Process',
-                'duration': '2:15',
-                'description': 'See how we handpick the finest Italian leather',
-                'url': 'https://www.youtube.com/watch?v=ACFejrSb9Vg',
-                'thumbnail': 'https://img.youtube.com/vi/ACFejrSb9Vg/hqdefault.jpg'
-            },
-            {
-                'title': '✂️ Hand Stitching Craftsmanship',
-                'duration': '3:40',
-                'description': 'Watch master craftsmen at work',
-                'url': 'https://www.youtube.com/watch?v=MFDo-dtr9mk',
-                'thumbnail': 'https://img.youtube.com/vi/MFDo-dtr9mk/hqdefault.jpg'
-            },
-            {
-                'title': '✅ Quality Inspection',
-                'duration': '1:55',
-                'description': 'Our rigorous quality standards',
-                'url': 'https://www.youtube.com/watch?v=BEBGtL_Q1iE',
-                'thumbnail': 'https://img.youtube.com/vi/BEBGtL_Q1iE/hqdefault.jpg'
-            }
-        ]
-    },
-    {
-        'id': 'order',
-        'message': "🎁 Ready to experience Inuit luxury?\n\nWe offer:\n• Free worldwide shipping\n• Premium packaging\n• 30-day returns\n• Lifetime warranty",
-        'type': 'buttons',
-        'options': [
-            ('🛒 Place Order', 'order'),
-            ('💬 Chat with Expert', 'expert'),
-            ('📧 Email Details', 'email')
-        ]
-    },
-    {
-        'id': 'conclusion',
-        'message': "✨ Thank you for choosing Inuit!\n\nYour order will arrive in 5-7 business days. We'll send tracking details to your email.\n\nEnjoy your luxury footwear! 👞",
-        'type': 'quick_replies',
-        'options': ['📦 Track Order', '👞 Browse More', '🏠 Main Menu']
-    }
-]
+# Steps, options and branches live in flows/inuit.json; the resources behind
+# them are shared with chatbot.py (see inuit/app.py)
+FLOW = get_flow()
+ENGINE = get_engine(reply_delay=0.8, fallback_delay=0.5)
+start_services()
+# Video thumbnails are fetched in the background whenever the video library changes
+get_thumbnails()
+
+# What is typed in the message box also searches the catalog (see inuit/search.py).
+# A product picked from the results counts as picked from the recommendations
+# only while they are on screen; elsewhere the bot just describes it.
+SEARCH_STEP = next(step_id for step_id, step in FLOW.steps.items() if step.get('source') == 'catalog')
+SEARCH_NOTES = {
+    'view': "{emoji} {name} · {price}\n{desc}\n{features}",
+    'add': "{emoji} {name} · {price} is a great pick.\n{features}\n\nCarry on below and place your order when you reach the order step.",
+}
+
+# ========== SESSION STATE INITIALIZATION ==========
+init_session(ENGINE)
 
 # ========== HELPER FUNCTIONS ==========
 
-def add_message(sender, message, **kwargs):
-    """Add a message to chat history"""
-    st.session_state.chat_history.append({
-        'sender': sender,
-        'message': message,
-        'timestamp': datetime.now(),
-        **kwargs
-    })
-
-def display_message(msg):
-    """Display a chat message with beautiful styling"""
-    if msg['sender'] == 'bot':
-        st.markdown(f"""
+# Message markup ({message} and {time} are filled in by the renderer)
+BOT_MESSAGE_HTML = """
         <div class="chat-message bot-message">
             <div class="avatar bot-avatar">🤖</div>
             <div style="flex: 1;">
                 <div style="color: #1e293b; font-size: 15px; line-height: 1.6; white-space: pre-line;">
-                    {msg['message']}
+                    {message}
                 </div>
                 <div style="color: #94a3b8; font-size: 11px; margin-top: 8px;">
-                    {msg['timestamp'].strftime('%I:%M %p')}
+                    {time}
                 </div>
             </div>
         </div>
-        """, unsafe_allow_html=True)
-    else:
-        st.markdown(f"""
+        """
+USER_MESSAGE_HTML = """
         <div class="chat-message user-message">
             <div class="avatar user-avatar">👤</div>
             <div style="flex: 1;">
                 <div style="font-size: 15px; line-height: 1.6;">
-                    {msg['message']}
+                    {message}
                 </div>
                 <div style="color: rgba(255,255,255,0.7); font-size: 11px; margin-top: 8px;">
-                    {msg['timestamp'].strftime('%I:%M %p')}
+                    {time}
                 </div>
             </div>
         </div>
-        """, unsafe_allow_html=True)
+        """
 
-def show_typing_indicator():
-    """Display typing animation"""
-    st.markdown("""
+TYPING_HTML = """
     <div class="chat-message bot-message" style="padding: 0.8rem 1.2rem;">
         <div class="avatar bot-avatar">🤖</div>
         <div class="typing-indicator">
@@ -346,55 +103,15 @@ def show_typing_indicator():
             <div class="typing-dot"></div>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """
 
-def handle_choice(choice, display_text=None):
-    """Handle user selection and progress to next step"""
-    text = display_text if display_text else choice
-    add_message('user', text)
-    
-    # Save user choices
-    step = st.session_state.current_step
-    if step == 1:
-        st.session_state.user_choices['shoe_type'] = choice
-    elif step == 2:
-        st.session_state.user_choices['occasion'] = choice
-    elif step == 3:
-        st.session_state.user_choices['size'] = choice
-    
-    # Show typing indicator
-    st.session_state.show_typing = True
-    st.rerun()
-
-def advance_conversation():
-    """Move to next step in conversation"""
-    if st.session_state.current_step < len(STEPS) - 1:
-        time.sleep(0.8)  # Simulate bot thinking
-        st.session_state.current_step += 1
-        current_step_data = STEPS[st.session_state.current_step]
-        add_message('bot', current_step_data['message'], step_data=current_step_data)
-        st.session_state.show_typing = False
-        st.rerun()
+@st.cache_resource
+def get_renderer():
+    """Message renderer shared by every session"""
+    return MessageRenderer(BOT_MESSAGE_HTML, USER_MESSAGE_HTML)
 
-def reset_chat():
-    """Reset the entire conversation"""
-    st.session_state.chat_history = []
-    st.session_state.current_step = 0
-    st.session_state.user_choices = {'shoe_type': '', 'occasion': '', 'size': ''}
-    st.session_state.initialized = False
-    st.session_state.show_typing = False
-    st.session_state.playing_video = None
-    st.rerun()
-
-# ========== MAIN APP ==========
-
-# Initialize chat with welcome message
-if not st.session_state.initialized:
-    add_message('bot', STEPS[0]['message'], step_data=STEPS[0])
-    st.session_state.initialized = True
-
-# Header Section
-st.markdown("""
+# Page fragments: compiled once per process (see inuit/fragments.py)
+HEADER_HTML = """
 <div style='text-align: center; padding: 2rem 0 1rem 0;'>
     <h1 style='color: white; font-size: 3rem; margin-bottom: 0.5rem; 
                text-shadow: 2px 2px 4px rgba(0,0,0,0.3);'>
@@ -404,141 +121,336 @@ st.markdown("""
         Your Personal Shopping Assistant
     </p>
 </div>
-""", unsafe_allow_html=True)
+"""
 
-# Main Layout: Chat (Left) + Sidebar (Right)
-col_chat, col_sidebar = st.columns([2.5, 1])
+# {number}, {title} and the stage's icon and colours are filled in per tracker step
+TRACKER_STEP_HTML = """
+<div class="progress-step" style="background-color: {bg}; border: 2px solid {border};">
+    <div style="display: flex; align-items: center; gap: 10px;">
+        <span style="font-size: 18px;">{icon}</span>
+        <div>
+            <div style="font-weight: 600; color: #1e293b; font-size: 13px;">
+                Step {number}
+            </div>
+            <div style="font-size: 11px; color: #64748b;">
+                {title}
+            </div>
+        </div>
+    </div>
+</div>
+"""
+TRACKER_STAGES = {
+    'done': {'icon': "✅", 'bg': "#d1fae5", 'border': "#10b981"},
+    'current': {'icon': "🔵", 'bg': "#fef3c7", 'border': "#f59e0b"},
+    'todo': {'icon': "⭕", 'bg': "#f1f5f9", 'border': "#cbd5e1"},
+}
 
-# ========== CHAT SECTION ==========
-with col_chat:
-    st.markdown("### 💬 Chat with Our Assistant")
-    
-    # Chat container
-    chat_container = st.container()
-    with chat_container:
-        # Display all messages
-        for msg in st.session_state.chat_history:
-            display_message(msg)
+SELECTIONS_HTML = """
+<div style="background: white; padding: 15px; border-radius: 10px; border: 2px solid #e2e8f0;">
+    <div style="margin-bottom: 10px;">
+        <strong style="color: #1e293b;">👞 Shoe Type:</strong><br>
+        <span style="color: #64748b;">{shoe_type}</span>
+    </div>
+    <div style="margin-bottom: 10px;">
+        <strong style="color: #1e293b;">🎯 Occasion:</strong><br>
+        <span style="color: #64748b;">{occasion}</span>
+    </div>
+    <div>
+        <strong style="color: #1e293b;">📏 Size:</strong><br>
+        <span style="color: #64748b;">{size}</span>
+    </div>
+</div>
+"""
+
+FEATURES_HTML = """
+<div style="background: white; padding: 15px; border-radius: 10px; border: 2px solid #e2e8f0;">
+    <div style="margin-bottom: 8px;">
+        <strong style="color: #b45309;">🤝 Warm Service</strong><br>
+        <span style="font-size: 12px; color: #64748b;">Luxury tone with personal care</span>
+    </div>
+    <div style="margin-bottom: 8px;">
+        <strong style="color: #b45309;">🎨 Rich Experience</strong><br>
+        <span style="font-size: 12px; color: #64748b;">Interactive shopping journey</span>
+    </div>
+    <div style="margin-bottom: 8px;">
+        <strong style="color: #b45309;">🛍️ Easy Navigation</strong><br>
+        <span style="font-size: 12px; color: #64748b;">Simple, guided process</span>
+    </div>
+    <div>
+        <strong style="color: #b45309;">✅ Quality Guarantee</strong><br>
+        <span style="font-size: 12px; color: #64748b;">Premium Italian craftsmanship</span>
+    </div>
+</div>
+"""
+
+CONTACT_HTML = """
+<div style="text-align: center; padding: 10px;">
+    <div style="font-size: 12px; color: #cbd5e1;">
+        📧 support@inuit.com<br>
+        📞 1-800-INUIT-SHOES
+    </div>
+</div>
+"""
+
+@st.cache_resource
+def get_fragments():
+    """Header, panels and progress tracker markup shared by every session"""
+    return PageFragments(FLOW, TRACKER_STEP_HTML, TRACKER_STAGES, SELECTIONS_HTML, "❌ Not selected",
+                         header=HEADER_HTML, features=FEATURES_HTML, contact=CONTACT_HTML)
+
+def carousel_products(step_data, user_choices, page=0):
+    """One page of products for a carousel step, and whether another page follows"""
+    limit = step_data.get('limit', 3 if step_data.get('source') == 'catalog' else len(step_data.get('products', ())))
+    start = page * limit
+    if step_data.get('source') == 'catalog':
+        # One product past the page tells whether there is a next one
+        products = get_content().current.catalog.recommend(user_choices, k=start + limit + 1)
+    else:
+        products = step_data['products']
+    return products[start:start + limit], len(products) > start + limit
+
+def carousel_page(msg_id):
+    """The page the user has turned the carousel of message msg_id to"""
+    shown_for, page = st.session_state.get('product_page', (None, 0))
+    return page if shown_for == msg_id else 0
+
+def turn_page(msg_id, page):
+    """Show another page of a carousel; only the step widgets rerun"""
+    st.session_state.product_page = (msg_id, page)
+
+# Pending orders and emails are polled in the sidebar
+JOB_POLL_SECONDS = 2
+
+def status_pending(job_id):
+    """Whether a background job may still change state"""
+    job = get_fulfilment().status(job_id)
+    return job is not None and job['status'] not in ('done', 'failed')
+
+# How the expert chat shows in the transcript
+HANDOFF_NOTES = {
+    'joined': "🧑‍💼 {agent} from our footwear team has joined the chat.",
+    'message': "🧑‍💼 {agent}: {text}",
+    'left': "👋 {agent} has left the chat. Is there anything else I can help you with?",
+    'requeued': "⏳ {agent} was disconnected. You keep your place at the front of the queue.",
+    'busy': "😔 All our experts are busy right now. Please try again in a little while, "
+            "or choose 📧 Email Details to get everything in your inbox.",
+}
+
+def request_full_rerun():
+    """Have the whole page rerun after a callback that changes the transcript"""
+    # A callback fired inside a fragment only reruns that fragment, and
+    # st.rerun() is ignored in callbacks, so the fragment does it instead
+    st.session_state.full_rerun = True
+
+def follow_full_rerun():
+    """Rerun the whole page if a callback asked for it; called first in each fragment"""
+    if st.session_state.pop('full_rerun', False):
+        st.rerun()
+
+@metrics.timed('handle_choice')
+def handle_choice(step_id, choice, display_text=None):
+    """Handle a selection made on step_id and progress to the step it leads to"""
+    # Reply in the same script run; the browser plays the typing indicator
+    conversation = load_conversation(ENGINE)
+    next_step = ENGINE.choose(conversation, step_id, choice, display_text)
+    save_conversation(conversation)
+    prefetch_media(next_step)
+    request_full_rerun()
+
+def prefetch_media(step_id):
+    """Start fetching the thumbnails of the step that step_id warms up"""
+    # Media for a later step loads while the user answers this one
+    target = FLOW.steps[step_id].get('prefetch') if step_id is not None else None
+    if target:
+        videos = step_videos(FLOW.steps[target])
+        get_thumbnails().prefetch(video['thumbnail'] for video in videos if 'thumbnail' in video)
+
+def play_video(idx):
+    """Open the player for a video (None closes it); only the player reruns"""
+    conversation = load_conversation(ENGINE)
+    ENGINE.play_video(conversation, idx)
+    save_conversation(conversation)
+
+@metrics.timed('send_message')
+def send_message():
+    """Handle a typed message from the input box"""
+    user_input = st.session_state.user_input
+    st.session_state.user_input = ''
+    conversation = load_conversation(ENGINE)
+    # While an expert has the conversation, what is typed goes to them
+    next_step = send_text(ENGINE, conversation, user_input)
+    save_conversation(conversation)
+    prefetch_media(next_step)
+    request_full_rerun()
+
+def pick_suggestion(product, choice, text):
+    """Handle a product picked from the search results"""
+    st.session_state.user_input = ''
+    conversation = load_conversation(ENGINE)
+    step_id = ENGINE.active_step(conversation)
+    if step_id == SEARCH_STEP:
+        handle_choice(step_id, choice, text)
+        return
+    # Describe the product without leaving the step or counting a choice in the funnel
+    ENGINE.add_message(conversation, USER, text)
+    note = SEARCH_NOTES[choice.partition('_')[0]].format(**product)
+    ENGINE.add_message(conversation, BOT, note, delay=thinking_delay({}, ENGINE.reply_delay), step=step_id)
+    save_conversation(conversation)
+    request_full_rerun()
+
+def leave_expert_chat():
+    """Leave the queue or the chat with an expert"""
+    leave_handoff(ENGINE)
+    request_full_rerun()
+
+def reset_chat():
+    """Reset the entire conversation"""
+    reset_conversation(ENGINE)
+    request_full_rerun()
+
+# ========== MAIN APP ==========
+# The page is drawn in fragments: a click in the step widgets, the video
+# player, the input row or the sidebar reruns only that fragment. Callbacks
+# that change the transcript ask for a full rerun (see request_full_rerun).
+
+@st.fragment
+def video_player(step_id):
+    """Videos of a step with the open player; watching or closing one reruns only this"""
+    follow_full_rerun()
+    conversation = load_conversation(ENGINE)
+    for idx, video in enumerate(step_videos(FLOW.steps[step_id])):
+        with st.container():
+            col_thumb, col_info = st.columns([1, 2])
             
-            # Show interactive elements only for the last bot message
-            if msg['sender'] == 'bot' and msg == st.session_state.chat_history[-1]:
-                step_data = msg.get('step_data', {})
-                
-                # Quick Reply Buttons
-                if step_data.get('type') == 'quick_replies':
-                    cols = st.columns(len(step_data['options']))
-                    for idx, option in enumerate(step_data['options']):
-                        with cols[idx]:
-                            if st.button(option, key=f"quick_{idx}"):
-                                handle_choice(option)
-                
-                # Regular Buttons
-                elif step_data.get('type') == 'buttons':
-                    for idx, (label, value) in enumerate(step_data['options']):
-                        if st.button(label, key=f"btn_{idx}"):
-                            handle_choice(value, label)
-                
-                # Product Carousel
-                elif step_data.get('type') == 'carousel':
-                    for idx, product in enumerate(step_data['products']):
-                        with st.container():
-                            st.markdown(f"""
-                            <div class="product-card">
-                                <div style="display: flex; justify-content: space-between; align-items: start; margin-bottom: 12px;">
-                                    <div style="display: flex; gap: 15px; align-items: center;">
-                                        <span style="font-size: 40px;">{product['emoji']}</span>
-                                        <div>
-                                            <div style="font-weight: 700; color: #1e293b; font-size: 18px;">
-                                                {product['name']}
-                                            </div>
-                                            <div style="font-size: 13px; color: #64748b; margin-top: 4px;">
-                                                {product['desc']}
-                                            </div>
-                                        </div>
-                                    </div>
-                                    <div style="font-weight: 800; color: #b45309; font-size: 22px;">
-                                        {product['price']}
-                                    </div>
-                                </div>
-                                <div style="font-size: 12px; color: #475569; margin-bottom: 10px; white-space: pre-line;">
-                                    {product.get('features', '')}
-                                </div>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.button(f"👁️ View Details", key=f"prod_view_{idx}"):
-                                    handle_choice(f"view_{product['name']}", f"📋 View {product['name']} details")
-                            with col2:
-                                if st.button(f"🛒 Add to Cart", key=f"prod_cart_{idx}"):
-                                    handle_choice(f"add_{product['name']}", f"🛒 Add {product['name']} to cart")
-                            st.markdown("<br>", unsafe_allow_html=True)
+            with col_thumb:
+                if 'thumbnail' in video:
+                    thumbnail = get_thumbnails().get(video['thumbnail'])
+                    st.image(thumbnail or video['thumbnail'], use_container_width=True)
+            
+            with col_info:
+                st.markdown(f"""
+                <div style="padding: 5px;">
+                    <div style="font-weight: 600; color: #1e293b; font-size: 15px; margin-bottom: 5px;">
+                        {video['title']}
+                    </div>
+                    <div style="font-size: 13px; color: #64748b; margin-bottom: 5px;">
+                        {video.get('description', '')}
+                    </div>
+                    <div style="font-size: 12px; color: #94a3b8;">
+                        ⏱️ Duration: {video['duration']}
+                    </div>
+                </div>
+                """, unsafe_allow_html=True)
                 
-                # Video Section
-                elif step_data.get('type') == 'videos':
-                    for idx, video in enumerate(step_data['videos']):
-                        with st.container():
-                            col_thumb, col_info = st.columns([1, 2])
-                            
-                            with col_thumb:
-                                if 'thumbnail' in video:
-                                    st.image(video['thumbnail'], use_container_width=True)
-                            
-                            with col_info:
-                                st.markdown(f"""
-                                <div style="padding: 5px;">
-                                    <div style="font-weight: 600; color: #1e293b; font-size: 15px; margin-bottom: 5px;">
-                                        {video['title']}
-                                    </div>
-                                    <div style="font-size: 13px; color: #64748b; margin-bottom: 5px;">
-                                        {video.get('description', '')}
-                                    </div>
-                                    <div style="font-size: 12px; color: #94a3b8;">
-                                        ⏱️ Duration: {video['duration']}
-                                    </div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                                
-                                if st.button(f"▶️ Watch Now", key=f"vid_{idx}"):
-                                    st.session_state.playing_video = idx
-                                    st.rerun()
-                            
-                            # Show video player if this video is selected
-                            if st.session_state.playing_video == idx:
-                                if 'url' in video:
-                                    st.video(video['url'])
-                                    if st.button(f"❌ Close Video", key=f"close_vid_{idx}"):
-                                        st.session_state.playing_video = None
-                                        st.rerun()
-                                else:
-                                    st.info("🎬 Video coming soon!")
-                            
-                            st.markdown("---")
-                    
-                    # Add Skip Option after all videos
-                    st.markdown("<br>", unsafe_allow_html=True)
-                    col_skip1, col_skip2 = st.columns(2)
-                    with col_skip1:
-                        if st.button("⏭️ Skip Videos - Continue Shopping", key="skip_videos", use_container_width=True):
-                            st.session_state.playing_video = None
-                            handle_choice("skip_videos", "⏭️ Skip videos and continue")
-                    with col_skip2:
-                        if st.button("✅ Done Watching - Next Step", key="done_videos", use_container_width=True):
-                            st.session_state.playing_video = None
-                            handle_choice("done_watching", "✅ Finished watching videos")
+                st.button(f"▶️ Watch Now", key=f"vid_{idx}", on_click=play_video, args=(idx,))
+            
+            # Show video player if this video is selected
+            if conversation['playing_video'] == idx:
+                if 'url' in video:
+                    st.video(video['url'])
+                    st.button(f"❌ Close Video", key=f"close_vid_{idx}", on_click=play_video, args=(None,))
+                else:
+                    st.info("🎬 Video coming soon!")
+            
+            st.markdown("---")
+
+def product_card(product, key, idx, on_click, *args):
+    """Carousel card for a product; its buttons pass *args and the choice to on_click"""
+    with st.container():
+        st.markdown(f"""
+        <div class="product-card">
+            <div style="display: flex; justify-content: space-between; align-items: start; margin-bottom: 12px;">
+                <div style="display: flex; gap: 15px; align-items: center;">
+                    <span style="font-size: 40px;">{product['emoji']}</span>
+                    <div>
+                        <div style="font-weight: 700; color: #1e293b; font-size: 18px;">
+                            {product['name']}
+                        </div>
+                        <div style="font-size: 13px; color: #64748b; margin-top: 4px;">
+                            {product['desc']}
+                        </div>
+                    </div>
+                </div>
+                <div style="font-weight: 800; color: #b45309; font-size: 22px;">
+                    {product['price']}
+                </div>
+            </div>
+            <div style="font-size: 12px; color: #475569; margin-bottom: 10px; white-space: pre-line;">
+                {product.get('features', '')}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
         
-        # Show typing indicator
-        if st.session_state.show_typing:
-            show_typing_indicator()
-            advance_conversation()
-    
-    # Message Input Area
-    st.markdown("---")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.button(f"👁️ View Details", key=f"{key}_view_{idx}", on_click=on_click,
+                      args=(*args, f"view_{product['name']}", f"📋 View {product['name']} details"))
+        with col2:
+            st.button(f"🛒 Add to Cart", key=f"{key}_cart_{idx}", on_click=on_click,
+                      args=(*args, f"add_{product['name']}", f"🛒 Add {product['name']} to cart"))
+        st.markdown("<br>", unsafe_allow_html=True)
+
+@st.fragment
+def step_widgets():
+    """Interactive elements for the last bot message"""
+    follow_full_rerun()
+    conversation = load_conversation(ENGINE)
+    msg = conversation['chat_history'][-1]
+    step_data = FLOW.steps[ENGINE.active_step(conversation)] if msg.sender == BOT else {}
+    with metrics.span(f"widgets.{step_data.get('type', 'none')}"):
+        # Quick Reply Buttons
+        if step_data.get('type') == 'quick_replies':
+            cols = st.columns(len(step_data['options']))
+            for idx, option in enumerate(step_data['options']):
+                with cols[idx]:
+                    st.button(option, key=f"quick_{idx}",
+                              on_click=handle_choice, args=(step_data['id'], option))
+        
+        # Regular Buttons
+        elif step_data.get('type') == 'buttons':
+            for idx, (label, value) in enumerate(step_data['options']):
+                st.button(label, key=f"btn_{idx}",
+                          on_click=handle_choice, args=(step_data['id'], value, label))
+        
+        # Product Carousel
+        elif step_data.get('type') == 'carousel':
+            page = carousel_page(msg.id)
+            products, has_more = carousel_products(step_data, conversation['user_choices'], page)
+            for idx, product in enumerate(products):
+                product_card(product, 'prod', idx, handle_choice, step_data['id'])
+            
+            # Paging Buttons
+            if page or has_more:
+                col_prev, col_next = st.columns(2)
+                with col_prev:
+                    st.button("◀️ Previous", key="prod_prev", use_container_width=True, disabled=not page,
+                              on_click=turn_page, args=(msg.id, page - 1))
+                with col_next:
+                    st.button("More Styles ▶️", key="prod_next", use_container_width=True, disabled=not has_more,
+                              on_click=turn_page, args=(msg.id, page + 1))
+        
+        # Video Section
+        elif step_data.get('type') == 'videos':
+            video_player(step_data['id'])
+            
+            # Add Skip Option after all videos
+            st.markdown("<br>", unsafe_allow_html=True)
+            col_skip1, col_skip2 = st.columns(2)
+            with col_skip1:
+                st.button("⏭️ Skip Videos - Continue Shopping", key="skip_videos", use_container_width=True,
+                          on_click=handle_choice, args=(step_data['id'], "skip_videos", "⏭️ Skip videos and continue"))
+            with col_skip2:
+                st.button("✅ Done Watching - Next Step", key="done_videos", use_container_width=True,
+                          on_click=handle_choice, args=(step_data['id'], "done_watching", "✅ Finished watching videos"))
+
+@st.fragment
+def chat_input():
+    """Message box and Send button, with the products matching what is typed"""
+    follow_full_rerun()
     col_input, col_send = st.columns([5, 1])
     
     with col_input:
-        user_input = st.text_input(
+        st.text_input(
             "Type your message...",
             key="user_input",
             placeholder="Ask me anything about our shoes...",
@@ -546,122 +458,147 @@ with col_chat:
         )
     
     with col_send:
-        if st.button("📤 Send", use_container_width=True):
-            if user_input.strip():
-                add_message('user', user_input)
-                time.sleep(0.5)
-                add_message('bot', 
-                    "🤔 I didn't quite catch that!\n\nWould you like to explore our collections, speak with an expert, or return to the main menu?",
-                    step_data={
-                        'type': 'quick_replies',
-                        'options': ['🏠 Main Menu', '💬 Human Agent', '👞 Collections']
-                    }
-                )
-                st.rerun()
-
-# ========== SIDEBAR SECTION ==========
-with col_sidebar:
-    # Progress Tracker
-    st.markdown("### 📊 Your Journey")
+        st.button("📤 Send", use_container_width=True, on_click=send_message)
     
-    for idx, step in enumerate(STEPS):
-        if idx < st.session_state.current_step:
-            icon = "✅"
-            color = "#10b981"
-            bg = "#d1fae5"
-            border = "#10b981"
-        elif idx == st.session_state.current_step:
-            icon = "🔵"
-            color = "#f59e0b"
-            bg = "#fef3c7"
-            border = "#f59e0b"
-        else:
-            icon = "⭕"
-            color = "#94a3b8"
-            bg = "#f1f5f9"
-            border = "#cbd5e1"
+    # Matching products, updated each time the box changes; only this fragment reruns
+    typed = st.session_state.get('user_input', '')
+    if typed.strip() and get_broker().status(load_conversation(ENGINE)['conversation_id']) is None:
+        with metrics.span('search'):
+            products = get_content().current.search.search(typed)
+        if products:
+            st.caption(f"🔎 Products matching \"{typed.strip()}\"")
+            for idx, product in enumerate(products):
+                product_card(product, 'search', idx, pick_suggestion, product)
+
+def handoff_panel(conversation_id):
+    """Queue position or expert, with their new messages moved into the transcript"""
+    follow_full_rerun()
+    if receive_handoff(ENGINE, conversation_id, HANDOFF_NOTES):
+        # The transcript is only drawn by full runs
+        st.rerun()
+    status = get_broker().status(conversation_id)
+    if status is None:
+        # The handoff is over; a full run draws the page without the panel
+        st.rerun()
+    if status['state'] == WAITING:
+        st.info(f"You're number {status['position']} in the queue for an expert.", icon="⏳")
+    else:
+        st.success(f"You're chatting with {status['agent']}. Type below to reply.", icon="🧑‍💼")
+    st.button("🚪 Leave Expert Chat", key="leave_expert", on_click=leave_expert_chat)
+
+def order_panel(job_ids, polling):
+    """Status of this chat's orders and emails"""
+    follow_full_rerun()
+    for job_id in job_ids:
+        st.markdown(job_status(job_id))
+    # Once every job has settled, one full rerun draws the panel without a timer
+    if polling and not any(status_pending(job_id) for job_id in job_ids):
+        st.rerun()
+
+@st.fragment
+def sidebar():
+    """Journey tracker, selections, orders and help"""
+    follow_full_rerun()
+    conversation = load_conversation(ENGINE)
+    with metrics.span('sidebar'):
+        # Progress Tracker
+        st.markdown("### 📊 Your Journey")
         
-        st.markdown(f"""
-        <div class="progress-step" style="background-color: {bg}; border: 2px solid {border};">
-            <div style="display: flex; align-items: center; gap: 10px;">
-                <span style="font-size: 18px;">{icon}</span>
-                <div>
-                    <div style="font-weight: 600; color: #1e293b; font-size: 13px;">
-                        Step {idx + 1}
-                    </div>
-                    <div style="font-size: 11px; color: #64748b;">
-                        {step['id'].title()}
-                    </div>
-                </div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    st.markdown("---")
-    
-    # User Selections Summary
-    st.markdown("### 📝 Your Selections")
-    st.markdown(f"""
-    <div style="background: white; padding: 15px; border-radius: 10px; border: 2px solid #e2e8f0;">
-        <div style="margin-bottom: 10px;">
-            <strong style="color: #1e293b;">👞 Shoe Type:</strong><br>
-            <span style="color: #64748b;">{st.session_state.user_choices['shoe_type'] or '❌ Not selected'}</span>
-        </div>
-        <div style="margin-bottom: 10px;">
-            <strong style="color: #1e293b;">🎯 Occasion:</strong><br>
-            <span style="color: #64748b;">{st.session_state.user_choices['occasion'] or '❌ Not selected'}</span>
-        </div>
-        <div>
-            <strong style="color: #1e293b;">📏 Size:</strong><br>
-            <span style="color: #64748b;">{st.session_state.user_choices['size'] or '❌ Not selected'}</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    st.markdown("---")
-    
-    # Features Overview
-    st.markdown("### ✨ Why Choose Inuit?")
-    st.markdown("""
-    <div style="background: white; padding: 15px; border-radius: 10px; border: 2px solid #e2e8f0;">
-        <div style="margin-bottom: 8px;">
-            <strong style="color: #b45309;">🤝 Warm Service</strong><br>
-            <span style="font-size: 12px; color: #64748b;">Luxury tone with personal care</span>
-        </div>
-        <div style="margin-bottom: 8px;">
-            <strong style="color: #b45309;">🎨 Rich Experience</strong><br>
-            <span style="font-size: 12px; color: #64748b;">Interactive shopping journey</span>
-        </div>
-        <div style="margin-bottom: 8px;">
-            <strong style="color: #b45309;">🛍️ Easy Navigation</strong><br>
-            <span style="font-size: 12px; color: #64748b;">Simple, guided process</span>
-        </div>
-        <div>
-            <strong style="color: #b45309;">✅ Quality Guarantee</strong><br>
-            <span style="font-size: 12px; color: #64748b;">Premium Italian craftsmanship</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    st.markdown("---")
-    
-    # Action Buttons
-    if st.button("🔄 Restart Conversation", use_container_width=True):
-        reset_chat()
+        with metrics.span('progress'):
+            st.markdown(get_fragments().tracker[conversation['current_step']], unsafe_allow_html=True)
+        
+        st.markdown("---")
+        
+        # User Selections Summary
+        st.markdown("### 📝 Your Selections")
+        with metrics.span('selections'):
+            st.markdown(get_fragments().selections(conversation['user_choices']), unsafe_allow_html=True)
+        
+        st.markdown("---")
+        
+        # Orders and emails placed from this chat, fulfilled in the background;
+        # the panel polls on its own while any of them is still pending
+        if conversation['jobs']:
+            st.markdown("### 📦 Your Orders")
+            polling = any(status_pending(job_id) for job_id in conversation['jobs'])
+            st.fragment(order_panel, run_every=JOB_POLL_SECONDS if polling else None)(conversation['jobs'], polling)
+            st.markdown("---")
+        
+        # Features Overview
+        st.markdown("### ✨ Why Choose Inuit?")
+        st.markdown(get_fragments().static['features'], unsafe_allow_html=True)
+        
+        st.markdown("---")
+        
+        # Action Buttons
+        st.button("🔄 Restart Conversation", use_container_width=True, on_click=reset_chat)
+        
+        st.markdown("<br>", unsafe_allow_html=True)
+        
+        # Help Section
+        st.markdown("### 💡 Need Help?")
+        st.info("💬 Type your questions anytime or use the quick reply buttons for faster navigation!", icon="ℹ️")
+        
+        # Contact
+        st.markdown("---")
+        st.markdown(get_fragments().static['contact'], unsafe_allow_html=True)
+
+# This run redraws everything, so a pending full rerun request is met already
+st.session_state.pop('full_rerun', None)
+
+conversation = load_conversation(ENGINE)
+# Rendered fragments ride along with the conversation but are never saved;
+# those of messages folded into the archive are not needed any more
+get_renderer().prune(conversation.setdefault('render_cache', {}), conversation['chat_history'])
+
+# Header Section
+st.markdown(get_fragments().static['header'], unsafe_allow_html=True)
+
+# Main Layout: Chat (Left) + Sidebar (Right)
+col_chat, col_sidebar = st.columns([2.5, 1])
+
+# ========== CHAT SECTION ==========
+with col_chat, metrics.span('chat'):
+    st.markdown("### 💬 Chat with Our Assistant")
     
-    st.markdown("<br>", unsafe_allow_html=True)
+    # Chat container
+    chat_container = st.container()
+    with chat_container:
+        # Earlier turns stay collapsed and are only rendered on request
+        if conversation['chat_archive']:
+            archive = conversation['chat_archive']
+            if st.toggle(f"📜 Load earlier messages ({len(archive)})", key="show_archive"):
+                st.markdown(get_renderer().render_many(archive), unsafe_allow_html=True)
+        
+        # Display all messages
+        with metrics.span('chat_history'):
+            shown_at = 0
+            for msg in conversation['chat_history']:
+                shown_at = max(shown_at, display_message(msg, conversation, get_renderer(), TYPING_HTML))
+        
+        # Show interactive elements only for the last bot message, once its
+        # text has streamed in
+        if shown_at:
+            st.markdown(hold_until('.st-key-step_widgets', shown_at), unsafe_allow_html=True)
+        with st.container(key="step_widgets"):
+            step_widgets()
     
-    # Help Section
-    st.markdown("### 💡 Need Help?")
-    st.info("💬 Type your questions anytime or use the quick reply buttons for faster navigation!", icon="ℹ️")
+    # Expert Chat: polls for the queue position and the expert's replies
+    handoff = get_broker().status(conversation['conversation_id'])
+    if handoff is not None:
+        st.fragment(handoff_panel, run_every=HANDOFF_POLL_SECONDS.get(handoff['state'], 1))(
+            conversation['conversation_id'])
     
-    # Contact
+    # Message Input Area
     st.markdown("---")
-    st.markdown("""
-    <div style="text-align: center; padding: 10px;">
-        <div style="font-size: 12px; color: #cbd5e1;">
-            📧 support@inuit.com<br>
-            📞 1-800-INUIT-SHOES
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    chat_input()
+
+# ========== SIDEBAR SECTION ==========
+with col_sidebar:
+    sidebar()
+
+# ========== DEBUG PANEL ==========
+# Opt in with INUIT_METRICS=on and ?debug=metrics in the page URL
+if metrics.ENABLED and st.query_params.get('debug') == 'metrics':
+    with st.expander("⏱️ Timing metrics", expanded=True):
+        st.dataframe(metrics.REGISTRY.snapshot(), hide_index=True, use_container_width=True)
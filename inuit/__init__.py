@@ -0,0 +1,3 @@
+"""
+Shared building blocks for the Inuit chatbot pages (chatbot.py, intuitbot.py)
+"""
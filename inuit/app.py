@@ -0,0 +1,266 @@
+"""
+Setup shared by the chatbot pages (chatbot.py, intuitbot.py)
+
+The process-wide resources (flow, content, job queue, expert broker, funnel
+logging, engine and session store), the session bootstrap from ?sid=, and
+the conversation handlers both pages run the same way. The pages keep only
+their markup and layout.
+"""
+
+import uuid
+from html import escape
+
+import streamlit as st
+from pathlib import Path
+
+from inuit import metrics
+from inuit.content import ContentStore
+from inuit.delay import with_delay
+from inuit.engine import Engine
+from inuit.events import EventLog
+from inuit.flow import load_flow
+from inuit.fulfilment import order_actions, queue_from_env
+from inuit.funnel import FunnelCounters
+from inuit.handoff import CONNECTED, WAITING, HandoffBroker, handoff_actions
+from inuit.intents import IntentIndex
+from inuit.messages import BOT, USER
+from inuit.sessions import SessionManager
+from inuit.store import store_from_env
+from inuit.theme import compile_theme
+from inuit.thumbnails import ThumbnailCache
+
+ROOT = Path(__file__).parent.parent
+CACHE_DIR = ROOT / '.cache'
+
+# Stylesheets in themes/ are minified into static/ once per process
+THEMES_DIR = ROOT / 'themes'
+STATIC_DIR = ROOT / 'static'
+# Steps, options and branches live in flows/inuit.json
+FLOW_PATH = ROOT / 'flows' / 'inuit.json'
+# Products and workshop videos live in data/ and are reloaded when they change
+CATALOG_PATH = ROOT / 'data' / 'catalog.json'
+VIDEOS_PATH = ROOT / 'data' / 'videos.json'
+# Resized video thumbnails, fetched once and kept on disk
+THUMBNAIL_DIR = CACHE_DIR / 'thumbnails'
+# Orders and emails are handed to a background queue (see inuit/fulfilment.py)
+FULFILMENT_DIR = CACHE_DIR / 'fulfilment'
+# Funnel events are buffered and written to .cache/events in the background
+EVENTS_DIR = CACHE_DIR / 'events'
+# Funnel counts of every process are merged in .cache/funnel.db (see admin.py)
+FUNNEL_DB = CACHE_DIR / 'funnel.db'
+# Conversations are kept in a local SQLite file and come back with ?sid=
+SESSION_DB = CACHE_DIR / 'sessions.db'
+
+# How background jobs are shown in the sidebar
+JOB_TITLES = {'order': "🛒 Order", 'email': "📧 Email"}
+JOB_STATES = {
+    'queued': "⏳ Queued",
+    'running': "⚙️ In progress",
+    'retrying': "🔁 Retrying",
+    'done': "✅ Done",
+    'failed': "❌ Failed",
+}
+
+# Queue positions move slowly; the expert's replies should not
+HANDOFF_POLL_SECONDS = {WAITING: 3, CONNECTED: 1}
+
+
+@st.cache_resource
+def get_theme(name):
+    """Minified, content-hashed stylesheet themes/<name>.css shared by every session"""
+    return compile_theme(THEMES_DIR / f'{name}.css', STATIC_DIR)
+
+
+def show_theme(name):
+    """Link the page's stylesheet; reruns only send a <link>"""
+    with metrics.span('theme'):
+        st.markdown(get_theme(name).tag(st.get_option('server.enableStaticServing')), unsafe_allow_html=True)
+
+
+@st.cache_resource
+def get_flow():
+    """Compiled conversation flow shared by every session"""
+    return load_flow(FLOW_PATH)
+
+
+@st.cache_resource
+def get_intents():
+    """Free-text matcher over the flow's options, shared by every session"""
+    return IntentIndex.from_flow(get_flow())
+
+
+@st.cache_resource
+def get_content():
+    """Catalog and video library shared by every session, swapped on file changes"""
+    return ContentStore(CATALOG_PATH, VIDEOS_PATH)
+
+
+@st.cache_resource
+def get_thumbnails():
+    """Thumbnail cache and prefetcher shared by every session"""
+    thumbnails = ThumbnailCache(THUMBNAIL_DIR)
+
+    def prefetch_library(content):
+        thumbnails.prefetch(video['thumbnail'] for video in content.videos if 'thumbnail' in video)
+
+    # From now on each newly loaded video library is fetched in the background
+    get_content().on_change = prefetch_library
+    return thumbnails
+
+
+def step_videos(step_data):
+    """Videos of a step, from the current video library when the step names it as source"""
+    if step_data.get('source') == 'videos':
+        return get_content().current.videos
+    return step_data.get('videos', ())
+
+
+@st.cache_resource
+def get_metrics_exporter():
+    """Background writer of the metrics file (INUIT_METRICS=on), shared by every session"""
+    return metrics.start_exporter()
+
+
+@st.cache_resource
+def get_fulfilment():
+    """Order and email job queue shared by every session"""
+    return queue_from_env(FULFILMENT_DIR)
+
+
+@st.cache_resource
+def get_broker():
+    """Queue for the expert chat; agent consoles connect on INUIT_AGENT_PORT"""
+    return HandoffBroker()
+
+
+@st.cache_resource
+def get_event_log():
+    """Funnel event log shared by every session"""
+    return EventLog(EVENTS_DIR)
+
+
+@st.cache_resource
+def get_funnel():
+    """Funnel counters shared by every session"""
+    return FunnelCounters(FUNNEL_DB)
+
+
+@st.cache_resource
+def get_engine(reply_delay, fallback_delay):
+    """Conversation engine shared by every session, pausing as long as the page likes before replies"""
+    actions = {**order_actions(get_fulfilment()), **handoff_actions(get_broker())}
+    engine = Engine(get_flow(), get_intents(), reply_delay=reply_delay, fallback_delay=fallback_delay,
+                    actions=actions)
+    engine.subscribe(get_event_log().record)
+    engine.subscribe(get_funnel().record)
+    return engine
+
+
+@st.cache_resource
+def get_store():
+    """Session store shared by every session: write-behind SQLite, or INUIT_SESSION_STORE across workers"""
+    return store_from_env(SESSION_DB)
+
+
+@st.cache_resource
+def get_sessions():
+    """Resident conversations, spilled to the store when idle, shared by every session"""
+    return SessionManager(get_store())
+
+
+def start_services():
+    """Start the metrics writer and have the broker listen for agents"""
+    get_metrics_exporter()
+    # A taken agent port falls back to a free one
+    get_broker().start()
+
+
+def init_session(engine):
+    """Tie this browser session to a conversation
+
+    Only the session id lives in st.session_state; the conversation is a
+    plain dict driven by the engine and held by the session manager. A known
+    ?sid= resumes the saved conversation, otherwise a new one starts under a
+    fresh id.
+    """
+    if 'session_id' in st.session_state:
+        return
+    session_id = st.query_params.get('sid')
+    conversation = get_sessions().get(session_id) if session_id else None
+    if conversation is None or not engine.accepts(conversation):
+        session_id = uuid.uuid4().hex
+        get_sessions().save(session_id, engine.new_state())
+        st.query_params['sid'] = session_id
+    st.session_state.session_id = session_id
+
+
+def load_conversation(engine):
+    """This session's conversation, loaded back from disk if it was spilled"""
+    conversation = get_sessions().get(st.session_state.session_id)
+    if conversation is None:
+        conversation = engine.new_state()
+        save_conversation(conversation)
+    return conversation
+
+
+def save_conversation(conversation):
+    """Keep the changed conversation resident and queue it for the session store"""
+    get_sessions().save(st.session_state.session_id, conversation)
+
+
+def display_message(msg, conversation, renderer, typing_html):
+    """Display a chat message; returns when a fresh reply has fully shown"""
+    # A fresh reply plays once, in the browser: a short typing pause, then
+    # its lines stream in one by one
+    delay = conversation['reply_delays'].pop(msg.id, 0)
+    if not delay:
+        st.markdown(renderer.render(msg, conversation['render_cache']), unsafe_allow_html=True)
+        return 0
+    html, first, last = renderer.stream(msg, delay)
+    st.markdown(with_delay(html, first, typing_html), unsafe_allow_html=True)
+    return last
+
+
+def job_status(job_id):
+    """One line on how a background order or email job is getting on"""
+    job = get_fulfilment().status(job_id)
+    if job is None:
+        return "📦 No longer tracked"
+    line = f"**{JOB_TITLES.get(job['kind'], job['kind'])}** — {JOB_STATES[job['status']]}"
+    if job['status'] == 'done' and job['kind'] == 'order':
+        line += f" · {job['result']['order_number']}"
+    return line
+
+
+def send_text(engine, conversation, text):
+    """Hand typed text to the expert who has the conversation, or else to the engine; returns the step entered"""
+    if text.strip() and get_broker().relay(conversation['conversation_id'], text.strip()):
+        engine.add_message(conversation, USER, text.strip())
+        return None
+    return engine.send_text(conversation, text)
+
+
+def receive_handoff(engine, conversation_id, notes):
+    """Move the expert chat's new events into the transcript, worded by notes; returns whether there were any"""
+    events = get_broker().receive(conversation_id)
+    if not events:
+        return False
+    conversation = load_conversation(engine)
+    for event, agent, text in events:
+        # Agents' text is escaped
+        engine.add_message(conversation, BOT, notes[event].format(agent=agent, text=escape(text or '', quote=False)))
+    save_conversation(conversation)
+    return True
+
+
+def leave_handoff(engine):
+    """Leave the queue or the chat with an expert"""
+    get_broker().leave(load_conversation(engine)['conversation_id'])
+
+
+def reset_conversation(engine):
+    """Leave any expert chat and start the conversation over"""
+    conversation = load_conversation(engine)
+    get_broker().leave(conversation['conversation_id'])
+    engine.reset(conversation)
+    save_conversation(conversation)
@@ -0,0 +1,400 @@
+"""
+Shared session store backends
+
+With one server process, SessionStore (see inuit/store.py) can keep the
+conversations in its own SQLite file and write them behind the reruns.
+Several worker processes behind a plain round-robin balancer need one
+store they all read and write, so that a visitor whose browser reconnects
+to another worker finds the conversation where they left it.
+
+A backend keeps each session as an encoded state with a version number.
+Writes are optimistic: save() names the version the change was based on
+and only succeeds if that is still the stored one, bumping it by one;
+otherwise it raises StaleSession and nothing is written. Two backends are
+provided, both taking the same compare-and-set path:
+
+    sqlite:///.cache/shared-sessions.db   workers on one host
+    redis://localhost:6379/0              workers anywhere
+
+RedisBackend speaks the Redis protocol itself (WATCH/MULTI/EXEC around
+the version check), so it needs no client library. For development it can
+be pointed at a local stand-in that speaks enough of the protocol:
+
+    python -m inuit.backends redis --port 6379
+"""
+
+import argparse
+import queue
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+KEY_PREFIX = 'inuit:session:'
+POOL_SIZE = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versioned_sessions (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    state BLOB NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class StaleSession(Exception):
+    """A session was saved from an older version than the stored one"""
+
+
+class RedisError(Exception):
+    """An error reply from a Redis server"""
+
+
+class SQLiteBackend:
+    """Versioned session states in a SQLite file shared by the workers of one host"""
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+            conn.commit()
+
+    @contextmanager
+    def _connection(self):
+        # Streamlit runs each rerun on a new thread, so connections are pooled
+        # rather than kept per thread; each is used by one thread at a time
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def load(self, session_id):
+        """(state bytes, version) of a session, or None if there is none"""
+        with self._connection() as conn:
+            row = conn.execute('SELECT state, version FROM versioned_sessions WHERE id = ?',
+                               (session_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def version(self, session_id):
+        """Stored version of a session, or None if there is none"""
+        with self._connection() as conn:
+            row = conn.execute('SELECT version FROM versioned_sessions WHERE id = ?', (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, session_id, blob, version):
+        """Store a state based on version (0 for a new session); returns the new version"""
+        with self._connection() as conn, conn:
+            if version:
+                cursor = conn.execute(
+                    'UPDATE versioned_sessions SET version = version + 1, state = ?, updated = ? '
+                    'WHERE id = ? AND version = ?',
+                    (blob, time.time(), session_id, version)
+                )
+            else:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO versioned_sessions (id, version, state, updated) VALUES (?, 1, ?, ?)',
+                    (session_id, blob, time.time())
+                )
+            if cursor.rowcount != 1:
+                raise StaleSession(session_id)
+        return version + 1
+
+    def delete(self, session_id):
+        """Forget a session"""
+        with self._connection() as conn, conn:
+            conn.execute('DELETE FROM versioned_sessions WHERE id = ?', (session_id,))
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class RedisConnection:
+    """One connection to a Redis server, speaking just enough of its protocol"""
+
+    def __init__(self, host, port, db=0, timeout=5):
+        self._sock = socket.create_connection((host, port), timeout)
+        self._file = self._sock.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        """Send one command and return its reply"""
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._sock.sendall(b''.join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis server closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            return None if size < 0 else self._file.read(size + 2)[:-2]
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class RedisBackend:
+    """Versioned session states in Redis, one hash per session"""
+
+    def __init__(self, host='localhost', port=6379, db=0, prefix=KEY_PREFIX, pool_size=POOL_SIZE):
+        self.address = (host, port, db)
+        self.prefix = prefix
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    @contextmanager
+    def _connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = RedisConnection(*self.address)
+        reusable = False
+        try:
+            yield conn
+            reusable = True
+        except (StaleSession, RedisError):
+            reusable = True
+            raise
+        finally:
+            # After a network error the connection may be half-way through a reply
+            if not reusable:
+                conn.close()
+            else:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+
+    def load(self, session_id):
+        """(state bytes, version) of a session, or None if there is none"""
+        with self._connection() as redis:
+            version, blob = redis.execute('HMGET', self.prefix + session_id, 'version', 'state')
+        return (blob, int(version)) if version is not None else None
+
+    def version(self, session_id):
+        """Stored version of a session, or None if there is none"""
+        with self._connection() as redis:
+            version = redis.execute('HGET', self.prefix + session_id, 'version')
+        return int(version) if version is not None else None
+
+    def save(self, session_id, blob, version):
+        """Store a state based on version (0 for a new session); returns the new version"""
+        key = self.prefix + session_id
+        with self._connection() as redis:
+            # EXEC does nothing if the key changed after WATCH
+            redis.execute('WATCH', key)
+            stored = redis.execute('HGET', key, 'version')
+            if int(stored or 0) != version:
+                redis.execute('UNWATCH')
+                raise StaleSession(session_id)
+            redis.execute('MULTI')
+            redis.execute('HSET', key, 'version', version + 1, 'state', blob)
+            if redis.execute('EXEC') is None:
+                raise StaleSession(session_id)
+        return version + 1
+
+    def delete(self, session_id):
+        """Forget a session"""
+        with self._connection() as redis:
+            redis.execute('DEL', self.prefix + session_id)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def backend_from_url(url):
+    """Backend for a sqlite:///path or redis://host:port/db URL"""
+    parts = urlsplit(url)
+    if parts.scheme == 'sqlite':
+        # sqlite:///relative/path or sqlite:////absolute/path
+        return SQLiteBackend(parts.path[1:])
+    if parts.scheme == 'redis':
+        db = int(parts.path.strip('/') or 0)
+        return RedisBackend(parts.hostname or 'localhost', parts.port or 6379, db)
+    raise ValueError(f"unknown session backend {url!r}")
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    """The Redis commands RedisBackend uses, on one client connection"""
+
+    def reply(self, value):
+        self.wfile.write(_encode_reply(value))
+
+    def handle(self):
+        watched = {}  # key -> its write count when WATCH was issued
+        transaction = None
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            name = command[0].upper()
+            args = command[1:]
+            if name == b'MULTI':
+                transaction = []
+                self.reply('OK')
+            elif name == b'EXEC':
+                if transaction is None:
+                    self.reply(RedisError('ERR EXEC without MULTI'))
+                    continue
+                self.reply(self.server.execute_transaction(transaction, watched))
+                transaction = None
+                watched = {}
+            elif name == b'DISCARD':
+                transaction = None
+                watched = {}
+                self.reply('OK')
+            elif name == b'WATCH':
+                watched.update(self.server.write_counts(args))
+                self.reply('OK')
+            elif name == b'UNWATCH':
+                watched = {}
+                self.reply('OK')
+            elif transaction is not None:
+                transaction.append((name, args))
+                self.reply('QUEUED')
+            else:
+                self.reply(self.server.execute(name, args))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            raise ValueError("only array commands are understood")
+        command = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(size + 2)[:-2])
+        return command
+
+
+def _encode_reply(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, RedisError):
+        return b'-%s\r\n' % str(value).encode('utf-8')
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode('utf-8')
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(_encode_reply(item) for item in value)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """In-memory Redis stand-in with hashes, WATCH and transactions"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _RedisHandler)
+        self.hashes = {}
+        self._writes = {}  # key -> how often it was written, for WATCH
+        self._lock = threading.Lock()
+
+    def write_counts(self, keys):
+        with self._lock:
+            return {key: self._writes.get(key, 0) for key in keys}
+
+    def execute(self, name, args):
+        with self._lock:
+            return self._apply(name, args)
+
+    def execute_transaction(self, commands, watched):
+        with self._lock:
+            if any(self._writes.get(key, 0) != count for key, count in watched.items()):
+                return None
+            return [self._apply(name, args) for name, args in commands]
+
+    def _apply(self, name, args):
+        if name == b'PING':
+            return 'PONG'
+        if name == b'SELECT':
+            return 'OK'
+        if name == b'HGET':
+            return self.hashes.get(args[0], {}).get(args[1])
+        if name == b'HMGET':
+            fields = self.hashes.get(args[0], {})
+            return [fields.get(field) for field in args[1:]]
+        if name == b'HSET':
+            fields = self.hashes.setdefault(args[0], {})
+            pairs = list(zip(args[1::2], args[2::2]))
+            added = sum(field not in fields for field, _ in pairs)
+            fields.update(pairs)
+            self._writes[args[0]] = self._writes.get(args[0], 0) + 1
+            return added
+        if name == b'DEL':
+            deleted = 0
+            for key in args:
+                if self.hashes.pop(key, None) is not None:
+                    self._writes[key] = self._writes.get(key, 0) + 1
+                    deleted += 1
+            return deleted
+        return RedisError(f"ERR unknown command '{name.decode('utf-8', 'replace')}'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in of the shared session store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    redis = commands.add_parser('redis', help="in-memory server speaking the Redis commands the store uses")
+    redis.add_argument('--host', default='localhost')
+    redis.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args(argv)
+
+    server = LocalRedisServer((args.host, args.port))
+    print(f"Redis stand-in on {args.host}:{args.port} (INUIT_SESSION_STORE=redis://{args.host}:{args.port}/0)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
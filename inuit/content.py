@@ -0,0 +1,125 @@
+"""
+Hot-reloadable catalog and video library
+
+The product catalog (data/catalog.json) and the workshop videos
+(data/videos.json) are data, not code: a price or a video link can change
+without a redeploy. ContentStore holds the current Content, an immutable
+snapshot of both along with the catalog's search index. A watcher thread
+polls the files' modification times and sizes; when one changes it loads
+and indexes the new files in the background and then replaces the
+snapshot with a single reference swap.
+
+A rerun reads `store.current` once, which costs an attribute lookup: it
+never waits for a reload and never sees a catalog that is only half
+built. A file that cannot be read or parsed (for instance one caught in
+the middle of being written) leaves the current snapshot in place and is
+tried again on the next poll, so editors do not need to write atomically.
+"""
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from inuit.catalog import Catalog
+from inuit.search import ProductSearch
+
+POLL_INTERVAL = 2.0
+VIDEO_FIELDS = ('title', 'duration')
+
+
+class Content:
+    """Catalog, its search index and videos loaded together from one version of the data files"""
+
+    __slots__ = ('catalog', 'search', 'videos', 'version', 'loaded_at')
+
+    def __init__(self, catalog, videos, version):
+        set_ = object.__setattr__
+        set_(self, 'catalog', catalog)
+        set_(self, 'search', ProductSearch(catalog))
+        set_(self, 'videos', videos)
+        set_(self, 'version', version)
+        set_(self, 'loaded_at', time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Content is read-only")
+
+
+def load_videos(path):
+    """Read-only video entries from a JSON list"""
+    with open(path, encoding='utf-8') as f:
+        videos = json.load(f)
+    if not isinstance(videos, list):
+        raise ValueError(f"{path} should hold a list of videos")
+    for video in videos:
+        missing = [field for field in VIDEO_FIELDS if field not in video]
+        if missing:
+            raise ValueError(f"video {video.get('title', '?')!r} in {path} has no {', '.join(missing)}")
+    return tuple(MappingProxyType(dict(video)) for video in videos)
+
+
+def _read_catalog(path):
+    with open(path, encoding='utf-8') as f:
+        records = json.load(f)
+    if not records:
+        raise ValueError(f"{path} holds no products")
+    return Catalog(records)
+
+
+class ContentStore:
+    """The current Content, swapped for a new snapshot when the data files change"""
+
+    def __init__(self, catalog_path, videos_path, poll_interval=POLL_INTERVAL, on_change=None):
+        self.catalog_path = catalog_path
+        self.videos_path = videos_path
+        self.poll_interval = poll_interval
+        # Called with the new Content after each swap, on the watcher thread
+        self.on_change = on_change
+        self.reloads = 0
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        # A broken file at startup is an error; later ones keep the old snapshot
+        self._signature = self._stat()
+        self.current = self._load(version=1)
+        self._closed = threading.Event()
+        self._watcher = threading.Thread(target=self._run, name='content-watcher', daemon=True)
+        self._watcher.start()
+
+    def reload(self):
+        """Load the data files if they changed since the last load; returns whether they did"""
+        with self._reload_lock:
+            signature = self._stat()
+            if signature == self._signature:
+                return False
+            content = self._load(self.current.version + 1)
+            # Readers hold on to the snapshot they took; new reads get this one
+            self.current = content
+            self._signature = signature
+            self.reloads += 1
+            self.last_error = None
+        if self.on_change is not None:
+            self.on_change(content)
+        return True
+
+    def close(self):
+        """Stop watching the files"""
+        self._closed.set()
+
+    def _stat(self):
+        signature = []
+        for path in (self.catalog_path, self.videos_path):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _load(self, version):
+        return Content(_read_catalog(self.catalog_path), load_videos(self.videos_path), version)
+
+    def _run(self):
+        while not self._closed.wait(self.poll_interval):
+            try:
+                self.reload()
+            except (OSError, ValueError, KeyError, TypeError) as exc:
+                # Keep serving the last good snapshot; the files are tried again next poll
+                self.last_error = exc
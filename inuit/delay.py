@@ -0,0 +1,49 @@
+"""
+Simulated "thinking" delay that never blocks the script thread
+
+The bot reply is sent straight away and the browser plays the pause: a
+typing indicator is shown and the message is revealed by a CSS animation
+once the delay has passed. Steps can set their own 'delay' in seconds.
+Set INUIT_DELAY_MODE=off (e.g. for benchmarks) to show replies at once.
+
+Long replies are streamed the same way: the pause is cut short, each line
+of the reply fades in a moment after the one before it, and the step's
+widgets are held back until the last line is showing. The whole reply is
+still sent in one go; only the browser paces it.
+"""
+
+import os
+
+DELAY_MODE = os.environ.get('INUIT_DELAY_MODE', 'client')
+FIRST_CONTENT = 0.3  # longest pause before a streamed reply starts to show
+LINE_PACE = 0.08  # seconds between the lines of a streamed reply
+
+
+def thinking_delay(step_data, default):
+    """Seconds to hold back a reply for this step (0 when delays are off)"""
+    if DELAY_MODE == 'off':
+        return 0
+    return step_data.get('delay', default)
+
+
+def with_delay(html, delay, typing_html=''):
+    """Wrap a message so the browser shows typing_html, then reveals it after delay"""
+    if not delay:
+        return html
+    return (
+        f'<div class="thinking" style="animation-delay: {delay}s;">{typing_html}</div>'
+        f'<div class="reveal" style="animation-delay: {delay}s;">{html}</div>'
+    )
+
+
+def stream_lines(text, delay, pace=LINE_PACE):
+    """Yield each line of a reply with the second at which the browser shows it"""
+    start = min(delay, FIRST_CONTENT)
+    for idx, line in enumerate(text.split('\n')):
+        yield line, start + idx * pace
+
+
+def hold_until(selector, delay):
+    """Style that keeps the elements matched by selector hidden until delay has passed"""
+    # Fades only: the element stays laid out at full size, so an open video or a paging row is never clipped
+    return f'<style>{selector} {{animation: hold-in 0.3s ease-out {delay:.2f}s both;}}</style>'
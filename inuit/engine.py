@@ -0,0 +1,158 @@
+"""
+Headless conversation engine
+
+A conversation is a plain dict (see Engine.new_state) and every change to it
+goes through an Engine, so the same state transitions drive the Streamlit
+pages, the batch simulator and anything else, without importing Streamlit.
+The pages keep the dict in st.session_state and only render it.
+
+Options of the flow may name an action. The engine runs the callable it was
+given for that name when the option is chosen; it is expected to hand the
+work off (see inuit.fulfilment) and return a job id, which is kept in the
+state's 'jobs' so the pages can show how the job is getting on. Actions
+with nothing to track, such as queueing for an expert (see
+inuit.handoff), return None.
+
+Listeners added with subscribe() are called as listener(event, state, step,
+value) for every step entered ('enter'), option chosen ('choice') and
+fallback reply ('fallback'), and for the first time a conversation enters
+a step ('reach'), from the rerun that caused it, so they must return
+quickly (see inuit.events and inuit.funnel).
+"""
+
+import time
+import uuid
+
+from inuit.delay import thinking_delay
+from inuit.history import fold_history, new_archive
+from inuit.messages import BOT, USER, Message
+from inuit.metrics import timed
+
+
+class Engine:
+    """State transitions for one compiled flow"""
+
+    def __init__(self, flow, intents=None, reply_delay=0.8, fallback_delay=0.5, clock=time.time, actions=None):
+        self.flow = flow
+        self.intents = intents
+        self.actions = dict(actions or {})
+        self.listeners = []
+        self.reply_delay = reply_delay
+        self.fallback_delay = fallback_delay
+        self.clock = clock
+        # user_choices fields, in the order the flow asks for them
+        self.choice_fields = tuple(dict.fromkeys(
+            step['records'] for step in flow.steps.values() if step.get('records')
+        ))
+
+    def new_state(self):
+        """A fresh conversation, greeted with the flow's start step"""
+        state = {
+            'conversation_id': uuid.uuid4().hex,
+            'chat_history': [],
+            'chat_archive': new_archive(),
+            'current_step': self.flow.start,
+            'user_choices': dict.fromkeys(self.choice_fields, ''),
+            'playing_video': None,
+            'message_seq': 0,
+            'reply_delays': {},
+            'jobs': [],
+            'reached': set(),
+        }
+        self.enter(state, self.flow.start, delay=0)
+        return state
+
+    def subscribe(self, listener):
+        """Call listener(event, state, step, value) on every transition"""
+        self.listeners.append(listener)
+
+    def notify(self, event, state, step, value=None):
+        """Tell the listeners about a transition"""
+        for listener in self.listeners:
+            listener(event, state, step, value)
+
+    def accepts(self, state):
+        """Whether a restored state only refers to steps this flow has"""
+        steps = self.flow.steps
+        return state['current_step'] in steps and all(
+            msg.step is None or msg.step in steps for msg in state['chat_history']
+        )
+
+    def reset(self, state):
+        """Start the conversation in state over"""
+        state.clear()
+        state.update(self.new_state())
+
+    def add_message(self, state, sender, text, delay=0, step=None):
+        """Add a message to chat history, optionally revealed after a delay"""
+        state['message_seq'] += 1
+        if delay:
+            state['reply_delays'][state['message_seq']] = delay
+        msg = Message(state['message_seq'], sender, text, self.clock(), step)
+        state['chat_history'].append(msg)
+        # Keep only the recent window live; older turns go to the archive
+        fold_history(state['chat_history'], state['chat_archive'])
+        return msg
+
+    def active_step(self, state):
+        """Step whose options are on screen (that of the last bot message, unless it belongs to none)"""
+        history = state['chat_history']
+        if history and history[-1].sender == BOT and history[-1].step is not None:
+            return history[-1].step
+        return state['current_step']
+
+    @timed('advance_conversation')
+    def enter(self, state, step_id, delay=None):
+        """Move to step_id and post its bot message"""
+        step_data = self.flow.steps[step_id]
+        state['current_step'] = step_id
+        state['playing_video'] = None
+        if delay is None:
+            delay = thinking_delay(step_data, self.reply_delay)
+        self.add_message(state, BOT, step_data['message'], delay=delay, step=step_id)
+        self.notify('enter', state, step_id)
+        if step_id not in state['reached']:
+            state['reached'].add(step_id)
+            self.notify('reach', state, step_id)
+
+    def choose(self, state, step_id, value, text=None):
+        """Apply a choice made on step_id; returns the step moved to, or None"""
+        self.add_message(state, USER, text if text else value)
+        self.notify('choice', state, step_id, value)
+        step_data = self.flow.steps[step_id]
+        field = step_data.get('records')
+        if field:
+            state['user_choices'][field] = value
+        action = step_data.get('actions', {}).get(value)
+        if action in self.actions:
+            # Actions that start a background job return its id
+            job = self.actions[action](state)
+            if job is not None:
+                state['jobs'].append(job)
+        next_step = self.flow.next_step(step_id, value)
+        if next_step is not None:
+            self.enter(state, next_step)
+        return next_step
+
+    def send_text(self, state, text):
+        """Handle typed text; returns the step moved to, or None"""
+        text = text.strip()
+        if not text:
+            return None
+        # Text that matches an option on screen moves on like a click would
+        if self.intents is not None:
+            match = self.intents.classify(text, (self.active_step(state), self.flow.fallback))
+            if match:
+                step_id, value, _ = match
+                return self.choose(state, step_id, value, text)
+        self.add_message(state, USER, text)
+        # The fallback reply offers a way back without moving current_step
+        self.notify('fallback', state, self.active_step(state))
+        fallback_data = self.flow.steps[self.flow.fallback]
+        self.add_message(state, BOT, fallback_data['message'],
+                         delay=thinking_delay(fallback_data, self.fallback_delay), step=self.flow.fallback)
+        return None
+
+    def play_video(self, state, idx):
+        """Open the player for a video (None closes it)"""
+        state['playing_video'] = idx
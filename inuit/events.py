@@ -0,0 +1,137 @@
+"""
+Funnel event log
+
+The engine tells its listeners about every step entered, choice made and
+fallback reply (see Engine.subscribe). EventLog.record is such a listener:
+it appends a small tuple to an in-memory ring buffer and returns, so a
+rerun never waits on the disk. If the disk falls behind for long enough
+that the buffer fills up, the oldest events are dropped (and counted)
+rather than the rerun blocking.
+
+A background thread drains the buffer every flush interval and appends
+the batch to the current segment as one gzip member of JSON lines. A
+segment is therefore a valid .jsonl.gz file after every flush, even if
+the process dies. Segments rotate by size and age, are named by time and
+process id so several server processes can share a directory, and only
+the newest ones are kept.
+
+    {"time": 1704067200.0, "conversation": "3f2a...", "event": "choice", "step": "size", "value": "9-10"}
+"""
+
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+CAPACITY = 65536
+FLUSH_INTERVAL = 1.0
+SEGMENT_BYTES = 8 * 1024 * 1024  # compressed size at which a segment rotates
+SEGMENT_SECONDS = 3600
+KEEP_SEGMENTS = 168
+
+FIELDS = ('time', 'conversation', 'event', 'step', 'value')
+
+
+class EventLog:
+    """Ring buffer of funnel events, flushed to rotating gzip JSONL segments"""
+
+    def __init__(self, directory, capacity=CAPACITY, flush_interval=FLUSH_INTERVAL,
+                 segment_bytes=SEGMENT_BYTES, segment_seconds=SEGMENT_SECONDS, keep=KEEP_SEGMENTS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.keep = keep
+        # deque appends and pops are atomic, so record() needs no lock
+        self._buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        self.written = 0
+        self._unwritten = []  # a batch whose write failed
+        self._segment = None
+        self._segment_started = 0.0
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def record(self, event, state, step, value=None):
+        """Engine listener: buffer one event"""
+        if len(self._buffer) == self.capacity:
+            self.dropped += 1
+        self._buffer.append((time.time(), state['conversation_id'], event, step, value))
+
+    def flush(self):
+        """Write whatever is buffered now; returns how many events were written"""
+        with self._flush_lock:
+            batch, self._unwritten = self._unwritten, []
+            pop = self._buffer.popleft
+            try:
+                while True:
+                    batch.append(pop())
+            except IndexError:
+                pass
+            if not batch:
+                return 0
+            lines = ''.join(
+                json.dumps(dict(zip(FIELDS, event)), ensure_ascii=False, separators=(',', ':')) + '\n'
+                for event in batch
+            )
+            try:
+                with open(self._current_segment(), 'ab') as f:
+                    f.write(gzip.compress(lines.encode('utf-8'), compresslevel=6))
+            except OSError:
+                # Keep the batch for the next flush, within the buffer's capacity
+                self.dropped += max(0, len(batch) - self.capacity)
+                self._unwritten = batch[-self.capacity:]
+                raise
+            self.written += len(batch)
+            return len(batch)
+
+    def close(self):
+        """Stop the flusher and write what is still buffered"""
+        if not self._closed.is_set():
+            self._closed.set()
+            self._flusher.join(timeout=5)
+            self.flush()
+
+    def segments(self):
+        """Segment files, oldest first"""
+        return sorted(self.directory.glob('events-*.jsonl.gz'))
+
+    def _current_segment(self):
+        now = time.time()
+        if (self._segment is None or now - self._segment_started >= self.segment_seconds
+                or (self._segment.exists() and self._segment.stat().st_size >= self.segment_bytes)):
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(now)) + f"{int(now * 1000) % 1000:03d}"
+            self._segment = self.directory / f"events-{stamp}-{os.getpid()}.jsonl.gz"
+            self._segment_started = now
+            segments = self.segments()
+            for old in segments[:max(0, len(segments) + 1 - self.keep)]:
+                old.unlink(missing_ok=True)
+        return self._segment
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                # The batch is kept and written with the next one
+                pass
+
+
+def read_events(directory):
+    """Every logged event under directory as dicts, oldest segment first"""
+    for path in sorted(Path(directory).glob('events-*.jsonl.gz')):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except EOFError:
+                continue  # a member cut short by a crash
@@ -0,0 +1,167 @@
+"""
+Declarative conversation flow
+
+A flow is defined in a JSON (or YAML) file: an ordered list of steps, each
+with its message, widget type and options. A carousel step either lists its
+products or names a 'source' (such as the product catalog) to rank them from,
+and a videos step lists its videos or names the video library as its source.
+Options may list 'examples' of free text that should select them, and a step
+may name a later step to 'prefetch' media for while the user answers. Options and steps may name the
+step they lead to with 'next'; without it, a journey step moves on to the
+following journey step. An option may also name an 'action' (such as
+placing an order) for the engine to run when it is chosen. Steps marked "journey": false are side branches that
+are not shown in the progress tracker; their 'stage' names the journey step
+they count as for progress.
+
+load_flow() validates the definition and compiles it into a read-only Flow
+with O(1) lookups by step id and by (step id, choice value).
+"""
+
+import json
+from pathlib import Path
+from types import MappingProxyType
+
+STEP_TYPES = {
+    'quick_replies': 'options',
+    'buttons': 'options',
+    'carousel': 'products',
+    'videos': 'videos',
+}
+
+
+class FlowError(ValueError):
+    """Raised when a flow definition is invalid"""
+
+
+class Flow:
+    """Compiled, immutable conversation graph"""
+
+    __slots__ = ('start', 'fallback', 'steps', 'journey', 'position', '_routes', '_default_next')
+
+    def __init__(self, start, fallback, steps, journey, position, routes, default_next):
+        set_ = object.__setattr__
+        set_(self, 'start', start)
+        set_(self, 'fallback', fallback)
+        set_(self, 'steps', MappingProxyType(steps))
+        set_(self, 'journey', tuple(journey))
+        set_(self, 'position', MappingProxyType(position))
+        set_(self, '_routes', MappingProxyType(routes))
+        set_(self, '_default_next', MappingProxyType(default_next))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Flow is read-only")
+
+    def next_step(self, step_id, value):
+        """Step id that answering step_id with value leads to (None to stay put)"""
+        return self._routes.get((step_id, value), self._default_next.get(step_id))
+
+
+def load_flow(path):
+    """Read, validate and compile a flow definition file"""
+    path = Path(path)
+    with open(path, encoding='utf-8') as f:
+        if path.suffix in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise FlowError(f"PyYAML is needed to load {path.name}") from None
+            definition = yaml.safe_load(f)
+        else:
+            definition = json.load(f)
+    return compile_flow(definition)
+
+
+def compile_flow(definition):
+    """Validate a flow definition (a dict) and compile it into a Flow"""
+    raw_steps = definition.get('steps') or []
+    if not raw_steps:
+        raise FlowError("flow has no steps")
+
+    steps = {}
+    for raw in raw_steps:
+        step_id = raw.get('id')
+        if not step_id:
+            raise FlowError(f"step without an id: {raw!r}")
+        if step_id in steps:
+            raise FlowError(f"duplicate step id '{step_id}'")
+        steps[step_id] = raw
+
+    journey = [raw['id'] for raw in raw_steps if raw.get('journey', True)]
+    if not journey:
+        raise FlowError("flow has no journey steps")
+    position = {step_id: idx for idx, step_id in enumerate(journey)}
+
+    compiled, routes, default_next = {}, {}, {}
+    for raw in raw_steps:
+        step_id = raw['id']
+        step_type = raw.get('type')
+        if step_type not in STEP_TYPES:
+            raise FlowError(f"step '{step_id}' has unknown type {step_type!r}")
+        if 'message' not in raw:
+            raise FlowError(f"step '{step_id}' has no message")
+        payload = STEP_TYPES[step_type]
+        if not raw.get(payload) and not (step_type in ('carousel', 'videos') and raw.get('source')):
+            raise FlowError(f"{step_type} step '{step_id}' needs '{payload}'")
+
+        if step_id not in position:
+            stage = raw.get('stage')
+            if stage is not None:
+                if stage not in position:
+                    raise FlowError(f"step '{step_id}' has stage '{stage}', which is not a journey step")
+                position[step_id] = position[stage]
+
+        if raw.get('prefetch') is not None and raw['prefetch'] not in steps:
+            raise FlowError(f"step '{step_id}' prefetches unknown step '{raw['prefetch']}'")
+
+        if 'next' in raw:
+            default_next[step_id] = raw['next']
+        elif step_id in journey and journey.index(step_id) + 1 < len(journey):
+            default_next[step_id] = journey[journey.index(step_id) + 1]
+
+        step = {key: value for key, value in raw.items() if key not in ('options', 'next', 'journey')}
+        if step_type in ('quick_replies', 'buttons'):
+            examples, actions = {}, {}
+            step['options'] = tuple(_compile_options(
+                step_id, raw['options'], routes, examples, actions, labels_only=step_type == 'quick_replies'
+            ))
+            step['examples'] = MappingProxyType(examples)
+            step['actions'] = MappingProxyType(actions)
+        elif payload in raw:
+            step[payload] = tuple(MappingProxyType(dict(item)) for item in raw[payload])
+        compiled[step_id] = MappingProxyType(step)
+
+    targets = [(step_id, target) for (step_id, _), target in routes.items()]
+    targets += default_next.items()
+    for step_id, target in targets:
+        if target is not None and target not in steps:
+            raise FlowError(f"step '{step_id}' leads to unknown step '{target}'")
+
+    start = definition.get('start', journey[0])
+    if start not in steps:
+        raise FlowError(f"start step '{start}' does not exist")
+    fallback = definition.get('fallback')
+    if fallback is not None and fallback not in steps:
+        raise FlowError(f"fallback step '{fallback}' does not exist")
+
+    return Flow(start, fallback, compiled, journey, position, routes, default_next)
+
+
+def _compile_options(step_id, options, routes, examples, actions, labels_only=False):
+    """Normalise options to labels or (label, value) pairs, collecting routes, examples and actions"""
+    seen = set()
+    for option in options:
+        if isinstance(option, str):
+            option = {'label': option}
+        label = option.get('label')
+        if not label:
+            raise FlowError(f"option without a label in step '{step_id}'")
+        value = label if labels_only else option.get('value', label)
+        if value in seen:
+            raise FlowError(f"duplicate option value {value!r} in step '{step_id}'")
+        seen.add(value)
+        if 'next' in option:
+            routes[(step_id, value)] = option['next']
+        examples[value] = tuple(option.get('examples', ()))
+        if option.get('action'):
+            actions[value] = option['action']
+        yield label if labels_only else (label, value)
@@ -0,0 +1,63 @@
+"""
+Precompiled page fragments
+
+Most of a page's markup does not depend on the session: the header, the
+info panels and the contact block never change, and the progress tracker
+can only look one way per journey position. PageFragments builds all of
+that once per process, so a rerun looks the tracker up by current step
+and sends one ready-made string instead of formatting a block per step.
+The selections panel is the only part that depends on the conversation;
+it is rebuilt only for choices it has not seen before.
+"""
+
+import functools
+from textwrap import dedent
+from types import MappingProxyType
+
+SELECTIONS_CACHE_SIZE = 1024
+
+
+def compile_html(html):
+    """Markup as st.markdown will lay it out, dedented and trimmed once"""
+    return dedent(html).strip()
+
+
+class PageFragments:
+    """Static markup and per-step tracker variants, shared by every session"""
+
+    def __init__(self, flow, tracker_step, tracker_stages, selections, missing, **static):
+        # tracker_step takes {number}, {step}, {title} and the keys of the stage
+        # ('done', 'current' or 'todo') styles; selections takes one {field}
+        # per recorded choice
+        self.static = MappingProxyType({name: compile_html(html) for name, html in static.items()})
+        self.tracker = self._compile_tracker(flow, compile_html(tracker_step), tracker_stages)
+        self.fields = tuple(dict.fromkeys(
+            step['records'] for step in flow.steps.values() if step.get('records')
+        ))
+        self._selections = compile_html(selections)
+        self._missing = missing
+        self._selections_html = functools.lru_cache(maxsize=SELECTIONS_CACHE_SIZE)(self._build_selections)
+
+    def selections(self, user_choices):
+        """Selections panel markup, built once per distinct set of choices"""
+        return self._selections_html(tuple(user_choices.get(field, '') for field in self.fields))
+
+    def _build_selections(self, values):
+        return self._selections.format(**{
+            field: value or self._missing for field, value in zip(self.fields, values)
+        })
+
+    @staticmethod
+    def _compile_tracker(flow, step_html, stages):
+        """Tracker markup for every step a conversation can be on"""
+        by_position = []
+        for position in range(len(flow.journey)):
+            blocks = []
+            for idx, step_id in enumerate(flow.journey):
+                stage = 'done' if idx < position else 'current' if idx == position else 'todo'
+                blocks.append(step_html.format(number=idx + 1, step=step_id, title=step_id.title(), **stages[stage]))
+            # A blank line between blocks keeps each one a separate HTML block
+            by_position.append('\n\n'.join(blocks))
+        return MappingProxyType({
+            step_id: by_position[flow.position.get(step_id, 0)] for step_id in flow.steps
+        })
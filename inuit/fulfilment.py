@@ -0,0 +1,552 @@
+"""
+Background order and email fulfilment
+
+Placing an order or emailing details must not hold up the rerun that
+asked for it, and must not be lost when the process restarts. submit()
+writes the job to an append-only journal and returns its id at once; a
+dispatcher thread hands due jobs to a small thread pool, and a failed
+attempt is retried with exponential backoff (with jitter) until it
+succeeds, fails permanently or runs out of attempts. Every change of a
+job's status is journalled, so jobs still queued or retrying when the
+process stops are picked up again on the next start.
+
+Both pages and every worker process run a queue of their own, so each
+queue writes its own journal in the journal directory and holds a lock
+on it while it runs. A starting queue takes over, under a directory
+lock, the journals nobody holds any more (those of stopped processes)
+and compacts them into its own; the journals of running queues are left
+alone, so no job is run by two processes.
+
+Orders go to an order API and confirmations out by SMTP. Both have local
+stand-ins for development and testing: LocalOrderAPI books orders into a
+JSONL file and OutboxMailer writes .eml files. They can also be run as
+services so the real clients can be pointed at them:
+
+    python -m inuit.fulfilment orders --port 8026   # INUIT_ORDER_API=http://localhost:8026/orders
+    python -m inuit.fulfilment smtp --port 8025     # INUIT_SMTP=localhost:8025
+
+Placing an order reuses the job id as the order's idempotency key, and the
+confirmation email gets an id derived from it, so a replayed job neither
+books nor mails twice.
+"""
+
+import argparse
+import atexit
+import heapq
+import itertools
+import json
+import os
+import random
+import smtplib
+import socketserver
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+QUEUED, RUNNING, RETRYING, DONE, FAILED = 'queued', 'running', 'retrying', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+WORKERS = 2
+MAX_ATTEMPTS = 6
+BACKOFF = 1.0  # seconds before the first retry, doubled for each one after
+MAX_BACKOFF = 60.0
+RETENTION = 24 * 3600  # how long finished jobs stay known, in seconds
+
+MAIL_FROM = os.environ.get('INUIT_MAIL_FROM', 'orders@inuit.com')
+# The flow does not ask for an address yet, so every email goes here
+MAIL_TO = os.environ.get('INUIT_MAIL_TO', 'customer@example.com')
+
+
+def lock_file(f, block=True):
+    """Lock an open file against other processes until it is closed; False if taken and not block"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if block else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if block:
+            raise
+        return False
+    return True
+
+
+class PermanentError(Exception):
+    """Raised by a job handler for a failure that retrying cannot fix"""
+
+
+class Job:
+    """One unit of background work and where it stands"""
+
+    __slots__ = ('id', 'kind', 'payload', 'status', 'attempts', 'error', 'result', 'updated')
+
+    def __init__(self, id, kind, payload, status=QUEUED, attempts=0, error=None, result=None, updated=None):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.status = status
+        self.attempts = attempts
+        self.error = error
+        self.result = result
+        self.updated = updated if updated is not None else time.time()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FulfilmentQueue:
+    """Durable work queue run by a thread pool, with retries and backoff"""
+
+    def __init__(self, journal_dir, handlers, workers=WORKERS, max_attempts=MAX_ATTEMPTS,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.journal_path = self.journal_dir / f"journal-{uuid.uuid4().hex}.jsonl"
+        self.handlers = dict(handlers)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._jobs = {}
+        self._finished = deque()  # (finished at, job id), oldest first
+        self._due = []  # heap of (due at, seq, job id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._closed = False
+        self._journal = None
+        unfinished = self._replay()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fulfilment')
+        for job in unfinished:
+            self._schedule(job, 0)
+        self._dispatcher = threading.Thread(target=self._dispatch, name='fulfilment', daemon=True)
+        self._dispatcher.start()
+        atexit.register(self.close)
+
+    def submit(self, kind, payload, job_id=None):
+        """Queue a job and return its id at once; a known job_id is not queued twice"""
+        if kind not in self.handlers:
+            raise ValueError(f"no handler for {kind!r} jobs")
+        job_id = job_id or uuid.uuid4().hex
+        with self._cond:
+            if job_id in self._jobs:
+                return job_id
+            job = self._jobs[job_id] = Job(job_id, kind, payload)
+        self._record(job)
+        self._schedule(job, 0)
+        return job_id
+
+    def status(self, job_id):
+        """Snapshot of a job as a dict, or None if it is not known"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return job.as_dict() if job is not None else None
+
+    def close(self):
+        """Stop taking jobs off the queue; running ones finish, the rest wait in the journal"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._dispatcher.join(timeout=5)
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._journal_lock:
+            self._journal.close()
+
+    def retry_delay(self, attempts):
+        """Seconds to wait after a job has failed attempts times"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _schedule(self, job, delay):
+        with self._cond:
+            heapq.heappush(self._due, (time.monotonic() + delay, next(self._seq), job.id))
+            self._cond.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._due or self._due[0][0] > time.monotonic()):
+                    self._cond.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                if self._closed:
+                    return
+                _, _, job_id = heapq.heappop(self._due)
+                job = self._jobs[job_id]
+                job.status = RUNNING
+            self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        job.attempts += 1
+        try:
+            result = self.handlers[job.kind](job, self)
+        except PermanentError as exc:
+            self._update(job, FAILED, error=str(exc))
+        except Exception as exc:
+            if job.attempts >= self.max_attempts:
+                self._update(job, FAILED, error=str(exc))
+            else:
+                self._update(job, RETRYING, error=str(exc))
+                self._schedule(job, self.retry_delay(job.attempts))
+        else:
+            self._update(job, DONE, result=result)
+
+    def _update(self, job, status, error=None, result=None):
+        now = time.time()
+        with self._cond:
+            job.status, job.error, job.result, job.updated = status, error, result, now
+            if status in FINISHED:
+                self._finished.append((now, job.id))
+                # Forget jobs finished longer ago than the retention period
+                while self._finished and self._finished[0][0] < now - RETENTION:
+                    self._jobs.pop(self._finished.popleft()[1], None)
+        self._record(job)
+
+    def _record(self, job):
+        with self._cond:
+            line = json.dumps(job.as_dict(), ensure_ascii=False)
+        with self._journal_lock:
+            if self._journal is None or self._journal.closed:
+                return
+            self._journal.write(line + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def _replay(self):
+        """Take over the journals of stopped queues, compact them into a new one of this
+        queue's own, and return their unfinished jobs"""
+        with open(self.journal_dir / 'journal.lock', 'a') as directory_lock:
+            lock_file(directory_lock)
+            latest = {}
+            adopted = []
+            for path in sorted(self.journal_dir.glob('journal*.jsonl')):
+                f = open(path, 'r+', encoding='utf-8')
+                if not lock_file(f, block=False):
+                    f.close()  # a running queue's journal
+                    continue
+                adopted.append((path, f))
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line torn by a crash
+                    known = latest.get(record['id'])
+                    if known is None or record['updated'] >= known['updated']:
+                        latest[record['id']] = record
+            cutoff = time.time() - RETENTION
+            kept = [
+                record for record in latest.values()
+                if record['status'] not in FINISHED or record['updated'] >= cutoff
+            ]
+            # The new journal is complete and locked before the old ones go
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            lock_file(self._journal)
+            for record in kept:
+                self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            for path, f in adopted:
+                f.close()
+                path.unlink()
+
+        unfinished = []
+        for record in sorted(kept, key=lambda record: record['updated']):
+            job = self._jobs[record['id']] = Job(**record)
+            if job.status in FINISHED:
+                self._finished.append((job.updated, job.id))
+            else:
+                job.status = QUEUED
+                unfinished.append(job)
+        return unfinished
+
+
+# ---------- Order and mail services ----------
+
+class LocalOrderAPI:
+    """Order service stand-in that books orders into a JSONL file"""
+
+    def __init__(self, path, fail_rate=0.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fail_rate = fail_rate
+        self._lock = threading.Lock()
+        self._placed = {}  # idempotency key -> confirmation
+        self._read_up_to = 0  # bytes of the order book already in _placed
+
+    def place(self, order, key):
+        """Book an order once per key; returns its confirmation"""
+        if random.random() < self.fail_rate:
+            raise ConnectionError("order service unavailable (simulated)")
+        with self._lock, open(self.path, 'a+', encoding='utf-8') as f:
+            # Other processes book into the same file; catch up with them under the lock
+            lock_file(f)
+            f.seek(self._read_up_to)
+            for line in f.read().splitlines():
+                record = json.loads(line)
+                self._placed[record['key']] = record['confirmation']
+            confirmation = self._placed.get(key)
+            if confirmation is None:
+                confirmation = {'order_number': f"IN-{key[:8].upper()}", 'delivery_days': '5-7'}
+                record = {'key': key, 'order': order, 'confirmation': confirmation, 'placed': time.time()}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                self._placed[key] = confirmation
+            self._read_up_to = f.tell()
+        return confirmation
+
+
+class HTTPOrderAPI:
+    """Client of an order service that takes JSON POSTs with an Idempotency-Key"""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def place(self, order, key):
+        """Post an order; 4xx answers are permanent failures, anything else is retried"""
+        request = Request(self.url, data=json.dumps(order).encode('utf-8'), method='POST', headers={
+            'Content-Type': 'application/json',
+            'Idempotency-Key': key,
+        })
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except HTTPError as exc:
+            if 400 <= exc.code < 500 and exc.code not in (408, 429):
+                raise PermanentError(f"order rejected with HTTP {exc.code}") from exc
+            raise
+
+
+def deliver(outbox, data):
+    """Write a raw message into an outbox directory as an .eml file"""
+    outbox = Path(outbox)
+    outbox.mkdir(parents=True, exist_ok=True)
+    path = outbox / f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.eml"
+    path.write_bytes(data)
+    return path
+
+
+class OutboxMailer:
+    """Mail stand-in that writes every message to an outbox directory"""
+
+    def __init__(self, outbox):
+        self.outbox = Path(outbox)
+
+    def send(self, message):
+        deliver(self.outbox, bytes(message))
+
+
+class SMTPMailer:
+    """Sends mail through an SMTP server"""
+
+    def __init__(self, host, port=25, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send(self, message):
+        """Send a message; 5xx answers and refused recipients are permanent failures"""
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                smtp.send_message(message)
+        except smtplib.SMTPRecipientsRefused as exc:
+            raise PermanentError(f"recipients refused: {', '.join(exc.recipients)}") from exc
+        except smtplib.SMTPResponseException as exc:
+            if exc.smtp_code >= 500:
+                raise PermanentError(f"SMTP {exc.smtp_code}: {exc.smtp_error!r}") from exc
+            raise
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """The subset of SMTP that smtplib needs to hand over a message"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 inuit-smtp ready')
+        for line in self.rfile:
+            verb = line[:4].decode('ascii', 'replace').upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 inuit-smtp')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in self.rfile:
+                    if data.rstrip(b'\r\n') == b'.':
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                deliver(self.server.outbox, b''.join(lines))
+                self.reply('250 OK: delivered')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """SMTP stand-in that drops every message it receives into an outbox directory"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, outbox):
+        super().__init__(address, _SMTPHandler)
+        self.outbox = Path(outbox)
+
+
+def serve_orders(address, api):
+    """HTTP stand-in of the order service in front of a LocalOrderAPI"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            key = self.headers.get('Idempotency-Key')
+            try:
+                order = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                order = None
+            if not key or not isinstance(order, dict):
+                self.send_error(400, "expected a JSON order and an Idempotency-Key")
+                return
+            try:
+                confirmation = api.place(order, key)
+            except ConnectionError as exc:
+                self.send_error(503, str(exc))
+                return
+            body = json.dumps(confirmation).encode('utf-8')
+            self.send_response(201)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer(address, Handler)
+
+
+# ---------- Jobs of the order step ----------
+
+def build_email(job):
+    """EmailMessage for an 'email' job; its id is stable so a resend can be spotted"""
+    message = EmailMessage()
+    message['From'] = MAIL_FROM
+    message['To'] = job.payload['to']
+    message['Subject'] = job.payload['subject']
+    message['Message-ID'] = f"<{job.id}@inuit.local>"
+    message.set_content(job.payload['body'])
+    return message
+
+
+def _choice_lines(choices):
+    return '\n'.join(f"{field.replace('_', ' ').title()}: {value or '-'}" for field, value in choices.items())
+
+
+def details_email(to, choices):
+    """Payload of the email that sends a shopper their selections"""
+    return {
+        'to': to,
+        'subject': "Your Inuit selections",
+        'body': f"Thank you for shopping with Inuit. Here is what you picked:\n\n{_choice_lines(choices)}\n",
+    }
+
+
+def confirmation_email(order, confirmation):
+    """Payload of the email that confirms a placed order"""
+    return {
+        'to': order['to'],
+        'subject': f"Your Inuit order {confirmation['order_number']}",
+        'body': (
+            f"Thank you for choosing Inuit!\n\nOrder {confirmation['order_number']}\n"
+            f"{_choice_lines(order['choices'])}\n\n"
+            f"Your order will arrive in {confirmation.get('delivery_days', '5-7')} business days. "
+            f"We'll send tracking details to this address.\n"
+        ),
+    }
+
+
+def fulfilment_handlers(orders, mailer):
+    """Job handlers that place orders through orders and send mail through mailer"""
+
+    def place_order(job, queue):
+        confirmation = orders.place(job.payload, key=job.id)
+        queue.submit('email', confirmation_email(job.payload, confirmation), job_id=f"{job.id}-email")
+        return confirmation
+
+    def send_email(job, queue):
+        mailer.send(build_email(job))
+        return {'to': job.payload['to']}
+
+    return {'order': place_order, 'email': send_email}
+
+
+def order_actions(queue, to=MAIL_TO):
+    """Engine actions for the order step; each returns the id of the job it queued"""
+
+    def place_order(state):
+        return queue.submit('order', {'to': to, 'choices': dict(state['user_choices'])})
+
+    def email_details(state):
+        return queue.submit('email', details_email(to, state['user_choices']))
+
+    return {'place_order': place_order, 'email_details': email_details}
+
+
+def queue_from_env(directory):
+    """Queue that talks to INUIT_ORDER_API and INUIT_SMTP, or to local stand-ins under directory"""
+    directory = Path(directory)
+    url = os.environ.get('INUIT_ORDER_API')
+    orders = HTTPOrderAPI(url) if url else LocalOrderAPI(directory / 'orders.jsonl')
+    smtp = os.environ.get('INUIT_SMTP')
+    if smtp:
+        host, _, port = smtp.rpartition(':')
+        mailer = SMTPMailer(host or 'localhost', int(port))
+    else:
+        mailer = OutboxMailer(directory / 'outbox')
+    return FulfilmentQueue(directory, fulfilment_handlers(orders, mailer))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-ins of the order and mail services")
+    commands = parser.add_subparsers(dest='command', required=True)
+    smtp = commands.add_parser('smtp', help="SMTP server that writes messages to an outbox")
+    smtp.add_argument('--host', default='localhost')
+    smtp.add_argument('--port', type=int, default=8025)
+    smtp.add_argument('--outbox', default='.cache/fulfilment/smtp-outbox')
+    orders = commands.add_parser('orders', help="order API that books orders into a JSONL file")
+    orders.add_argument('--host', default='localhost')
+    orders.add_argument('--port', type=int, default=8026)
+    orders.add_argument('--path', default='.cache/fulfilment/orders-api.jsonl')
+    orders.add_argument('--fail-rate', type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args(argv)
+
+    if args.command == 'smtp':
+        server = LocalSMTPServer((args.host, args.port), args.outbox)
+        print(f"SMTP stand-in on {args.host}:{args.port}, writing to {args.outbox}")
+    else:
+        server = serve_orders((args.host, args.port), LocalOrderAPI(args.path, args.fail_rate))
+        print(f"order API stand-in on http://{args.host}:{args.port}/orders, booking into {args.path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
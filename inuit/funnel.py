@@ -0,0 +1,132 @@
+"""
+Cross-session funnel counters
+
+FunnelCounters is an engine listener that keeps running counts of the
+funnel events of its process: conversations reaching each step ('reach',
+once per conversation), step entries, choices by value and fallback
+replies. Each event is one dict increment. Every flush interval the counts
+gathered since the last flush are added to a shared SQLite table in one
+transaction, so all server processes (and the simulator) merge into the
+same totals. The admin page reads those few rows; nothing ever scans the
+event log.
+"""
+
+import atexit
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+FLUSH_INTERVAL = 2.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS funnel (
+    event TEXT NOT NULL,
+    step TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (event, step, value)
+) WITHOUT ROWID
+"""
+
+
+class FunnelCounters:
+    """This process's funnel counts, merged into a shared SQLite table"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self._delta = {}  # (event, step, value) -> count since the last flush
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        with closing(_connect(self.path)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+            conn.commit()
+        self._flusher = threading.Thread(target=self._run, name='funnel', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def record(self, event, state, step, value=None):
+        """Engine listener: count one event"""
+        key = (event, step, '' if value is None else str(value))
+        with self._lock:
+            self._delta[key] = self._delta.get(key, 0) + 1
+
+    def flush(self):
+        """Add the counts gathered since the last flush to the shared table"""
+        with self._lock:
+            delta, self._delta = self._delta, {}
+        if not delta:
+            return 0
+        try:
+            with closing(_connect(self.path)) as conn, conn:
+                conn.executemany(
+                    'INSERT INTO funnel (event, step, value, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(event, step, value) DO UPDATE SET count = count + excluded.count',
+                    [(*key, count) for key, count in delta.items()]
+                )
+        except sqlite3.Error:
+            # Fold the counts back in for the next flush
+            with self._lock:
+                for key, count in delta.items():
+                    self._delta[key] = self._delta.get(key, 0) + count
+            raise
+        return len(delta)
+
+    def close(self):
+        """Stop the flusher and merge what is still counted"""
+        if not self._closed.is_set():
+            self._closed.set()
+            self._flusher.join(timeout=5)
+            self.flush()
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+
+def _connect(path):
+    return sqlite3.connect(path, timeout=10)
+
+
+def load_totals(path):
+    """Merged counts as {(event, step, value): count}; empty if nothing was counted yet"""
+    if not Path(path).exists():
+        return {}
+    with closing(_connect(path)) as conn:
+        try:
+            rows = conn.execute('SELECT event, step, value, count FROM funnel').fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    return {(event, step, value): count for event, step, value, count in rows}
+
+
+def funnel_table(flow, totals):
+    """Per journey step: conversations reaching it, conversion from the step before and overall"""
+    rows = []
+    started = totals.get(('reach', flow.start, ''), 0)
+    previous = None
+    for step_id in flow.journey:
+        reached = totals.get(('reach', step_id, ''), 0)
+        rows.append({
+            'step': step_id,
+            'reached': reached,
+            'entries': totals.get(('enter', step_id, ''), 0),
+            'step_conversion': round(reached / previous, 4) if previous else None,
+            'overall_conversion': round(reached / started, 4) if started else None,
+            'fallbacks': totals.get(('fallback', step_id, ''), 0),
+        })
+        previous = reached
+    return rows
+
+
+def choice_table(totals, step_id):
+    """How often each value was chosen on a step, most chosen first"""
+    counts = [(value, count) for (event, step, value), count in totals.items() if event == 'choice' and step == step_id]
+    return [{'choice': value, 'count': count} for value, count in sorted(counts, key=lambda item: -item[1])]
+
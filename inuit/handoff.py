@@ -0,0 +1,437 @@
+"""
+Expert handoff broker
+
+"Chat with Expert" and "Human Agent" put the conversation in a queue for
+a human expert. HandoffBroker runs an asyncio event loop in one background
+thread: a waiting conversation is a small record in an ordered dict, not a
+thread or a task, so a process can hold thousands of them. Agents connect
+to the broker over TCP, say how many chats they can take at once, and get
+one free slot per chat. A single dispatcher hands the longest-waiting
+conversation to the next free slot, so agents are never sent more than
+they asked for and customers simply keep their place until a slot opens.
+Queue positions are refreshed twice a second. If the queue is full, the
+request is turned down straight away rather than left waiting. The pages
+poll status() and receive() every few seconds; a waiting conversation
+that has not been polled for WAITING_IDLE seconds (its tab was closed or
+its session is gone) is dropped from the queue on the next refresh.
+
+Messages are relayed both ways as soon as they arrive: what a customer
+types goes straight to the agent's connection (anything typed while still
+waiting is passed on when the agent joins), and what the agent sends is
+put in the conversation's inbox for the page to pick up. The pages call
+in from their script threads; those calls run on the broker's loop and
+return within a loop iteration.
+
+Agents speak JSON lines. The agent sends {"type": "hello", "name": ...,
+"capacity": ...} first, then {"type": "message", "session": ..., "text":
+...} and {"type": "close", "session": ...}; the broker sends "assigned"
+(with the customer's choices and what they typed while waiting),
+"message" and "left". A local console stands in for the agents' tool:
+
+    python -m inuit.handoff console --name Ana --capacity 2
+    python -m inuit.handoff console --auto --capacity 50   # answers by itself
+
+The broker lives in the server process, so a conversation's expert chat
+stays with the worker process that queued it. It starts listening when a
+page first uses it, on INUIT_AGENT_PORT (default 8765) if that is free;
+when another process already has the port (the other page, or a second
+worker) it takes a free port of its own and prints which one.
+"""
+
+import argparse
+import asyncio
+import atexit
+import errno
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+WAITING, CONNECTED, CLOSED, BUSY = 'waiting', 'connected', 'closed', 'busy'
+
+AGENT_HOST = os.environ.get('INUIT_AGENT_HOST', 'localhost')
+AGENT_PORT = int(os.environ.get('INUIT_AGENT_PORT', 8765))
+MAX_WAITING = 10000
+POSITION_INTERVAL = 0.5
+WAITING_IDLE = float(os.environ.get('INUIT_HANDOFF_IDLE', 30))  # pages poll every few seconds
+CALL_TIMEOUT = 5
+INBOX_SIZE = 200  # agent messages kept for a page that has not picked them up
+
+
+class Handoff:
+    """One conversation waiting for or talking to an agent"""
+
+    __slots__ = ('conversation_id', 'summary', 'state', 'position', 'agent', 'pending', 'inbox', 'polled')
+
+    def __init__(self, conversation_id, summary, position):
+        self.conversation_id = conversation_id
+        self.summary = summary
+        self.state = WAITING
+        self.position = position
+        self.agent = None
+        self.pending = []  # typed while waiting, passed on when an agent joins
+        # (event, agent name, text) for the page; deque appends and pops are atomic
+        self.inbox = deque(maxlen=INBOX_SIZE)
+        self.polled = time.monotonic()  # last time the page asked about it
+
+
+class Agent:
+    """One connected agent console"""
+
+    def __init__(self, name, capacity, writer):
+        self.name = name
+        self.capacity = capacity
+        self.writer = writer
+        self.sessions = set()
+        self.closed = False
+
+    def send(self, message):
+        if not self.closed:
+            self.writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class HandoffBroker:
+    """Queue of conversations waiting for an expert, routed to agent consoles on an asyncio loop"""
+
+    def __init__(self, host=AGENT_HOST, port=AGENT_PORT, max_waiting=MAX_WAITING,
+                 position_interval=POSITION_INTERVAL, waiting_idle=WAITING_IDLE):
+        self.host = host
+        self.requested_port = port
+        self.max_waiting = max_waiting
+        self.position_interval = position_interval
+        self.waiting_idle = waiting_idle
+        self.port = None  # the port agents connect on, once started
+        self._handoffs = {}  # conversation id -> Handoff; read from script threads
+        self._waiting = OrderedDict()  # conversation id -> Handoff, longest waiting first
+        self._agents = set()
+        self._loop = None
+        self._start_lock = threading.Lock()
+
+    # ---- called from script threads ----
+
+    def start(self):
+        """Start the loop and listen for agents, if not done yet; returns the port agents connect on"""
+        if self._loop is not None:
+            return self.port
+        with self._start_lock:
+            if self._loop is not None:
+                return self.port
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='handoff', daemon=True)
+            thread.start()
+            try:
+                port = asyncio.run_coroutine_threadsafe(self._start(self.host, self.requested_port),
+                                                        loop).result(CALL_TIMEOUT)
+            except BaseException:
+                # Leave no loop thread behind; the next call tries again
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join(timeout=CALL_TIMEOUT)
+                loop.close()
+                raise
+            self._thread, self.port = thread, port
+            self._loop = loop
+            atexit.register(self.close)
+        if self.requested_port and port != self.requested_port:
+            print(f"Expert broker: port {self.requested_port} is taken, agents connect on port {port}",
+                  file=sys.stderr)
+        return port
+
+    def request(self, conversation_id, summary=None):
+        """Queue a conversation for an expert; returns its queue position, or None if the queue is full"""
+        return self._call(self._request, conversation_id, summary or {})
+
+    def relay(self, conversation_id, text):
+        """Pass a customer's message to their expert; False if the conversation has none"""
+        return self._call(self._relay, conversation_id, text)
+
+    def leave(self, conversation_id):
+        """Take a conversation out of the queue or away from its expert"""
+        self._call(self._leave, conversation_id)
+
+    def status(self, conversation_id):
+        """{'state', 'position', 'agent'} of a conversation's handoff, or None if it has none"""
+        handoff = self._handoffs.get(conversation_id)
+        if handoff is None:
+            return None
+        handoff.polled = time.monotonic()
+        agent = handoff.agent.name if handoff.agent is not None else None
+        return {'state': handoff.state, 'position': handoff.position, 'agent': agent}
+
+    def receive(self, conversation_id):
+        """Take what happened since the last call, as (event, agent name, text) tuples"""
+        handoff = self._handoffs.get(conversation_id)
+        if handoff is None:
+            return []
+        handoff.polled = time.monotonic()
+        events = []
+        try:
+            while True:
+                events.append(handoff.inbox.popleft())
+        except IndexError:
+            pass
+        if handoff.state in (CLOSED, BUSY):
+            # Everything about a finished handoff has been passed on now
+            self._call(self._forget, handoff)
+        return events
+
+    def stats(self):
+        """Conversations waiting and connected, agents and free chat slots"""
+        return self._call(lambda: {
+            'waiting': len(self._waiting),
+            'connected': sum(len(agent.sessions) for agent in self._agents),
+            'agents': len(self._agents),
+            'free_slots': sum(agent.capacity - len(agent.sessions) for agent in self._agents),
+        })
+
+    def close(self):
+        """Disconnect the agents and stop the loop"""
+        if self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(CALL_TIMEOUT)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=CALL_TIMEOUT)
+
+    def _call(self, fn, *args):
+        """Run fn(*args) on the loop and return its result"""
+        self.start()
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+
+        self._loop.call_soon_threadsafe(run)
+        return future.result(CALL_TIMEOUT)
+
+    # ---- on the loop ----
+
+    async def _start(self, host, port):
+        self._free = asyncio.Queue()  # one entry per free chat slot of an agent
+        self._queued = asyncio.Event()
+        try:
+            self._server = await asyncio.start_server(self._serve_agent, host, port)
+        except OSError as exc:
+            if not port or exc.errno != errno.EADDRINUSE:
+                raise
+            self._server = await asyncio.start_server(self._serve_agent, host, 0)
+        self._tasks = [
+            asyncio.create_task(self._dispatch()),
+            asyncio.create_task(self._update_positions()),
+        ]
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _stop(self):
+        self._server.close()
+        for task in self._tasks:
+            task.cancel()
+        for agent in list(self._agents):
+            agent.closed = True
+            agent.writer.close()
+
+    def _request(self, conversation_id, summary):
+        handoff = self._handoffs.get(conversation_id)
+        if handoff is not None and handoff.state in (WAITING, CONNECTED):
+            handoff.polled = time.monotonic()
+            return handoff.position
+        if len(self._waiting) >= self.max_waiting:
+            handoff = self._handoffs[conversation_id] = Handoff(conversation_id, summary, None)
+            handoff.state = BUSY
+            handoff.inbox.append((BUSY, None, None))
+            return None
+        handoff = Handoff(conversation_id, summary, len(self._waiting) + 1)
+        self._handoffs[conversation_id] = self._waiting[conversation_id] = handoff
+        self._queued.set()
+        return handoff.position
+
+    def _relay(self, conversation_id, text):
+        handoff = self._handoffs.get(conversation_id)
+        if handoff is None or handoff.state not in (WAITING, CONNECTED):
+            return False
+        if handoff.state == WAITING:
+            handoff.pending.append(text)
+        else:
+            handoff.agent.send({'type': 'message', 'session': conversation_id, 'text': text})
+        return True
+
+    def _leave(self, conversation_id):
+        handoff = self._handoffs.pop(conversation_id, None)
+        if handoff is None:
+            return
+        self._waiting.pop(conversation_id, None)
+        if handoff.state == CONNECTED:
+            handoff.agent.send({'type': 'left', 'session': conversation_id})
+            self._release(handoff)
+
+    def _forget(self, handoff):
+        if self._handoffs.get(handoff.conversation_id) is handoff:
+            del self._handoffs[handoff.conversation_id]
+
+    def _release(self, handoff):
+        """Give the agent's slot back once a chat is over"""
+        agent = handoff.agent
+        agent.sessions.discard(handoff.conversation_id)
+        if not agent.closed:
+            self._free.put_nowait(agent)
+
+    async def _dispatch(self):
+        while True:
+            agent = await self._free.get()
+            if agent.closed:
+                continue
+            while not self._waiting:
+                self._queued.clear()
+                await self._queued.wait()
+            if agent.closed:
+                continue
+            conversation_id, handoff = self._waiting.popitem(last=False)
+            handoff.state = CONNECTED
+            handoff.position = 0
+            handoff.agent = agent
+            agent.sessions.add(conversation_id)
+            agent.send({'type': 'assigned', 'session': conversation_id,
+                        'summary': handoff.summary, 'pending': handoff.pending})
+            handoff.pending = []
+            handoff.inbox.append(('joined', agent.name, None))
+
+    async def _update_positions(self):
+        while True:
+            await asyncio.sleep(self.position_interval)
+            self._expire_waiting()
+            for position, handoff in enumerate(self._waiting.values(), 1):
+                handoff.position = position
+
+    def _expire_waiting(self):
+        """Drop waiting conversations whose page stopped polling, so they hold no place in the queue"""
+        cutoff = time.monotonic() - self.waiting_idle
+        for conversation_id in [key for key, handoff in self._waiting.items() if handoff.polled < cutoff]:
+            self._leave(conversation_id)
+
+    async def _serve_agent(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+            agent = Agent(str(hello.get('name') or 'Expert'), max(1, int(hello.get('capacity', 1))), writer)
+        except (ValueError, TypeError, AttributeError):
+            writer.close()
+            return
+        self._agents.add(agent)
+        for _ in range(agent.capacity):
+            self._free.put_nowait(agent)
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                    handoff = self._handoffs.get(message['session'])
+                except (ValueError, TypeError, KeyError):
+                    continue
+                if handoff is None or handoff.agent is not agent or handoff.state != CONNECTED:
+                    continue
+                if message.get('type') == 'message':
+                    handoff.inbox.append(('message', agent.name, str(message.get('text', ''))))
+                elif message.get('type') == 'close':
+                    handoff.state = CLOSED
+                    handoff.inbox.append(('left', agent.name, None))
+                    self._release(handoff)
+        except ConnectionError:
+            pass
+        finally:
+            agent.closed = True
+            self._agents.discard(agent)
+            writer.close()
+            # Customers of a lost agent go back to the front of the queue
+            for conversation_id in list(agent.sessions):
+                handoff = self._handoffs.get(conversation_id)
+                if handoff is None:
+                    continue
+                handoff.state = WAITING
+                handoff.agent = None
+                handoff.position = 1
+                handoff.inbox.append(('requeued', agent.name, None))
+                self._waiting[conversation_id] = handoff
+                self._waiting.move_to_end(conversation_id, last=False)
+                self._queued.set()
+            agent.sessions.clear()
+
+
+def handoff_actions(broker):
+    """Engine actions that put the conversation in the queue for an expert"""
+
+    def request_expert(state):
+        broker.request(state['conversation_id'], dict(state['user_choices']))
+
+    return {'request_expert': request_expert}
+
+
+async def run_console(host, port, name, capacity, auto=False):
+    """Agent console on the terminal: type '<chat number> <message>' or '/close <chat number>'"""
+    reader, writer = await asyncio.open_connection(host, port)
+
+    def send(message):
+        writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    send({'type': 'hello', 'name': name, 'capacity': capacity})
+    chats = {}  # chat number -> conversation id
+    numbers = {}
+
+    async def read_input():
+        loop = asyncio.get_running_loop()
+        while True:
+            line = (await loop.run_in_executor(None, sys.stdin.readline))
+            if not line:
+                return
+            command, _, text = line.strip().partition(' ')
+            if command == '/close' and text in chats:
+                send({'type': 'close', 'session': chats.pop(text)})
+            elif command in chats and text:
+                send({'type': 'message', 'session': chats[command], 'text': text})
+            else:
+                print("usage: <chat number> <message> | /close <chat number>")
+
+    if not auto:
+        asyncio.create_task(read_input())
+    print(f"{name} connected to {host}:{port} for up to {capacity} chats")
+    async for line in reader:
+        message = json.loads(line)
+        conversation_id = message['session']
+        if message['type'] == 'assigned':
+            number = numbers[conversation_id] = str(len(numbers) + 1)
+            chats[number] = conversation_id
+            choices = ', '.join(f"{key}: {value}" for key, value in message['summary'].items() if value)
+            print(f"[{number}] new chat ({choices or 'no choices yet'})")
+            for text in message['pending']:
+                print(f"[{number}] customer: {text}")
+            if auto:
+                send({'type': 'message', 'session': conversation_id,
+                      'text': f"Hi, I'm {name}, one of the Inuit footwear experts. How can I help?"})
+        elif message['type'] == 'message':
+            print(f"[{numbers.get(conversation_id, '?')}] customer: {message['text']}")
+            if auto:
+                send({'type': 'message', 'session': conversation_id, 'text': f"Noted: {message['text']}"})
+        elif message['type'] == 'left':
+            number = numbers.get(conversation_id, '?')
+            chats.pop(number, None)
+            print(f"[{number}] customer left")
+    print("broker closed the connection")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in of the expert agents' console")
+    commands = parser.add_subparsers(dest='command', required=True)
+    console = commands.add_parser('console', help="take expert chats from the terminal")
+    console.add_argument('--host', default=AGENT_HOST)
+    console.add_argument('--port', type=int, default=AGENT_PORT)
+    console.add_argument('--name', default='Ana')
+    console.add_argument('--capacity', type=int, default=2, help="chats taken at once")
+    console.add_argument('--auto', action='store_true', help="greet and acknowledge customers without input")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run_console(args.host, args.port, args.name, args.capacity, args.auto))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Bounded chat history window
+
+Only the last HISTORY_WINDOW messages stay in the live transcript. Older
+turns are folded into a capped archive that the page shows as a single
+collapsed "load earlier" element, so the number of rendered elements stays
+the same however long a session runs.
+"""
+
+from collections import deque
+
+HISTORY_WINDOW = 20
+ARCHIVE_LIMIT = 200
+
+
+def new_archive(limit=ARCHIVE_LIMIT):
+    """Create an empty archive that drops its oldest turns past the limit"""
+    return deque(maxlen=limit)
+
+
+def fold_history(history, archive, limit=HISTORY_WINDOW):
+    """Move messages beyond the window into the archive and return them"""
+    overflow = len(history) - limit
+    if overflow <= 0:
+        return []
+    folded = history[:overflow]
+    del history[:overflow]
+    archive.extend(folded)
+    return folded
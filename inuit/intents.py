@@ -0,0 +1,118 @@
+"""
+Free-text intent matching
+
+Typed messages are matched against the options on screen (and the fallback
+step's navigation options) with hashed character n-gram TF-IDF vectors.
+Each option contributes its label, its value and the 'examples' listed for
+it in the flow definition, one row per phrase. The matrix is built once per
+process, and a lookup is a few small NumPy operations, well under a
+millisecond.
+"""
+
+import math
+import re
+import zlib
+
+import numpy as np
+
+NGRAM_SIZES = (2, 3, 4)
+HASH_MASK = (1 << 20) - 1
+
+# Minimum cosine similarity for a phrase to count as a match
+MIN_SCORE = 0.4
+
+_NON_WORD = re.compile(r"[^\w.']+")
+
+
+def normalize(text):
+    """Lowercase text and reduce emoji and punctuation to single spaces"""
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def ngram_counts(text):
+    """Hashed character n-gram id -> count for a piece of text"""
+    text = f" {normalize(text)} "
+    counts = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            feature = zlib.crc32(text[i:i + n].encode('utf-8')) & HASH_MASK
+            counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+
+class IntentIndex:
+    """TF-IDF matrix over option phrases, grouped by step"""
+
+    def __init__(self, phrases):
+        # phrases: (step_id, value, text); rows are kept grouped by step
+        order = {}
+        for step_id, _, _ in phrases:
+            order.setdefault(step_id, len(order))
+        phrases = sorted(phrases, key=lambda phrase: order[phrase[0]])
+        self.intents = [(step_id, value) for step_id, value, _ in phrases]
+
+        self.step_rows = {}
+        for row, (step_id, _) in enumerate(self.intents):
+            start = self.step_rows.get(step_id, slice(row, row)).start
+            self.step_rows[step_id] = slice(start, row + 1)
+
+        counts = [ngram_counts(text) for _, _, text in phrases]
+        df = {}
+        for row_counts in counts:
+            for feature in row_counts:
+                df[feature] = df.get(feature, 0) + 1
+        n_rows = len(counts)
+        self.idf = {feature: math.log((1 + n_rows) / (1 + d)) + 1 for feature, d in df.items()}
+        self.column = {feature: col for col, feature in enumerate(df)}
+
+        # Feature-major so a query gathers just the rows of its own n-grams
+        matrix = np.zeros((len(self.column), n_rows), dtype=np.float32)
+        for row, row_counts in enumerate(counts):
+            for feature, count in row_counts.items():
+                matrix[self.column[feature], row] = count * self.idf[feature]
+        norms = np.linalg.norm(matrix, axis=0)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms
+
+    @classmethod
+    def from_flow(cls, flow):
+        """Build the index from every option in a compiled Flow"""
+        phrases = []
+        for step_id, step in flow.steps.items():
+            examples = step.get('examples')
+            if not examples:
+                continue
+            for option in step['options']:
+                label, value = option if isinstance(option, tuple) else (option, option)
+                texts = dict.fromkeys((label, value, *examples.get(value, ())))
+                phrases.extend((step_id, value, text) for text in texts if normalize(text))
+        return cls(phrases)
+
+    def classify(self, text, step_ids):
+        """Best (step_id, value, score) among the options of step_ids, or None"""
+        # N-grams never seen in any phrase are left out of the query vector,
+        # so filler words around a known phrase do not drown it out
+        cols, weights = [], []
+        for feature, count in ngram_counts(text).items():
+            col = self.column.get(feature)
+            if col is not None:
+                cols.append(col)
+                weights.append(count * self.idf[feature])
+        if not cols:
+            return None
+        weights = np.asarray(weights, dtype=np.float32)
+        scores = weights @ self.matrix[cols]
+        scores /= np.linalg.norm(weights)
+
+        best = None
+        for step_id in step_ids:
+            rows = self.step_rows.get(step_id)
+            if rows is None:
+                continue
+            row = rows.start + int(np.argmax(scores[rows]))
+            if best is None or scores[row] > scores[best]:
+                best = row
+        if best is None or scores[best] < MIN_SCORE:
+            return None
+        step_id, value = self.intents[best]
+        return step_id, value, float(scores[best])
@@ -0,0 +1,41 @@
+"""
+Compact chat message records
+
+A message keeps only what differs from one message to the next: its id, a
+sender flag, the step it belongs to, an integer epoch timestamp and its
+interned text. Step payloads (options, products, videos) are looked up in
+the shared Flow when the message is rendered, so a long session holds a few
+small objects per turn instead of dicts that point at whole steps.
+"""
+
+import sys
+
+BOT = 0
+USER = 1
+
+
+class Message:
+    """One chat message"""
+
+    __slots__ = ('id', 'sender', 'step', 'time', 'text')
+
+    def __init__(self, msg_id, sender, text, time, step=None):
+        self.id = msg_id
+        self.sender = sender
+        self.step = sys.intern(step) if step is not None else None
+        self.time = int(time)
+        self.text = sys.intern(text)
+
+    def as_tuple(self):
+        """Constructor arguments, for compact serialization: Message(*msg.as_tuple())"""
+        return (self.id, self.sender, self.text, self.time, self.step)
+
+    def __getstate__(self):
+        return self.as_tuple()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        who = 'bot' if self.sender == BOT else 'user'
+        return f"Message({self.id}, {who}, step={self.step!r}, text={self.text[:30]!r})"
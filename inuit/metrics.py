@@ -0,0 +1,174 @@
+"""
+Timing spans for the page's hot paths
+
+Page sections and handlers are wrapped in span('name') blocks, or decorated
+with @timed('name'). Durations go into in-process histograms that a
+background thread writes out as a Prometheus text file, and that the
+pages can show in a debug panel.
+
+Metrics are off unless INUIT_METRICS=on. When off, span() hands back one
+shared no-op context manager and timed() returns the function untouched,
+so the instrumentation costs next to nothing.
+"""
+
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+ENABLED = os.environ.get('INUIT_METRICS', 'off') == 'on'
+METRICS_PATH = Path(os.environ.get('INUIT_METRICS_FILE', Path(__file__).parent.parent / '.cache' / 'metrics.prom'))
+EXPORT_INTERVAL = 15
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Bucketed latency histogram with Prometheus semantics"""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Registry:
+    """Histograms by span name, safe to update from every session's thread"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Rows of count, mean and p50/p95/p99 in milliseconds, one per span"""
+        with self._lock:
+            return [
+                {
+                    'span': name,
+                    'count': h.count,
+                    'mean_ms': round(h.total / h.count * 1000, 2),
+                    'p50_ms': round(h.quantile(0.5) * 1000, 2),
+                    'p95_ms': round(h.quantile(0.95) * 1000, 2),
+                    'p99_ms': round(h.quantile(0.99) * 1000, 2),
+                }
+                for name, h in sorted(self._histograms.items())
+            ]
+
+    def prometheus(self):
+        """All histograms in the Prometheus text exposition format"""
+        lines = [
+            '# HELP inuit_span_seconds Time spent in instrumented page sections and handlers',
+            '# TYPE inuit_span_seconds histogram',
+        ]
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ('+Inf',), h.counts):
+                    cumulative += n
+                    lines.append(f'inuit_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'inuit_span_seconds_sum{{span="{name}"}} {h.total:.6f}')
+                lines.append(f'inuit_span_seconds_count{{span="{name}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=METRICS_PATH):
+        """Atomically write the Prometheus text file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(self.prometheus(), encoding='utf-8')
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, time.perf_counter() - self.started)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Context manager that times its block under name"""
+    return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name):
+    """Decorator that times every call of a function under name"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def start_exporter(path=METRICS_PATH, interval=EXPORT_INTERVAL):
+    """Write the Prometheus file every interval seconds (no-op when disabled)"""
+    if not ENABLED:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            REGISTRY.export(path)
+
+    thread = threading.Thread(target=run, name='metrics-exporter', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,82 @@
+"""
+Rendered-fragment cache for chat messages
+
+Past messages never change, so each one is turned into HTML once and the
+string is reused on every rerun. Bot messages tied to a conversation step
+share their markup across all sessions, keyed by step and text, since a
+step can also carry other replies (a search note); only the timestamp is
+spliced in per message. A fresh reply is streamed instead:
+its lines are revealed one after another by the browser (see
+inuit/delay.py), so it is built once for the run that shows it first.
+"""
+
+from datetime import datetime
+
+from inuit.delay import stream_lines
+from inuit.messages import BOT
+
+TIME_FORMAT = '%I:%M %p'
+
+# Marker used to split a step's bot template around its timestamp
+_TIME_SLOT = '\x00time\x00'
+
+
+class MessageRenderer:
+    """Build chat message HTML once and hand back the cached fragment afterwards"""
+
+    def __init__(self, bot_template, user_template):
+        # Templates take {message} and {time} placeholders
+        self.bot_template = bot_template
+        self.user_template = user_template
+        # (step id, text) -> (head, tail) around the timestamp, shared by all sessions
+        self._step_parts = {}
+
+    def render(self, msg, cache):
+        """Return the HTML for a message, using the per-session cache"""
+        html = cache.get(msg.id)
+        if html is None:
+            html = self._build(msg)
+            cache[msg.id] = html
+        return html
+
+    def prune(self, cache, history):
+        """Drop cached fragments of messages that left the live history"""
+        live = {msg.id for msg in history}
+        for msg_id in [msg_id for msg_id in cache if msg_id not in live]:
+            del cache[msg_id]
+
+    def stream(self, msg, delay):
+        """HTML for a fresh reply whose lines show one by one, with when the first and last appear"""
+        schedule = list(stream_lines(msg.text, delay))
+        message = '\n'.join(
+            f'<span class="stream-line" style="animation-delay: {shown_at:.2f}s;">{line}</span>'
+            for line, shown_at in schedule
+        )
+        html = self._template(msg).format(message=message, time=_time_label(msg))
+        return html, schedule[0][1], schedule[-1][1]
+
+    def render_many(self, messages):
+        """Return the joined HTML for messages without keeping it around"""
+        return ''.join(self._build(msg) for msg in messages)
+
+    def _build(self, msg):
+        time_label = _time_label(msg)
+        if msg.sender == BOT and msg.step is not None:
+            head, tail = self._shared_parts(msg.step, msg.text)
+            return head + time_label + tail
+        return self._template(msg).format(message=msg.text, time=time_label)
+
+    def _template(self, msg):
+        return self.bot_template if msg.sender == BOT else self.user_template
+
+    def _shared_parts(self, step_id, message):
+        key = (step_id, message)
+        parts = self._step_parts.get(key)
+        if parts is None:
+            html = self.bot_template.format(message=message, time=_TIME_SLOT)
+            parts = self._step_parts.setdefault(key, tuple(html.split(_TIME_SLOT)))
+        return parts
+
+
+def _time_label(msg):
+    return datetime.fromtimestamp(msg.time).strftime(TIME_FORMAT)
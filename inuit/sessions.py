@@ -0,0 +1,163 @@
+"""
+Resident conversation states with an idle spill and a memory budget
+
+st.session_state only holds a session id; the conversation itself lives
+in a process-wide SessionManager. The manager keeps recently used states
+in memory in LRU order. Every change is already saved to the SessionStore
+(compressed blobs in SQLite), so spilling a session only drops its
+resident copy: once it has been idle for IDLE_AFTER seconds, or least
+recently used first when the resident states outgrow MEMORY_BUDGET. A
+spilled session is loaded back on its next get(), so the pages never
+notice, and memory stays flat however many visitors have come and gone.
+
+Views may keep transient entries in a state, such as a 'render_cache' of
+HTML fragments; they count towards the budget but are not persisted.
+
+When several worker processes share the store, another worker may have
+moved a conversation on since this one last saw it. get() therefore asks
+the store whether the resident copy is still current and loads the newer
+state if not, and a save() that loses the race to another worker is
+dropped (the store refuses it) so the next get() shows the winner.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from inuit.backends import StaleSession
+
+IDLE_AFTER = float(os.environ.get('INUIT_SESSION_IDLE', 600))
+MEMORY_BUDGET = int(float(os.environ.get('INUIT_SESSION_MEMORY_MB', 64)) * 1024 * 1024)
+SWEEP_INTERVAL = 30
+
+# Rough resident sizes used to charge states against the budget
+STATE_SIZE = 1500
+MESSAGE_SIZE = 120
+
+
+def state_size(state):
+    """Approximate bytes a conversation state keeps resident"""
+    size = STATE_SIZE
+    for messages in (state['chat_history'], state['chat_archive']):
+        size += len(messages) * MESSAGE_SIZE
+        size += sum(len(msg.text) for msg in messages if msg.step is None)
+    size += sum(len(html) for html in state.get('render_cache', {}).values())
+    return size
+
+
+class SessionManager:
+    """In-memory LRU of conversation states over a SessionStore"""
+
+    def __init__(self, store, idle_after=IDLE_AFTER, memory_budget=MEMORY_BUDGET,
+                 sweep_interval=SWEEP_INTERVAL):
+        self.store = store
+        self.idle_after = idle_after
+        self.memory_budget = memory_budget
+        self._resident = OrderedDict()  # session id -> [state, size, last used]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.spilled = 0
+        self.rehydrated = 0
+        self.refreshed = 0
+        self.conflicts = 0
+        self._sweeper = threading.Thread(target=self._sweep_forever, args=(sweep_interval,),
+                                         name='session-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def get(self, session_id):
+        """State of a session, loaded back from the store if it was spilled"""
+        with self._lock:
+            resident = session_id in self._resident
+        if resident and not self.store.is_current(session_id):
+            # Another worker saved a newer state; drop ours and load theirs
+            self._spill(session_id, refreshed=True)
+        with self._lock:
+            entry = self._resident.get(session_id)
+            if entry is not None:
+                # Re-charge the state: views may have added to its transient entries
+                size = state_size(entry[0])
+                self._bytes += size - entry[1]
+                entry[1:] = [size, time.monotonic()]
+                self._resident.move_to_end(session_id)
+                return entry[0]
+        state = self.store.load(session_id)
+        if state is None:
+            return None
+        with self._lock:
+            # Another rerun of the same session may have loaded it meanwhile
+            entry = self._resident.get(session_id)
+            if entry is not None:
+                return entry[0]
+            self.rehydrated += 1
+            self._admit(session_id, state)
+        self._enforce_budget()
+        return state
+
+    def save(self, session_id, state):
+        """Record a changed state: keep it resident and hand it to the store"""
+        try:
+            self.store.save(session_id, state)
+        except StaleSession:
+            # Another worker changed the session first and its state wins
+            with self._lock:
+                self.conflicts += 1
+            self._spill(session_id, refreshed=True)
+            return False
+        with self._lock:
+            entry = self._resident.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+            self._admit(session_id, state)
+        self._enforce_budget()
+        return True
+
+    def stats(self):
+        """Resident sessions and bytes, spill/rehydration counts and cross-worker changes"""
+        with self._lock:
+            return {
+                'resident': len(self._resident),
+                'resident_bytes': self._bytes,
+                'memory_budget': self.memory_budget,
+                'spilled': self.spilled,
+                'rehydrated': self.rehydrated,
+                'refreshed': self.refreshed,
+                'conflicts': self.conflicts,
+            }
+
+    def spill_idle(self):
+        """Spill every session idle for longer than idle_after; returns how many"""
+        cutoff = time.monotonic() - self.idle_after
+        with self._lock:
+            idle = [session_id for session_id, entry in self._resident.items() if entry[2] < cutoff]
+        return sum(self._spill(session_id) for session_id in idle)
+
+    def _admit(self, session_id, state):
+        size = state_size(state)
+        self._resident[session_id] = [state, size, time.monotonic()]
+        self._bytes += size
+
+    def _enforce_budget(self):
+        while True:
+            with self._lock:
+                if self._bytes <= self.memory_budget or len(self._resident) <= 1:
+                    return
+                session_id = next(iter(self._resident))
+            self._spill(session_id)
+
+    def _spill(self, session_id, refreshed=False):
+        with self._lock:
+            entry = self._resident.pop(session_id, None)
+            if entry is None:
+                return 0
+            self._bytes -= entry[1]
+            if refreshed:
+                self.refreshed += 1
+            else:
+                self.spilled += 1
+        return 1
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            self.spill_idle()
@@ -0,0 +1,176 @@
+"""
+Batch conversation simulator
+
+Runs synthetic sessions through the headless Engine, without Streamlit, to
+load-test the flow logic and see where users drop off. Each simulated user
+picks a random option on every step, now and then types it instead of
+clicking, and abandons the session with a fixed probability per turn.
+Sessions are split into chunks across worker processes; each worker
+compiles the flow and intent index once.
+
+    python -m inuit.simulate --sessions 100000 --workers 4
+    python -m inuit.simulate --sessions 5000 --events .cache/events   # also log funnel events
+    python -m inuit.simulate --sessions 5000 --funnel .cache/funnel.db  # and count them for admin.py
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from inuit.engine import Engine
+from inuit.events import EventLog
+from inuit.flow import load_flow
+from inuit.funnel import FunnelCounters
+from inuit.intents import IntentIndex
+
+FLOW_PATH = Path(__file__).resolve().parent.parent / 'flows' / 'inuit.json'
+
+MAX_TURNS = 40
+ABANDON_RATE = 0.05
+TEXT_RATE = 0.2
+CHUNK_SIZE = 2000
+EPOCH = 1704067200  # fixed message timestamp (2024-01-01)
+
+# What a user can do on steps whose controls are drawn by the page, not the flow
+PAGE_CHOICES = {
+    'carousel': (("📋 View details", 'view_product'), ("🛒 Add to cart", 'add_product')),
+    'videos': (("⏭️ Skip videos and continue", 'skip_videos'), ("✅ Finished watching videos", 'done_watching')),
+}
+
+_ENGINE = None
+_CHOICES = None
+_EVENTS = None
+_FUNNEL = None
+
+
+def step_choices(step):
+    """(label, value) pairs a simulated user can pick on a step"""
+    if step['type'] == 'quick_replies':
+        return tuple((option, option) for option in step['options'])
+    if step['type'] == 'buttons':
+        return tuple(step['options'])
+    return PAGE_CHOICES.get(step['type'], ())
+
+
+def build_engine(flow_path=FLOW_PATH):
+    """Engine with delays off and a fixed clock, plus the choices of every step"""
+    flow = load_flow(flow_path)
+    engine = Engine(flow, IntentIndex.from_flow(flow), reply_delay=0, fallback_delay=0, clock=lambda: EPOCH)
+    return engine, {step_id: step_choices(step) for step_id, step in flow.steps.items()}
+
+
+def simulate_session(engine, choices, rng, max_turns=MAX_TURNS, abandon_rate=ABANDON_RATE, text_rate=TEXT_RATE):
+    """Walk one synthetic session; returns (outcome, turns, steps reached, fallbacks)"""
+    goal = engine.flow.journey[-1]
+    state = engine.new_state()
+    reached = {state['current_step']}
+    fallbacks = 0
+    for turn in range(1, max_turns + 1):
+        if rng.random() < abandon_rate:
+            return 'abandoned', turn - 1, reached, fallbacks
+        step_id = engine.active_step(state)
+        options = choices[step_id]
+        if not options:
+            return 'stuck', turn - 1, reached, fallbacks
+        label, value = rng.choice(options)
+        if rng.random() < text_rate:
+            next_step = engine.send_text(state, label)
+            if next_step is None and engine.active_step(state) == engine.flow.fallback:
+                fallbacks += 1
+                reached.add(engine.flow.fallback)
+        else:
+            next_step = engine.choose(state, step_id, value, label)
+        if next_step is not None:
+            reached.add(next_step)
+            if next_step == goal:
+                return 'completed', turn, reached, fallbacks
+    return 'max_turns', max_turns, reached, fallbacks
+
+
+def _init_worker(flow_path, events_dir=None, funnel_db=None):
+    global _ENGINE, _CHOICES, _EVENTS, _FUNNEL
+    _ENGINE, _CHOICES = build_engine(flow_path)
+    if events_dir:
+        _EVENTS = EventLog(events_dir)
+        _ENGINE.subscribe(_EVENTS.record)
+    if funnel_db:
+        _FUNNEL = FunnelCounters(funnel_db)
+        _ENGINE.subscribe(_FUNNEL.record)
+
+
+def _run_chunk(seed, sessions, max_turns, abandon_rate, text_rate):
+    rng = random.Random(seed)
+    outcomes, reached, turns, fallbacks = Counter(), Counter(), 0, 0
+    for _ in range(sessions):
+        outcome, n, steps, misses = simulate_session(_ENGINE, _CHOICES, rng, max_turns, abandon_rate, text_rate)
+        outcomes[outcome] += 1
+        reached.update(steps)
+        turns += n
+        fallbacks += misses
+    # Pool workers exit without running atexit handlers
+    for sink in (_EVENTS, _FUNNEL):
+        if sink is not None:
+            sink.flush()
+    return outcomes, reached, turns, fallbacks
+
+
+def simulate(sessions, workers=None, seed=0, flow_path=FLOW_PATH, max_turns=MAX_TURNS,
+             abandon_rate=ABANDON_RATE, text_rate=TEXT_RATE, chunk_size=CHUNK_SIZE, events_dir=None, funnel_db=None):
+    """Run sessions synthetic conversations and return aggregate statistics"""
+    workers = workers or os.cpu_count() or 1
+    chunks = [min(chunk_size, sessions - start) for start in range(0, sessions, chunk_size)]
+    outcomes, reached, turns, fallbacks = Counter(), Counter(), 0, 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(str(flow_path), events_dir, funnel_db)) as pool:
+        futures = [
+            pool.submit(_run_chunk, seed + i, n, max_turns, abandon_rate, text_rate)
+            for i, n in enumerate(chunks)
+        ]
+        for future in futures:
+            chunk_outcomes, chunk_reached, chunk_turns, chunk_fallbacks = future.result()
+            outcomes.update(chunk_outcomes)
+            reached.update(chunk_reached)
+            turns += chunk_turns
+            fallbacks += chunk_fallbacks
+    elapsed = time.perf_counter() - started
+
+    flow = load_flow(flow_path)
+    return {
+        'sessions': sessions,
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'sessions_per_second': round(sessions / elapsed, 1) if elapsed else None,
+        'turns': turns,
+        'turns_per_second': round(turns / elapsed, 1) if elapsed else None,
+        'fallbacks': fallbacks,
+        'outcomes': dict(outcomes),
+        'completion_rate': round(outcomes['completed'] / sessions, 4) if sessions else 0,
+        'reached': {step_id: reached[step_id] for step_id in flow.steps},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate conversations through the headless engine")
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--flow', default=str(FLOW_PATH))
+    parser.add_argument('--max-turns', type=int, default=MAX_TURNS)
+    parser.add_argument('--abandon-rate', type=float, default=ABANDON_RATE)
+    parser.add_argument('--text-rate', type=float, default=TEXT_RATE)
+    parser.add_argument('--events', help="directory to write the funnel event log to")
+    parser.add_argument('--funnel', help="SQLite file to add the funnel counts to")
+    args = parser.parse_args(argv)
+    report = simulate(args.sessions, args.workers, args.seed, args.flow, args.max_turns,
+                      args.abandon_rate, args.text_rate, events_dir=args.events, funnel_db=args.funnel)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Conversation persistence on local SQLite
+
+Sessions are kept in one WAL-mode SQLite table keyed by session id, so a
+restart or redeploy does not lose in-flight conversations. save() only
+encodes the state and parks it in a pending map (later saves of the same
+session replace earlier ones); a background thread writes the pending
+states in one transaction every flush interval, so no rerun waits on the
+disk. load() checks the pending map, then does a single primary-key read.
+
+States are stored as zlib-compressed JSON (see encode_state), not pickles,
+so the database stays readable across code versions.
+
+SessionStore assumes it is the only process writing its database. Several
+worker processes share a SharedSessionStore instead: it writes through to
+a versioned backend (see inuit/backends.py) and can tell whether another
+worker has changed a session since this one last read or wrote it.
+INUIT_SESSION_STORE picks the backend (see store_from_env).
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from contextlib import closing
+from collections import OrderedDict
+from pathlib import Path
+
+from inuit.backends import StaleSession, backend_from_url
+from inuit.history import new_archive
+from inuit.messages import Message
+
+FORMAT_VERSION = 1
+FLUSH_INTERVAL = 0.5
+KNOWN_VERSIONS = 100_000  # sessions whose version a SharedSessionStore remembers
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    state BLOB NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+def encode_state(state):
+    """Compact bytes for a conversation state (pending reply delays are dropped)"""
+    data = {
+        'v': FORMAT_VERSION,
+        'id': state['conversation_id'],
+        'history': [msg.as_tuple() for msg in state['chat_history']],
+        'archive': [msg.as_tuple() for msg in state['chat_archive']],
+        'archive_limit': state['chat_archive'].maxlen,
+        'step': state['current_step'],
+        'choices': state['user_choices'],
+        'video': state['playing_video'],
+        'seq': state['message_seq'],
+        'jobs': state['jobs'],
+        'reached': sorted(state['reached']),
+    }
+    return zlib.compress(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def decode_state(blob):
+    """Conversation state from encode_state() bytes"""
+    data = json.loads(zlib.decompress(blob))
+    if data.get('v') != FORMAT_VERSION:
+        raise ValueError(f"unsupported session format {data.get('v')!r}")
+    archive = new_archive(data['archive_limit'])
+    archive.extend(Message(*row) for row in data['archive'])
+    return {
+        # Sessions saved before conversations had ids get one now
+        'conversation_id': data.get('id') or uuid.uuid4().hex,
+        'chat_history': [Message(*row) for row in data['history']],
+        'chat_archive': archive,
+        'current_step': data['step'],
+        'user_choices': data['choices'],
+        'playing_video': data['video'],
+        'message_seq': data['seq'],
+        'reply_delays': {},
+        'jobs': data.get('jobs', []),
+        'reached': set(data.get('reached', ())),
+    }
+
+
+class SessionStore:
+    """Session states in SQLite, written behind the reruns in batches"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._inflight = {}  # the batch being written, still readable by load()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        # Writes go through one connection, guarded by _write_lock
+        self._conn = self._connect()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._writer = threading.Thread(target=self._run, name='session-store', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def save(self, session_id, state):
+        """Queue the current state of a session for writing"""
+        blob = encode_state(state)
+        with self._lock:
+            self._pending[session_id] = (blob, time.time())
+
+    def load(self, session_id):
+        """Latest saved state of a session, or None if there is none"""
+        with self._lock:
+            pending = self._pending.get(session_id) or self._inflight.get(session_id)
+        if pending is not None:
+            return decode_state(pending[0])
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT state FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return decode_state(row[0])
+        except (ValueError, zlib.error):
+            # Unreadable or from an older format: start the session afresh
+            return None
+
+    def is_current(self, session_id):
+        """Whether a state this process saved or loaded is still the latest (always: it is the only writer)"""
+        return True
+
+    def delete(self, session_id):
+        """Forget a session"""
+        with self._write_lock:
+            with self._lock:
+                self._pending.pop(session_id, None)
+            self._conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            self._conn.commit()
+
+    def flush(self):
+        """Write every pending state now; returns how many were written"""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return 0
+            rows = [(session_id, blob, updated) for session_id, (blob, updated) in batch.items()]
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT INTO sessions (id, state, updated) VALUES (?, ?, ?) '
+                        'ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated = excluded.updated',
+                        rows
+                    )
+            except sqlite3.Error:
+                # Put the batch back unless a newer state arrived meanwhile
+                with self._lock:
+                    for session_id, entry in batch.items():
+                        self._pending.setdefault(session_id, entry)
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+            return len(rows)
+
+    def close(self):
+        """Stop the writer and write what is still pending"""
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._writer.join(timeout=5)
+            self.flush()
+            self._conn.close()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Keep the writer alive; the states stay in memory until the next try
+                time.sleep(self.flush_interval)
+
+
+class SharedSessionStore:
+    """Session states in a backend shared by several worker processes, written through"""
+
+    def __init__(self, backend, known_versions=KNOWN_VERSIONS):
+        self.backend = backend
+        self.known_versions = known_versions
+        # session id -> version this process last loaded or saved
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, session_id, state):
+        """Write a session's state; raises StaleSession if another worker changed it first"""
+        with self._lock:
+            version = self._versions.get(session_id, 0)
+        try:
+            version = self.backend.save(session_id, encode_state(state), version)
+        except StaleSession:
+            self._forget(session_id)
+            raise
+        self._remember(session_id, version)
+
+    def load(self, session_id):
+        """Latest stored state of a session, or None if there is none"""
+        stored = self.backend.load(session_id)
+        if stored is None:
+            return None
+        blob, version = stored
+        try:
+            state = decode_state(blob)
+        except (ValueError, zlib.error):
+            return None
+        self._remember(session_id, version)
+        return state
+
+    def is_current(self, session_id):
+        """Whether the state this process last loaded or saved is still the stored one"""
+        with self._lock:
+            version = self._versions.get(session_id)
+        return version is not None and self.backend.version(session_id) == version
+
+    def delete(self, session_id):
+        """Forget a session"""
+        self._forget(session_id)
+        self.backend.delete(session_id)
+
+    def flush(self):
+        """Nothing to write: every save went straight to the backend"""
+        return 0
+
+    def close(self):
+        self.backend.close()
+
+    def _remember(self, session_id, version):
+        with self._lock:
+            self._versions[session_id] = version
+            self._versions.move_to_end(session_id)
+            while len(self._versions) > self.known_versions:
+                self._versions.popitem(last=False)
+
+    def _forget(self, session_id):
+        with self._lock:
+            self._versions.pop(session_id, None)
+
+
+def store_from_env(path):
+    """SharedSessionStore on INUIT_SESSION_STORE if set, else a SessionStore at path"""
+    url = os.environ.get('INUIT_SESSION_STORE')
+    if url:
+        return SharedSessionStore(backend_from_url(url))
+    return SessionStore(path)
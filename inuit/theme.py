@@ -0,0 +1,57 @@
+"""
+Theme stylesheet compiled once per process
+
+The page CSS lives in themes/*.css. compile_theme() minifies it, names it
+by content hash and writes it to the app's static folder, so every rerun
+only has to send a short <link> tag; browsers cache the hashed file for
+good. When Streamlit's static file serving is switched off, the minified
+CSS is sent inline instead.
+"""
+
+import hashlib
+import re
+from pathlib import Path
+
+_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_SPACE = re.compile(r'\s+')
+_AROUND_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+_AFTER_COLON = re.compile(r':\s+')
+
+
+def minify(css):
+    """Strip comments and redundant whitespace from a stylesheet"""
+    css = _COMMENT.sub('', css)
+    css = _SPACE.sub(' ', css)
+    css = _AROUND_PUNCTUATION.sub(r'\1', css)
+    css = _AFTER_COLON.sub(':', css)
+    return css.replace(';}', '}').strip()
+
+
+class Theme:
+    """A compiled stylesheet and the tag that loads it"""
+
+    def __init__(self, name, css):
+        self.name = name
+        self.css = css
+        self.href = f"app/static/{name}"
+
+    def tag(self, static_serving=True):
+        """HTML that applies the theme: a <link> to the static file, or inline CSS"""
+        if static_serving:
+            return f'<link rel="stylesheet" href="{self.href}">'
+        return f'<style>{self.css}</style>'
+
+
+def compile_theme(source, static_dir):
+    """Minify source, write it to static_dir under a content-hashed name"""
+    source, static_dir = Path(source), Path(static_dir)
+    css = minify(source.read_text(encoding='utf-8'))
+    digest = hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]
+    name = f"{source.stem}.{digest}.css"
+    target = static_dir / name
+    if not target.exists():
+        static_dir.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix('.tmp')
+        tmp.write_text(css, encoding='utf-8')
+        tmp.replace(target)
+    return Theme(name, css)
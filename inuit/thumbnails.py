@@ -0,0 +1,141 @@
+"""
+Thumbnail cache for the video step
+
+Each thumbnail is fetched once, cropped and resized to the size it is shown
+at, and kept in a disk cache that evicts the least recently used files past
+a byte budget. Hot thumbnails are also kept in memory, so a rerun hands
+st.image plain bytes instead of making every client fetch the remote image.
+Fetching happens on a small background pool: prefetch() is called when a
+session reaches the step before the videos, and get() never waits on the
+network.
+
+The fetcher is any callable taking a URL and returning the image bytes, so
+tests can point it at a local HTTP stand-in.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+THUMBNAIL_SIZE = (320, 180)
+DISK_LIMIT = 64 * 1024 * 1024
+MEMORY_ITEMS = 64
+FETCH_TIMEOUT = 5
+RETRY_AFTER = 60
+
+
+def fetch_url(url):
+    """Default fetcher: download url over HTTP(S)"""
+    with urllib.request.urlopen(url, timeout=FETCH_TIMEOUT) as response:
+        return response.read()
+
+
+class ThumbnailCache:
+    """Memory + disk LRU cache of resized thumbnails, filled in the background"""
+
+    def __init__(self, directory, fetcher=fetch_url, size=THUMBNAIL_SIZE,
+                 disk_limit=DISK_LIMIT, memory_items=MEMORY_ITEMS, workers=2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fetcher = fetcher
+        self.size = size
+        self.disk_limit = disk_limit
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._pending = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+
+    def get(self, url):
+        """Thumbnail bytes for url, or None while it is still being fetched"""
+        with self._lock:
+            data = self._memory.get(url)
+            if data is not None:
+                self._memory.move_to_end(url)
+                return data
+        path = self._path(url)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mark as recently used for disk eviction
+        except FileNotFoundError:
+            self.prefetch([url])
+            return None
+        self._remember(url, data)
+        return data
+
+    def prefetch(self, urls):
+        """Start fetching any of urls that are not cached yet"""
+        for url in urls:
+            with self._lock:
+                if url in self._memory or url in self._pending:
+                    continue
+                if time.monotonic() - self._failed.get(url, -RETRY_AFTER) < RETRY_AFTER:
+                    continue
+                if self._path(url).exists():
+                    continue
+                self._pending[url] = self._executor.submit(self._load, url)
+
+    def wait(self, timeout=None):
+        """Block until the current prefetches are done (for tests and warm-up)"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception(timeout=timeout)
+
+    def _load(self, url):
+        try:
+            data = self._resize(self.fetcher(url))
+            path = self._path(url)
+            tmp = path.with_suffix('.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            self._remember(url, data)
+            self._evict_disk()
+        except Exception:
+            with self._lock:
+                self._failed[url] = time.monotonic()
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(url, None)
+
+    def _resize(self, data):
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        image = ImageOps.fit(image, self.size, Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=85, optimize=True)
+        return out.getvalue()
+
+    def _remember(self, url, data):
+        with self._lock:
+            self._memory[url] = data
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = []
+        for path in self.directory.glob('*.jpg'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_limit:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _path(self, url):
+        return self.directory / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.jpg')
@@ -0,0 +1,9 @@
+"""
+The tests import the inuit package from the checkout, however pytest is started
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,105 @@
+"""
+Shared session backends: versioned, compare-and-set writes
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from inuit.backends import LocalRedisServer, RedisBackend, SQLiteBackend, StaleSession
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def backend(request, tmp_path):
+    """Each backend, Redis against the local stand-in"""
+    if request.param == 'sqlite':
+        backend = SQLiteBackend(tmp_path / 'sessions.db')
+        yield backend
+        backend.close()
+        return
+    server = LocalRedisServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    backend = RedisBackend('127.0.0.1', server.server_address[1])
+    yield backend
+    backend.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_new_session_starts_at_version_one(backend):
+    assert backend.load('a') is None
+    assert backend.version('a') is None
+    assert backend.save('a', b'first', 0) == 1
+    assert backend.load('a') == (b'first', 1)
+    assert backend.version('a') == 1
+
+
+def test_each_save_bumps_the_version(backend):
+    backend.save('a', b'first', 0)
+    assert backend.save('a', b'second', 1) == 2
+    assert backend.save('a', b'third', 2) == 3
+    assert backend.load('a') == (b'third', 3)
+
+
+def test_save_from_an_older_version_is_refused(backend):
+    backend.save('a', b'first', 0)
+    backend.save('a', b'from worker one', 1)
+    with pytest.raises(StaleSession):
+        backend.save('a', b'from worker two', 1)
+    assert backend.load('a') == (b'from worker one', 2)
+
+
+def test_second_new_session_under_one_id_is_refused(backend):
+    backend.save('a', b'first', 0)
+    with pytest.raises(StaleSession):
+        backend.save('a', b'other', 0)
+    assert backend.load('a') == (b'first', 1)
+
+
+def test_saving_a_deleted_session_is_refused(backend):
+    backend.save('a', b'first', 0)
+    backend.delete('a')
+    assert backend.load('a') is None
+    with pytest.raises(StaleSession):
+        backend.save('a', b'second', 1)
+
+
+def test_concurrent_saves_from_one_version_let_one_through(backend):
+    backend.save('a', b'first', 0)
+    outcomes = []
+    barrier = threading.Barrier(8)
+
+    def save(n):
+        barrier.wait()
+        try:
+            backend.save('a', b'writer %d' % n, 1)
+            outcomes.append('saved')
+        except StaleSession:
+            outcomes.append('stale')
+
+    threads = [threading.Thread(target=save, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(outcomes) == ['saved'] + ['stale'] * 7
+    assert backend.version('a') == 2
+
+
+def test_sqlite_connections_are_reused_across_threads(tmp_path, monkeypatch):
+    backend = SQLiteBackend(tmp_path / 'sessions.db')
+    opened = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, 'connect', lambda *args, **kwargs: opened.append(args) or connect(*args, **kwargs))
+    try:
+        # One thread per call, like Streamlit's one thread per rerun
+        for n in range(5):
+            thread = threading.Thread(target=lambda: (backend.save(f's{n}', b'state', 0), backend.version(f's{n}')))
+            thread.start()
+            thread.join()
+        assert backend.version('s4') == 1
+        assert opened == []
+    finally:
+        backend.close()
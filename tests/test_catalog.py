@@ -0,0 +1,80 @@
+"""
+Catalog ranking against the shopper's choices
+"""
+
+import itertools
+import json
+from pathlib import Path
+
+import pytest
+
+from inuit.catalog import Catalog, load_catalog, sizes_wanted
+
+CATALOG_PATH = Path(__file__).resolve().parent.parent / 'data' / 'catalog.json'
+
+
+def sku(name, type, occasions=(), sizes=(), rating=4.0, price=300):
+    return {'sku': name, 'name': name, 'type': type, 'occasions': list(occasions),
+            'sizes': list(sizes), 'rating': rating, 'price': price}
+
+
+@pytest.fixture
+def catalog():
+    return Catalog([
+        sku('boot-work-10', 'boots', ['work'], [9.5, 10], rating=3.0),
+        sku('boot-work-12', 'boots', ['work'], [12], rating=4.5),
+        sku('boot-party', 'boots', ['events'], [10], rating=5.0),
+        sku('sneaker-work-10', 'sneakers', ['work'], [10], rating=5.0),
+        sku('loafer', 'loafers', ['casual'], [8], rating=4.8, price=1250),
+    ])
+
+
+def names(products):
+    return [product['name'] for product in products]
+
+
+def test_size_choice_covers_half_sizes():
+    assert sizes_wanted('9-10') == [9.0, 9.5, 10.0]
+    assert sizes_wanted('11-12') == [11.0, 11.5, 12.0]
+    assert sizes_wanted("❓ I'm not sure") == []
+    assert sizes_wanted('') == []
+
+
+def test_type_outranks_occasion_which_outranks_size(catalog):
+    ranked = catalog.recommend({'shoe_type': 'boots', 'occasion': 'work', 'size': '9-10'}, k=5)
+    assert names(ranked) == ['boot-work-10', 'boot-work-12', 'boot-party', 'sneaker-work-10', 'loafer']
+
+
+def test_rating_breaks_ties(catalog):
+    ranked = catalog.recommend({'shoe_type': 'boots', 'occasion': '', 'size': ''}, k=3)
+    assert names(ranked) == ['boot-party', 'boot-work-12', 'boot-work-10']
+
+
+def test_unknown_choices_rank_by_rating(catalog):
+    ranked = catalog.recommend({'shoe_type': 'sandals', 'occasion': '', 'size': ''}, k=2)
+    assert names(ranked) == ['boot-party', 'sneaker-work-10']
+
+
+def test_k_larger_than_the_catalog(catalog):
+    assert len(catalog.recommend({'shoe_type': 'loafers'}, k=50)) == len(catalog)
+
+
+def test_product_is_ready_for_display(catalog):
+    product = catalog.recommend({'shoe_type': 'loafers'}, k=1)[0]
+    assert product['price'] == "$1,250"
+    assert product['sku'] == 'loafer'
+
+
+def test_indexed_ranking_matches_scoring_every_row():
+    catalog = load_catalog(CATALOG_PATH)
+    with open(CATALOG_PATH, encoding='utf-8') as f:
+        records = json.load(f)
+    types = [''] + sorted({r['type'] for r in records})
+    occasions = [''] + sorted({o for r in records for o in r.get('occasions', ())})
+    for shoe_type, occasion, size in itertools.product(types, occasions, ['', '7-8', '9-10', '11-12']):
+        choices = {'shoe_type': shoe_type, 'occasion': occasion, 'size': size}
+        scores = catalog.scores(choices)
+        expected = sorted(scores[catalog.top_k(scores, 3)], reverse=True)
+        ranked = catalog.recommend(choices, k=3)
+        rows = [catalog.sku.index(product['sku']) for product in ranked]
+        assert sorted(scores[rows], reverse=True) == pytest.approx(expected)
@@ -0,0 +1,31 @@
+"""
+Client-side thinking delay and streamed replies
+"""
+
+import re
+from pathlib import Path
+
+import pytest
+
+from inuit.delay import hold_until, stream_lines
+
+THEMES = Path(__file__).resolve().parent.parent / 'themes'
+
+
+def test_lines_follow_one_another():
+    schedule = list(stream_lines("One\nTwo\nThree", 0.8))
+    assert [line for line, _ in schedule] == ["One", "Two", "Three"]
+    times = [shown_at for _, shown_at in schedule]
+    assert times == sorted(times)
+
+
+@pytest.mark.parametrize('theme', ['chatbot.css', 'intuitbot.css'])
+def test_held_widgets_only_fade_in(theme):
+    style = hold_until('.st-key-step_widgets', 1.5)
+    assert '1.50s' in style
+    # Neither the rule nor its keyframes may cap the height of the widgets
+    assert 'overflow' not in style
+    name = re.search(r'animation: ([\w-]+)', style).group(1)
+    css = (THEMES / theme).read_text(encoding='utf-8')
+    keyframes = re.search(r'@keyframes ' + name + r' \{(.*?\})\s*\}', css, re.S)
+    assert keyframes and 'height' not in keyframes.group(1)
@@ -0,0 +1,108 @@
+"""
+Conversation engine: choices, typed text and the fallback reply
+"""
+
+import pytest
+
+from inuit.engine import Engine
+from inuit.flow import compile_flow
+from inuit.intents import IntentIndex
+
+FLOW = compile_flow({
+    'start': 'welcome',
+    'fallback': 'fallback',
+    'steps': [
+        {'id': 'welcome', 'message': "Welcome!", 'type': 'quick_replies',
+         'options': [{'label': "Shop", 'examples': ["show me shoes", "browse"]}]},
+        {'id': 'type', 'message': "Which type?", 'type': 'buttons', 'records': 'shoe_type', 'options': [
+            {'label': "🥾 Boots", 'value': 'boots', 'examples': ["boots", "hiking boots"]},
+            {'label': "👟 Sneakers", 'value': 'sneakers', 'examples': ["sneakers", "trainers"]},
+        ]},
+        {'id': 'size', 'message': "Your size?", 'type': 'quick_replies', 'records': 'size',
+         'options': [{'label': "9-10", 'examples': ["size 10"]}, {'label': "11-12", 'examples': ["size 12"]}]},
+        {'id': 'done', 'message': "Thank you!", 'type': 'quick_replies',
+         'options': [{'label': "Start over", 'next': 'welcome'}, "Stay"]},
+        {'id': 'fallback', 'journey': False, 'message': "Sorry, I didn't catch that.", 'type': 'quick_replies',
+         'options': [{'label': "Main Menu", 'next': 'welcome', 'examples': ["main menu", "home"]}]},
+    ],
+})
+
+
+@pytest.fixture
+def engine():
+    return Engine(FLOW, IntentIndex.from_flow(FLOW), clock=lambda: 1_700_000_000)
+
+
+def texts(state):
+    """What has been said so far, oldest first"""
+    return [msg.text for msg in state['chat_history']]
+
+
+def test_new_conversation_is_greeted(engine):
+    state = engine.new_state()
+    assert state['current_step'] == 'welcome'
+    assert texts(state) == ["Welcome!"]
+    assert state['user_choices'] == {'shoe_type': '', 'size': ''}
+    # The greeting shows at once
+    assert state['reply_delays'] == {}
+
+
+def test_choice_is_recorded_and_moves_on(engine):
+    state = engine.new_state()
+    assert engine.choose(state, 'welcome', "Shop") == 'type'
+    assert engine.choose(state, 'type', 'boots', "🥾 Boots") == 'size'
+    assert state['current_step'] == 'size'
+    assert state['user_choices']['shoe_type'] == 'boots'
+    assert texts(state)[-3:] == ["Which type?", "🥾 Boots", "Your size?"]
+    assert engine.active_step(state) == 'size'
+
+
+def test_reply_waits_for_the_thinking_delay(engine):
+    state = engine.new_state()
+    engine.choose(state, 'welcome', "Shop")
+    reply = state['chat_history'][-1]
+    assert state['reply_delays'][reply.id] > 0
+
+
+def test_last_step_without_a_route_stays(engine):
+    state = engine.new_state()
+    for step_id, value in [('welcome', "Shop"), ('type', 'boots'), ('size', "9-10")]:
+        engine.choose(state, step_id, value)
+    assert engine.choose(state, 'done', "Stay") is None
+    assert state['current_step'] == 'done'
+    assert engine.choose(state, 'done', "Start over") == 'welcome'
+
+
+def test_matching_text_moves_on_like_a_click(engine):
+    state = engine.new_state()
+    assert engine.send_text(state, "show me shoes") == 'type'
+    assert engine.send_text(state, "I'd like hiking boots") == 'size'
+    assert state['user_choices']['shoe_type'] == 'boots'
+    assert "I'd like hiking boots" in texts(state)
+
+
+def test_unclear_text_gets_the_fallback_reply(engine):
+    state = engine.new_state()
+    engine.choose(state, 'welcome', "Shop")
+    assert engine.send_text(state, "qqq xyzzy") is None
+    assert texts(state)[-2:] == ["qqq xyzzy", "Sorry, I didn't catch that."]
+    # The journey stays where it was, with the fallback's options on screen
+    assert state['current_step'] == 'type'
+    assert engine.active_step(state) == 'fallback'
+    assert engine.send_text(state, "main menu") == 'welcome'
+
+
+def test_blank_text_is_ignored(engine):
+    state = engine.new_state()
+    assert engine.send_text(state, "   ") is None
+    assert texts(state) == ["Welcome!"]
+
+
+def test_reset_starts_over(engine):
+    state = engine.new_state()
+    engine.choose(state, 'welcome', "Shop")
+    engine.choose(state, 'type', 'boots')
+    engine.reset(state)
+    assert state['current_step'] == 'welcome'
+    assert texts(state) == ["Welcome!"]
+    assert state['user_choices'] == {'shoe_type': '', 'size': ''}
@@ -0,0 +1,106 @@
+"""
+Flow definitions: validation, progress positions and routing
+"""
+
+from pathlib import Path
+
+import pytest
+
+from inuit.flow import FlowError, compile_flow, load_flow
+
+FLOW_PATH = Path(__file__).resolve().parent.parent / 'flows' / 'inuit.json'
+
+
+def definition(**changes):
+    """A small flow with a side branch; changes replace whole top-level keys"""
+    flow = {
+        'start': 'welcome',
+        'fallback': 'fallback',
+        'steps': [
+            {'id': 'welcome', 'message': "Hi", 'type': 'quick_replies',
+             'options': [{'label': "Tell me more", 'next': 'about'}, "Shop"]},
+            {'id': 'type', 'message': "Which type?", 'type': 'buttons', 'records': 'shoe_type',
+             'options': [{'label': "👢 Boots", 'value': 'boots'}, {'label': "👟 Sneakers", 'value': 'sneakers'}]},
+            {'id': 'done', 'message': "Thanks", 'type': 'quick_replies',
+             'options': [{'label': "Again", 'next': 'welcome'}, "Stay"]},
+            {'id': 'about', 'journey': False, 'stage': 'welcome', 'message': "About us", 'type': 'buttons',
+             'next': 'type', 'options': [{'label': "Shop now", 'value': 'shop'}]},
+            {'id': 'fallback', 'journey': False, 'message': "Sorry?", 'type': 'quick_replies',
+             'options': [{'label': "Menu", 'next': 'welcome'}]},
+        ],
+    }
+    flow.update(changes)
+    return flow
+
+
+def with_step(**step):
+    """definition() with one more step"""
+    flow = definition()
+    flow['steps'] = flow['steps'] + [step]
+    return flow
+
+
+def test_journey_leaves_side_branches_out():
+    flow = compile_flow(definition())
+    assert flow.journey == ('welcome', 'type', 'done')
+    assert flow.start == 'welcome'
+    assert flow.fallback == 'fallback'
+
+
+def test_side_branch_counts_as_its_stage():
+    flow = compile_flow(definition())
+    assert flow.position['about'] == flow.position['welcome'] == 0
+    assert flow.position['done'] == 2
+    assert 'fallback' not in flow.position
+
+
+def test_options_are_compiled_by_widget_type():
+    flow = compile_flow(definition())
+    assert flow.steps['welcome']['options'] == ("Tell me more", "Shop")
+    assert flow.steps['type']['options'] == (("👢 Boots", 'boots'), ("👟 Sneakers", 'sneakers'))
+
+
+def test_routes_follow_option_then_step_then_journey():
+    flow = compile_flow(definition())
+    # An option's own 'next'
+    assert flow.next_step('welcome', "Tell me more") == 'about'
+    assert flow.next_step('done', "Again") == 'welcome'
+    # Otherwise the following journey step
+    assert flow.next_step('welcome', "Shop") == 'type'
+    assert flow.next_step('type', 'boots') == 'done'
+    # A side branch's 'next'
+    assert flow.next_step('about', 'shop') == 'type'
+    # The last journey step stays put
+    assert flow.next_step('done', "Stay") is None
+
+
+def test_compiled_flow_is_read_only():
+    flow = compile_flow(definition())
+    with pytest.raises(AttributeError):
+        flow.start = 'type'
+    with pytest.raises(TypeError):
+        flow.steps['welcome']['message'] = "Changed"
+
+
+@pytest.mark.parametrize('flow', [
+    definition(steps=[]),
+    definition(start='nowhere'),
+    definition(fallback='nowhere'),
+    with_step(id='welcome', message="Again", type='quick_replies', options=["Ok"]),
+    with_step(id='extra', message="?", type='slider', options=["Ok"]),
+    with_step(id='extra', type='quick_replies', options=["Ok"]),
+    with_step(id='extra', message="?", type='buttons', options=[]),
+    with_step(id='extra', message="?", type='buttons', options=[{'label': "A", 'next': 'nowhere'}]),
+    with_step(id='extra', message="?", type='buttons', options=[{'label': "A", 'value': 'a'},
+                                                               {'label': "B", 'value': 'a'}]),
+    with_step(id='extra', journey=False, stage='fallback', message="?", type='quick_replies', options=["Ok"]),
+])
+def test_invalid_definitions_are_rejected(flow):
+    with pytest.raises(FlowError):
+        compile_flow(flow)
+
+
+def test_shipped_flow_compiles():
+    flow = load_flow(FLOW_PATH)
+    assert flow.start in flow.journey
+    assert flow.fallback in flow.steps
@@ -0,0 +1,156 @@
+"""
+Background job queue: retries, journal replay, the order actions and the order book stand-in
+"""
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from inuit.engine import Engine
+from inuit.flow import load_flow
+from inuit.fulfilment import DONE, FAILED, RETRYING, FulfilmentQueue, LocalOrderAPI, PermanentError
+
+FLOW_PATH = Path(__file__).resolve().parent.parent / 'flows' / 'inuit.json'
+
+
+def wait_for(condition, timeout=5):
+    """Poll condition until it holds; fails the test after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queues(tmp_path):
+    """Start queues on one journal directory; closes them at the end"""
+    started = []
+
+    def start(handlers, **options):
+        options.setdefault('backoff', 0.01)
+        queue = FulfilmentQueue(tmp_path, handlers, **options)
+        started.append(queue)
+        return queue
+
+    yield start
+    for queue in started:
+        queue.close()
+
+
+def flaky(failures, result='ok'):
+    """Handler that fails the first failures attempts, then returns result"""
+    def handler(job, queue):
+        if job.attempts <= failures:
+            raise ConnectionError(f"attempt {job.attempts}")
+        return result
+    return handler
+
+
+def test_failed_attempts_are_retried_until_done(queues):
+    queue = queues({'order': flaky(2)})
+    job_id = queue.submit('order', {})
+    wait_for(lambda: queue.status(job_id)['status'] == DONE)
+    job = queue.status(job_id)
+    assert job['attempts'] == 3
+    assert job['result'] == 'ok'
+    assert job['error'] is None
+
+
+def test_job_fails_after_max_attempts(queues):
+    queue = queues({'order': flaky(10)}, max_attempts=3)
+    job_id = queue.submit('order', {})
+    wait_for(lambda: queue.status(job_id)['status'] == FAILED)
+    assert queue.status(job_id)['attempts'] == 3
+    assert queue.status(job_id)['error'] == "attempt 3"
+
+
+def test_permanent_error_is_not_retried(queues):
+    def reject(job, queue):
+        raise PermanentError("card declined")
+
+    queue = queues({'order': reject})
+    job_id = queue.submit('order', {})
+    wait_for(lambda: queue.status(job_id)['status'] == FAILED)
+    assert queue.status(job_id)['attempts'] == 1
+
+
+def test_retry_delay_backs_off_up_to_the_cap(queues):
+    queue = queues({}, backoff=1.0, max_backoff=5.0)
+    for attempts, full in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 5.0), (10, 5.0)]:
+        assert full / 2 <= queue.retry_delay(attempts) <= full
+
+
+def test_known_job_id_is_queued_once(queues):
+    runs = []
+    queue = queues({'order': lambda job, queue: runs.append(job.id)})
+    assert queue.submit('order', {}, job_id='abc') == 'abc'
+    assert queue.submit('order', {}, job_id='abc') == 'abc'
+    wait_for(lambda: queue.status('abc')['status'] == DONE)
+    assert runs == ['abc']
+
+
+def test_unknown_kind_is_refused(queues):
+    with pytest.raises(ValueError):
+        queues({}).submit('order', {})
+
+
+def test_stopped_queue_jobs_are_replayed(queues, tmp_path):
+    first = queues({'order': flaky(10)}, backoff=60)
+    job_id = first.submit('order', {'size': '9-10'})
+    wait_for(lambda: first.status(job_id)['status'] == RETRYING)
+    first.close()
+
+    second = queues({'order': flaky(0)})
+    wait_for(lambda: second.status(job_id)['status'] == DONE)
+    assert second.status(job_id)['payload'] == {'size': '9-10'}
+    # The stopped queue's journal was compacted into the new one
+    assert [path.name for path in tmp_path.glob('journal*.jsonl')] == [second.journal_path.name]
+
+
+def test_finished_jobs_are_remembered_but_not_rerun(queues):
+    runs = []
+    first = queues({'order': lambda job, queue: runs.append(job.id) or 'booked'})
+    job_id = first.submit('order', {})
+    wait_for(lambda: first.status(job_id)['status'] == DONE)
+    first.close()
+
+    second = queues({'order': lambda job, queue: runs.append(job.id)})
+    time.sleep(0.1)
+    assert second.status(job_id)['result'] == 'booked'
+    assert runs == [job_id]
+
+
+def test_running_queue_jobs_are_left_alone(queues):
+    release = threading.Event()
+    first = queues({'order': lambda job, queue: release.wait(5)})
+    job_id = first.submit('order', {})
+
+    runs = []
+    second = queues({'order': lambda job, queue: runs.append(job.id)})
+    assert second.status(job_id) is None
+    release.set()
+    wait_for(lambda: first.status(job_id)['status'] == DONE)
+    assert runs == []
+
+
+def test_order_book_places_each_key_once(tmp_path):
+    path = tmp_path / 'orders.jsonl'
+    # Two processes' stand-ins on one order book
+    one, other = LocalOrderAPI(path), LocalOrderAPI(path)
+    confirmation = one.place({'shoe_type': 'boots'}, 'key-1')
+    assert other.place({'shoe_type': 'boots'}, 'key-1') == confirmation
+    other.place({'shoe_type': 'loafers'}, 'key-2')
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 2
+
+
+@pytest.mark.parametrize('step_id, value', [('order', 'order'), ('expert', "🛒 Place Order")])
+def test_place_order_queues_an_order(step_id, value):
+    flow = load_flow(FLOW_PATH)
+    queued = []
+    engine = Engine(flow, actions={'place_order': lambda state: queued.append(step_id) or step_id})
+    state = engine.new_state()
+    engine.choose(state, step_id, value)
+    assert queued == [step_id]
+    assert state['jobs'] == [step_id]
@@ -0,0 +1,169 @@
+"""
+Expert handoff broker: queueing, agent assignment and relaying
+"""
+
+import json
+import socket
+import time
+
+import pytest
+
+from inuit.handoff import BUSY, CONNECTED, WAITING, HandoffBroker
+
+
+def wait_for(condition, timeout=5):
+    """Poll condition until it returns something truthy, and return that"""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = condition()
+        if result:
+            return result
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class AgentConsole:
+    """A bare agent connection speaking the broker's JSON lines"""
+
+    def __init__(self, port, name='Ana', capacity=1):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.lines = self.sock.makefile('r', encoding='utf-8')
+        self.send({'type': 'hello', 'name': name, 'capacity': capacity})
+
+    def send(self, message):
+        self.sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+    def read(self):
+        return json.loads(self.lines.readline())
+
+    def close(self):
+        self.lines.close()
+        self.sock.close()
+
+
+@pytest.fixture
+def broker():
+    broker = HandoffBroker(host='127.0.0.1', port=0, max_waiting=2, position_interval=0.01)
+    broker.start()
+    yield broker
+    broker.close()
+
+
+@pytest.fixture
+def agents(broker):
+    """Connect agent consoles to the broker; disconnects them at the end"""
+    connected = []
+
+    def connect(**options):
+        agent = AgentConsole(broker.port, **options)
+        connected.append(agent)
+        return agent
+
+    yield connect
+    for agent in connected:
+        agent.close()
+
+
+def test_waiting_conversations_are_numbered(broker):
+    assert broker.request('a', {'shoe_type': 'boots'}) == 1
+    assert broker.request('b') == 2
+    # Asking again keeps the place
+    assert broker.request('a') == 1
+    assert broker.status('b') == {'state': WAITING, 'position': 2, 'agent': None}
+    broker.leave('a')
+    assert broker.status('a') is None
+    wait_for(lambda: broker.status('b')['position'] == 1)
+
+
+def test_unpolled_waiting_conversations_are_dropped():
+    broker = HandoffBroker(host='127.0.0.1', port=0, position_interval=0.01, waiting_idle=0.2)
+    try:
+        broker.request('gone')
+        broker.request('here')
+        # Only 'here' is still being polled by its page
+        wait_for(lambda: broker.status('here')['position'] == 1)
+        assert broker.stats()['waiting'] == 1
+        assert broker.status('gone') is None
+    finally:
+        broker.close()
+
+
+def test_full_queue_turns_requests_down(broker):
+    broker.request('a')
+    broker.request('b')
+    assert broker.request('c') is None
+    assert broker.receive('c') == [(BUSY, None, None)]
+    assert broker.status('c') is None
+
+
+def test_agent_gets_the_longest_waiting_chat(broker, agents):
+    broker.request('a', {'shoe_type': 'boots'})
+    broker.request('b')
+    assert broker.relay('a', "Do you have size 12?")
+    agent = agents()
+    assigned = agent.read()
+    assert assigned == {'type': 'assigned', 'session': 'a', 'summary': {'shoe_type': 'boots'},
+                        'pending': ["Do you have size 12?"]}
+    assert wait_for(lambda: broker.receive('a')) == [('joined', 'Ana', None)]
+    assert broker.status('a') == {'state': CONNECTED, 'position': 0, 'agent': 'Ana'}
+    # One slot: the other chat waits at the front
+    wait_for(lambda: broker.status('b')['position'] == 1)
+    assert broker.status('b')['state'] == WAITING
+
+
+def test_messages_are_relayed_both_ways(broker, agents):
+    broker.request('a')
+    agent = agents()
+    agent.read()
+    wait_for(lambda: broker.receive('a'))
+    assert broker.relay('a', "Hello")
+    assert agent.read() == {'type': 'message', 'session': 'a', 'text': "Hello"}
+    agent.send({'type': 'message', 'session': 'a', 'text': "Hi <b>there</b>"})
+    assert wait_for(lambda: broker.receive('a')) == [('message', 'Ana', "Hi <b>there</b>")]
+
+
+def test_closed_chat_frees_the_slot(broker, agents):
+    broker.request('a')
+    broker.request('b')
+    agent = agents()
+    agent.read()
+    wait_for(lambda: broker.receive('a'))
+    agent.send({'type': 'close', 'session': 'a'})
+    assert wait_for(lambda: broker.receive('a')) == [('left', 'Ana', None)]
+    assert broker.status('a') is None
+    assert not broker.relay('a', "Still there?")
+    assert agent.read()['session'] == 'b'
+
+
+def test_customer_leaving_tells_the_agent(broker, agents):
+    broker.request('a')
+    agent = agents()
+    agent.read()
+    broker.leave('a')
+    assert agent.read() == {'type': 'left', 'session': 'a'}
+
+
+def test_lost_agent_puts_chats_back_in_front(broker, agents):
+    broker.request('a')
+    agent = agents()
+    agent.read()
+    wait_for(lambda: broker.receive('a'))
+    broker.request('b')
+    agent.close()
+    assert wait_for(lambda: broker.receive('a')) == [('requeued', 'Ana', None)]
+    assert broker.status('a') == {'state': WAITING, 'position': 1, 'agent': None}
+    replacement = agents(name='Marco')
+    assert replacement.read()['session'] == 'a'
+
+
+def test_taken_port_falls_back_to_a_free_one():
+    with socket.socket() as taken:
+        taken.bind(('127.0.0.1', 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        broker = HandoffBroker(host='127.0.0.1', port=port)
+        try:
+            assert broker.start() not in (port, 0)
+            assert broker.start() == broker.port
+        finally:
+            broker.close()
@@ -0,0 +1,61 @@
+"""
+Typed text matched to the options on screen
+"""
+
+import pytest
+
+from inuit.flow import compile_flow
+from inuit.intents import IntentIndex, normalize
+
+
+@pytest.fixture(scope='module')
+def intents():
+    return IntentIndex.from_flow(compile_flow({
+        'fallback': 'fallback',
+        'steps': [
+            {'id': 'type', 'message': "Which type?", 'type': 'buttons', 'options': [
+                {'label': "🥾 Boots", 'value': 'boots', 'examples': ["chelsea boot", "hiking boots"]},
+                {'label': "👟 Sneakers", 'value': 'sneakers', 'examples': ["trainers", "running shoes"]},
+            ]},
+            {'id': 'size', 'message': "Your size?", 'type': 'quick_replies', 'options': [
+                {'label': "9-10", 'examples': ["size 9", "size 10", "nine", "ten"]},
+                {'label': "11-12", 'examples': ["size 11", "size 12", "eleven", "twelve"]},
+            ]},
+            {'id': 'fallback', 'journey': False, 'message': "Sorry?", 'type': 'quick_replies', 'options': [
+                {'label': "🏠 Main Menu", 'next': 'type', 'examples': ["start over", "home"]},
+            ]},
+        ],
+    }))
+
+
+def test_normalize_drops_emoji_and_punctuation():
+    assert normalize("🥾 Boots!!") == "boots"
+    assert normalize("  I'm   not sure? ") == "i'm not sure"
+
+
+@pytest.mark.parametrize('text, value', [
+    ("Boots", 'boots'),
+    ("I want some boots please", 'boots'),
+    ("hiking boot", 'boots'),
+    ("TRAINERS", 'sneakers'),
+    ("running shoe", 'sneakers'),
+])
+def test_text_picks_the_option_on_screen(intents, text, value):
+    step_id, matched, score = intents.classify(text, ('type', 'fallback'))
+    assert (step_id, matched) == ('type', value)
+    assert 0 < score <= 1.0001
+
+
+def test_fallback_options_are_matched_too(intents):
+    assert intents.classify("start over", ('type', 'fallback'))[:2] == ('fallback', "🏠 Main Menu")
+
+
+def test_only_the_given_steps_are_matched(intents):
+    assert intents.classify("size 10", ('size',))[:2] == ('size', "9-10")
+    match = intents.classify("size 10", ('type',))
+    assert match is None or match[0] == 'type'
+
+
+@pytest.mark.parametrize('text', ["qqq", "xyzzy plugh", ""])
+def test_unrelated_text_matches_nothing(intents, text):
+    assert intents.classify(text, ('type', 'size', 'fallback')) is None
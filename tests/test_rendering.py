@@ -0,0 +1,37 @@
+"""
+Chat message HTML cache
+"""
+
+from inuit.messages import BOT, USER, Message
+from inuit.rendering import MessageRenderer
+
+
+def renderer():
+    return MessageRenderer('<div class="bot">{message}<i>{time}</i></div>', '<div class="user">{message}<i>{time}</i></div>')
+
+
+def test_message_is_built_once_per_session():
+    render = renderer()
+    cache = {}
+    msg = Message(1, USER, "Hello", 1_700_000_000)
+    html = render.render(msg, cache)
+    assert "Hello" in html
+    assert render.render(msg, cache) is html
+
+
+def test_step_markup_is_shared_between_sessions():
+    render = renderer()
+    first = render.render(Message(1, BOT, "Which type?", 1_700_000_000, step='type'), {})
+    second = render.render(Message(7, BOT, "Which type?", 1_700_000_060, step='type'), {})
+    # Only the timestamp differs
+    assert first.partition('<i>')[0] == second.partition('<i>')[0] == '<div class="bot">Which type?'
+
+
+def test_other_replies_on_a_step_keep_their_own_text():
+    render = renderer()
+    render.render(Message(1, BOT, "Which type?", 1_700_000_000, step='type'), {})
+    note = render.render(Message(2, BOT, "Alpine Boot is $520.", 1_700_000_000, step='type'), {})
+    assert "Alpine Boot is $520." in note
+    # And the step's own message is not taken over by the note
+    again = render.render(Message(3, BOT, "Which type?", 1_700_000_000, step='type'), {})
+    assert "Which type?" in again and "Alpine" not in again
@@ -0,0 +1,109 @@
+"""
+Typeahead search: prefix lookup, query words and price filters
+"""
+
+import random
+
+import pytest
+
+from inuit.catalog import Catalog
+from inuit.search import PrefixTrie, ProductSearch, price_range
+
+
+def product(name, desc='', features=(), price=300, rating=4.0, type='boots'):
+    return {'sku': name, 'name': name, 'type': type, 'desc': desc, 'features': list(features),
+            'price': price, 'rating': rating}
+
+
+@pytest.fixture(scope='module')
+def search():
+    return ProductSearch(Catalog([
+        product('Alpine Boot', "Waterproof hiking boot", ["Italian leather", "Vibram sole"], price=520, rating=4.6),
+        product('Chelsea Boot', "Sleek pull-on boot", ["Suede", "Leather sole"], price=410, rating=4.8),
+        product('Milano Oxford', "Italian leather oxford", ["Goodyear welt"], price=450, rating=4.9, type='formal'),
+        product('Runner Sneaker', "Light everyday sneaker", ["Knit upper"], price=180, rating=4.2, type='sneakers'),
+        product('Double Monk', "Double monk strap", ["Calf leather"], price=610, rating=4.4, type='formal'),
+    ]))
+
+
+def names(products):
+    return [product['name'] for product in products]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("under $500", ("", None, 500)),
+    ("boots below 400", ("boots ", None, 400)),
+    ("$300-600 boots", (" boots", 300, 600)),
+    ("300 to 600", ("", 300, 600)),
+    ("over $1,000", ("", 1000, None)),
+    ("from 200 under 300", (" ", 200, 300)),
+    # Sizes are not prices
+    ("boots 9-10", ("boots 9-10", None, None)),
+    ("size 11 to 12 under 500", ("size 11 to 12 ", None, 500)),
+    ("$9-10", ("", 9, 10)),
+])
+def test_price_range_is_read_off_the_text(text, expected):
+    assert price_range(text) == expected
+
+
+def test_prefix_completions_are_most_common_first():
+    trie = PrefixTrie({'leather': 5, 'lean': 1, 'legend': 3, 'boot': 2}, max_completions=2)
+    assert trie.complete('le') == ['leather', 'legend']
+    assert trie.complete('boo') == ['boot']
+    assert trie.complete('x') == ()
+
+
+def test_name_outweighs_description(search):
+    assert names(search.search("oxford")) == ['Milano Oxford']
+    assert names(search.search("boot"))[:2] == ['Chelsea Boot', 'Alpine Boot']
+
+
+def test_half_typed_words_match(search):
+    # Features outweigh the description
+    assert names(search.search("ital lea")) == ['Alpine Boot', 'Milano Oxford']
+    assert names(search.search("sne")) == ['Runner Sneaker']
+
+
+def test_every_known_word_must_match(search):
+    assert names(search.search("italian boot")) == ['Alpine Boot']
+    assert search.search("suede sneaker") == []
+
+
+def test_chatter_and_plurals_are_ignored(search):
+    assert names(search.search("do you have any sneakers?")) == ['Runner Sneaker']
+    # "do" alone is still being typed, and "double" starts with it
+    assert names(search.search("do")) == ['Double Monk']
+
+
+def test_price_range_narrows_the_matches(search):
+    assert names(search.search("boot under $500")) == ['Chelsea Boot']
+    assert names(search.search("leather $400-500")) == ['Chelsea Boot', 'Milano Oxford']
+    assert names(search.search("under 200")) == ['Runner Sneaker']
+    assert names(search.search("boot", low=500)) == ['Alpine Boot']
+
+
+def test_size_alone_finds_nothing(search):
+    assert search.search("9-10") == []
+    assert names(search.search("boot 9-10")) == ['Chelsea Boot', 'Alpine Boot']
+
+
+def test_unknown_words_find_nothing(search):
+    assert search.search("qqq") == []
+    assert search.search("   ") == []
+
+
+def test_cached_prefix_ranking_matches_the_full_ranking():
+    # Ratings are all different, so both paths must agree on the order too
+    rng = random.Random(7)
+    vocabulary = ['leather', 'suede', 'boot', 'loafer', 'sole', 'stitch', 'italian', 'light', 'lace', 'strap']
+    catalog = Catalog([
+        product(f"P{row} {rng.choice(vocabulary)}", ' '.join(rng.sample(vocabulary, 3)),
+                rng.sample(vocabulary, 2), price=rng.randrange(100, 900), rating=rng.uniform(3, 5))
+        for row in range(3000)
+    ])
+    search = ProductSearch(catalog)
+    for prefix in ['l', 'le', 'lea', 's', 'st', 'boot', 'p1', 'p12']:
+        for low, high in [(None, None), (200, 300), (850, None)]:
+            # The same word twice takes the general path, with every score doubled
+            fast = search.search(prefix, k=5, low=low, high=high)
+            assert fast == search.search(f"{prefix} {prefix}", k=5, low=low, high=high)
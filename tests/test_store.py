@@ -0,0 +1,73 @@
+"""
+Conversation persistence: state encoding and the write-behind store
+"""
+
+import json
+import zlib
+from pathlib import Path
+
+import pytest
+
+from inuit.engine import Engine
+from inuit.flow import load_flow
+from inuit.store import SessionStore, decode_state, encode_state
+
+FLOW_PATH = Path(__file__).resolve().parent.parent / 'flows' / 'inuit.json'
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return Engine(load_flow(FLOW_PATH))
+
+
+@pytest.fixture
+def state(engine):
+    """A conversation a few turns in, with a reply still to be played"""
+    state = engine.new_state()
+    engine.choose(state, 'welcome', "👞 Show me shoes")
+    engine.choose(state, 'intro', 'boots', "🥾 Boots")
+    engine.send_text(state, "qqq xyzzy")
+    return state
+
+
+def comparable(state):
+    """A state with its messages as plain tuples"""
+    return {
+        key: [msg.as_tuple() for msg in value] if key in ('chat_history', 'chat_archive') else value
+        for key, value in state.items()
+    }
+
+
+def test_state_survives_encoding(state):
+    decoded = decode_state(encode_state(state))
+    expected = comparable(state)
+    # Replies still to be played are not worth keeping
+    expected['reply_delays'] = {}
+    assert comparable(decoded) == expected
+    assert decoded['chat_archive'].maxlen == state['chat_archive'].maxlen
+
+
+def test_decoded_state_carries_on(engine, state):
+    decoded = decode_state(encode_state(state))
+    assert engine.choose(decoded, 'occasion', 'work') == 'size'
+    assert decoded['chat_history'][-1].id == state['message_seq'] + 2
+
+
+def test_unknown_format_is_refused(state):
+    data = json.loads(zlib.decompress(encode_state(state)))
+    data['v'] = 999
+    with pytest.raises(ValueError):
+        decode_state(zlib.compress(json.dumps(data).encode('utf-8')))
+
+
+def test_saved_state_is_read_back_before_and_after_flushing(tmp_path, state):
+    store = SessionStore(tmp_path / 'sessions.db', flush_interval=60)
+    store.save('a', state)
+    assert comparable(store.load('a'))['chat_history'] == comparable(state)['chat_history']
+    store.flush()
+    store.close()
+
+    reopened = SessionStore(tmp_path / 'sessions.db')
+    assert comparable(reopened.load('a'))['chat_history'] == comparable(state)['chat_history']
+    assert reopened.load('missing') is None
+    reopened.close()
@@ -0,0 +1,95 @@
+"""
+Thumbnail cache: background fetching, resizing and the disk cache
+"""
+
+import io
+import time
+
+import pytest
+from PIL import Image
+
+from inuit.thumbnails import THUMBNAIL_SIZE, ThumbnailCache
+
+URL = 'https://example.com/video.jpg'
+
+
+def jpeg(size=(1280, 720), color='red'):
+    """Bytes of a plain JPEG image"""
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, format='JPEG')
+    return out.getvalue()
+
+
+class Fetcher:
+    """Stand-in for the network, counting what it was asked for"""
+
+    def __init__(self, data=None, error=None):
+        self.data = data if data is not None else jpeg()
+        self.error = error
+        self.urls = []
+
+    def __call__(self, url):
+        self.urls.append(url)
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+@pytest.fixture
+def fetcher():
+    return Fetcher()
+
+
+def test_get_fetches_in_the_background(tmp_path, fetcher):
+    cache = ThumbnailCache(tmp_path, fetcher=fetcher)
+    assert cache.get(URL) is None
+    cache.wait(5)
+    data = cache.get(URL)
+    assert Image.open(io.BytesIO(data)).size == THUMBNAIL_SIZE
+    assert fetcher.urls == [URL]
+
+
+def test_prefetched_thumbnail_is_fetched_once(tmp_path, fetcher):
+    cache = ThumbnailCache(tmp_path, fetcher=fetcher)
+    cache.prefetch([URL, URL])
+    cache.wait(5)
+    cache.prefetch([URL])
+    cache.wait(5)
+    assert cache.get(URL) is not None
+    assert fetcher.urls == [URL]
+
+
+def test_disk_cache_outlives_the_process(tmp_path, fetcher):
+    cache = ThumbnailCache(tmp_path, fetcher=fetcher)
+    cache.prefetch([URL])
+    cache.wait(5)
+    restarted = ThumbnailCache(tmp_path, fetcher=fetcher)
+    assert restarted.get(URL) == cache.get(URL)
+    assert fetcher.urls == [URL]
+
+
+def test_failed_fetch_is_not_retried_at_once(tmp_path):
+    fetcher = Fetcher(error=OSError("unreachable"))
+    cache = ThumbnailCache(tmp_path, fetcher=fetcher)
+    cache.prefetch([URL])
+    cache.wait(5)
+    assert cache.get(URL) is None
+    cache.wait(5)
+    assert fetcher.urls == [URL]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path, fetcher):
+    cache = ThumbnailCache(tmp_path, fetcher=fetcher, memory_items=1)
+    cache.prefetch([URL])
+    cache.wait(5)
+    one_file = sum(path.stat().st_size for path in tmp_path.glob('*.jpg'))
+    cache.disk_limit = 2 * one_file
+    urls = [f'https://example.com/{n}.jpg' for n in range(4)]
+    for url in urls:
+        time.sleep(0.02)  # file times only tick every few milliseconds
+        cache.prefetch([url])
+        cache.wait(5)
+    assert sum(path.stat().st_size for path in tmp_path.glob('*.jpg')) <= cache.disk_limit
+    assert len(list(tmp_path.glob('*.jpg'))) == 2
+    # The newest ones are kept
+    assert ThumbnailCache(tmp_path, fetcher=Fetcher(error=OSError())).get(urls[-1]) is not None